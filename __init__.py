@@ -3,3 +3,7 @@
 from .lexer import Lexer
 from .parser import Parser
 from .interpreter import Interpreter
+from .expression import compile_expression
+from .sweep import run_sweep
+from .arena import Arena
+from .session import Session
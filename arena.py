@@ -0,0 +1,210 @@
+# mathscript/arena.py
+
+from array import array
+
+from .lexer import Token
+from .parser import ASTNode
+
+# The low two bits of an operand say what the rest of it holds
+NODE, CONSTANT, LIST, NONE = range(4)
+
+
+class Arena:
+    """
+    A program stored as parallel arrays instead of one object per node.
+
+    Node i is an instance of classes[kinds[i]]; its fields, in the class's
+    `fields` order, are operands[starts[i]:starts[i] + len(fields)]. Each
+    operand is (payload << 2) | tag:
+    - NODE: payload is the index of a child node;
+    - CONSTANT: payload indexes `constants`, which holds every distinct
+      number, name, string and operator token once;
+    - LIST: payload indexes `items`, where the list's length is followed
+      by its encoded elements;
+    - NONE: the field is None.
+
+    Children are stored before their parents; `roots` holds the indices of
+    the top-level statements and `lines` each node's source line (0 when
+    it has none). Operands are 32-bit, which limits an arena
+    to 2**29 nodes.
+
+    Statements can be added from any iterable, e.g. Parser.statements(),
+    so a large script never exists as node objects all at once. to_ast()
+    and node() rebuild node objects for the interpreter and compilers;
+    view() reads fields in place.
+    """
+
+    def __init__(self, statements=()):
+        self.classes = []
+        self.class_codes = {}
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.lines = array('I')
+        self.operands = array('i')
+        self.items = array('i')
+        self.constants = []
+        self.constant_codes = {}
+        self.roots = array('I')
+        self.extend(statements)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def extend(self, statements):
+        for stmt in statements:
+            self.roots.append(self.add(stmt))
+
+    def add(self, node):
+        """Store `node` and everything below it; return its index."""
+        cls = type(node)
+        code = self.class_codes.get(cls)
+        if code is None:
+            code = self.class_codes[cls] = len(self.classes)
+            self.classes.append(cls)
+        operands = [self.encode(value) for value in node.field_values()]
+        index = len(self.kinds)
+        self.kinds.append(code)
+        self.starts.append(len(self.operands))
+        self.lines.append(getattr(node, 'line', None) or 0)
+        self.operands.extend(operands)
+        return index
+
+    def encode(self, value):
+        if isinstance(value, ASTNode):
+            return self.add(value) << 2 | NODE
+        if value is None:
+            return NONE
+        if isinstance(value, list):
+            encoded = [self.encode(item) for item in value]
+            start = len(self.items)
+            self.items.append(len(encoded))
+            self.items.extend(encoded)
+            return start << 2 | LIST
+        return self.constant(value) << 2 | CONSTANT
+
+    def constant(self, value):
+        if isinstance(value, Token):
+            key = (Token, value.type, value.value)
+        elif isinstance(value, float):
+            # 0.0 and -0.0 are equal but must stay apart
+            key = (float, value.hex())
+        else:
+            key = (type(value), value)
+        try:
+            code = self.constant_codes.get(key)
+        except TypeError:
+            # Unhashable; stored without sharing
+            self.constants.append(value)
+            return len(self.constants) - 1
+        if code is None:
+            code = self.constant_codes[key] = len(self.constants)
+            self.constants.append(value)
+        return code
+
+    def kind(self, index):
+        """The node class of node `index`."""
+        return self.classes[self.kinds[index]]
+
+    def operand(self, index, name):
+        cls = self.classes[self.kinds[index]]
+        return self.operands[self.starts[index] + cls.fields.index(name)]
+
+    def decode(self, operand, node):
+        payload, tag = operand >> 2, operand & 3
+        if tag == NODE:
+            return node(payload)
+        if tag == CONSTANT:
+            return self.constants[payload]
+        if tag == LIST:
+            count = self.items[payload]
+            return [self.decode(item, node) for item in self.items[payload + 1:payload + 1 + count]]
+        return None
+
+    def children(self, index):
+        """Indices of the nodes directly below node `index`, in field order."""
+        cls = self.classes[self.kinds[index]]
+        start = self.starts[index]
+        found = []
+        pending = list(self.operands[start:start + len(cls.fields)])
+        pending.reverse()
+        while pending:
+            operand = pending.pop()
+            payload, tag = operand >> 2, operand & 3
+            if tag == NODE:
+                found.append(payload)
+            elif tag == LIST:
+                count = self.items[payload]
+                pending.extend(reversed(self.items[payload + 1:payload + 1 + count]))
+        return found
+
+    def view(self, index):
+        return NodeView(self, index)
+
+    def node(self, index):
+        """Rebuild node `index` and everything below it as node objects."""
+        cls = self.classes[self.kinds[index]]
+        start = self.starts[index]
+        # Set the fields directly: some __init__ methods convert their
+        # arguments (NumberNode, StringNode)
+        node = cls.__new__(cls)
+        operands = self.operands
+        for offset, name in enumerate(cls.fields):
+            operand = operands[start + offset]
+            tag = operand & 3
+            if tag == NODE:
+                value = self.node(operand >> 2)
+            elif tag == CONSTANT:
+                value = self.constants[operand >> 2]
+            else:
+                value = self.decode(operand, self.node)
+            setattr(node, name, value)
+        if self.lines[index]:
+            node.line = self.lines[index]
+        return node
+
+    def to_ast(self):
+        """The top-level statements as node objects, for Interpreter.load()."""
+        return [self.node(index) for index in self.roots]
+
+    def nbytes(self):
+        """Bytes held by the arrays (not counting the shared constants)."""
+        return sum(buffer.itemsize * len(buffer)
+                   for buffer in (self.kinds, self.starts, self.lines, self.operands, self.items, self.roots))
+
+
+class NodeView:
+    """
+    A node of an Arena read in place: `kind` is its node class, and its
+    fields are attributes as on the node object, child nodes being views.
+    """
+
+    __slots__ = ('arena', 'index')
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+    @property
+    def kind(self):
+        return self.arena.kind(self.index)
+
+    @property
+    def line(self):
+        return self.arena.lines[self.index] or None
+
+    def __getattr__(self, name):
+        arena = self.arena
+        try:
+            operand = arena.operand(self.index, name)
+        except ValueError:
+            raise AttributeError(f"'{arena.kind(self.index).__name__}' node has no field '{name}'") from None
+        return arena.decode(operand, arena.view)
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and other.arena is self.arena and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.arena), self.index))
+
+    def __repr__(self):
+        return f'<{self.kind.__name__} {self.index}>'
@@ -0,0 +1,205 @@
+# mathscript/arrays.py
+
+import operator
+
+try:
+    import numpy as np
+except ImportError:  # arrays are unavailable, everything else still works
+    np = None
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError('MathScript arrays require NumPy (pip install numpy)')
+
+
+class Array:
+    """
+    A growable array of float64 values backed by a contiguous NumPy buffer.
+
+    The buffer is over-allocated so append() is amortized O(1); `values`
+    is a view of the used part. Arithmetic and comparison operators apply
+    element-wise with NumPy broadcasting, comparisons yielding 1.0/0.0.
+
+    As in NumPy, an array of several elements has no truth value: `if a`
+    or `a and b` raises ValueError, and scripts say a.any() or a.all().
+    An empty array is false, a one-element array is true if its element
+    is.
+    """
+
+    __slots__ = ('buffer', 'length')
+    __hash__ = None
+
+    def __init__(self, values=()):
+        require_numpy()
+        try:
+            buffer = np.array(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise TypeError('Array elements must be numbers')
+        if buffer.ndim != 1:
+            raise TypeError('Array elements must be numbers')
+        self.buffer = buffer
+        self.length = len(buffer)
+
+    @classmethod
+    def wrap(cls, values):
+        """Adopt a 1-d float64 ndarray without copying it."""
+        array = cls.__new__(cls)
+        array.buffer = values
+        array.length = len(values)
+        return array
+
+    @property
+    def values(self):
+        return self.buffer[:self.length]
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        if self.length > 1:
+            raise ValueError('The truth value of an array with more than one element is ambiguous; '
+                             'use a.any() or a.all()')
+        return self.length == 1 and bool(self.buffer[0])
+
+    def __iter__(self):
+        return iter(self.values.tolist())
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Array.wrap(self.values[slice_indices(key)].copy())
+        index = to_index(key)
+        if not -self.length <= index < self.length:
+            raise IndexError('Array index out of range')
+        return float(self.buffer[index % self.length])
+
+    def append(self, value):
+        if self.length == len(self.buffer):
+            grown = np.empty(max(8, 2 * self.length), dtype=np.float64)
+            grown[:self.length] = self.values
+            self.buffer = grown
+        try:
+            self.buffer[self.length] = value
+        except (TypeError, ValueError):
+            raise TypeError('Array elements must be numbers')
+        self.length += 1
+
+    def extend(self, values):
+        try:
+            values = np.asarray(values, dtype=np.float64).ravel()
+        except (TypeError, ValueError):
+            raise TypeError('Array elements must be numbers')
+        end = self.length + len(values)
+        if end > len(self.buffer):
+            grown = np.empty(max(8, 2 * self.length, end), dtype=np.float64)
+            grown[:self.length] = self.values
+            self.buffer = grown
+        self.buffer[self.length:end] = values
+        self.length = end
+
+    def copy(self):
+        return Array.wrap(self.values.copy())
+
+    def sum(self):
+        return float(self.values.sum())
+
+    def any(self):
+        return bool(self.values.any())
+
+    def all(self):
+        return bool(self.values.all())
+
+    def tolist(self):
+        return self.values.tolist()
+
+    def __repr__(self):
+        return repr(self.values.tolist())
+
+    def __str__(self):
+        return str(self.values.tolist())
+
+    def __neg__(self):
+        return Array.wrap(-self.values)
+
+    def __pos__(self):
+        return Array.wrap(self.values.copy())
+
+
+def operand(value):
+    if isinstance(value, Array):
+        return value.values
+    if isinstance(value, (int, float)):
+        return value
+    return None
+
+
+def elementwise(func, reverse=False):
+    def method(self, other):
+        other = operand(other)
+        if other is None:
+            return NotImplemented
+        left, right = (other, self.values) if reverse else (self.values, other)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            result = func(left, right)
+        return Array.wrap(np.asarray(result, dtype=np.float64))
+    return method
+
+
+for _name, _func in [('add', operator.add), ('sub', operator.sub), ('mul', operator.mul),
+                     ('truediv', operator.truediv), ('pow', operator.pow), ('mod', operator.mod)]:
+    setattr(Array, f'__{_name}__', elementwise(_func))
+    setattr(Array, f'__r{_name}__', elementwise(_func, reverse=True))
+
+for _name, _func in [('eq', operator.eq), ('ne', operator.ne), ('lt', operator.lt),
+                     ('le', operator.le), ('gt', operator.gt), ('ge', operator.ge)]:
+    setattr(Array, f'__{_name}__', elementwise(_func))
+
+
+def to_index(value):
+    """Convert a MathScript number used as an index to an int."""
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise IndexError(f'Index {value} is not an integer')
+        return int(value)
+    if isinstance(value, int):
+        return value
+    raise TypeError(f"Index must be a number, not '{type(value).__name__}'")
+
+
+def slice_indices(key):
+    return slice(None if key.start is None else to_index(key.start),
+                 None if key.stop is None else to_index(key.stop))
+
+
+def get_item(target, key):
+    """Evaluate target[key] for arrays, strings and other sequences."""
+    if isinstance(target, Array):
+        return target[key]
+    if isinstance(key, slice):
+        return target[slice_indices(key)]
+    return target[to_index(key)]
+
+
+def has_items(target):
+    """Whether a for loop over target runs at least once; unlike bool(),
+    this does not raise for arrays of several elements."""
+    try:
+        return len(target) > 0
+    except TypeError:
+        # Not sized: leave it to the loop to iterate (or to fail)
+        return True
+
+
+# The methods scripts may call, by receiver type; anything else on the
+# Python object stays out of reach
+METHODS = {
+    Array: frozenset({'append', 'extend', 'copy', 'sum', 'any', 'all'}),
+    str: frozenset({'upper', 'lower', 'strip', 'replace', 'startswith', 'endswith', 'find', 'count'}),
+}
+
+
+def call_method(target, name, args):
+    """Evaluate target.name(args) for the methods in METHODS."""
+    if name not in METHODS.get(type(target), ()):
+        raise AttributeError(f"'{type(target).__name__}' has no method '{name}'")
+    return getattr(target, name)(*args)
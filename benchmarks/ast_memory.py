@@ -0,0 +1,78 @@
+# benchmarks/ast_memory.py
+#
+# Memory and collector cost of a large parsed program, held as node
+# objects and as an Arena:
+#
+#     python benchmarks/ast_memory.py [--nodes N]
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from mathscript.lexer import Lexer
+from mathscript.parser import Parser
+from mathscript.arena import Arena
+
+# 67 nodes per block; {i} makes every copy's names unique
+BLOCK = '''\
+function f{i}(a, b, c) {{
+    total = a * b + c / 2.5 - (a - b) * {i}
+    if total > 10 and c != 0 {{
+        total = total - c * 3
+    }} else {{
+        total = total + abs(c) * 0.5
+    }}
+    for k in range(0, 3) {{
+        total = total + k * (a + 1)
+    }}
+    return total
+}}
+x{i} = f{i}(1.5, {i}, -2) + [1, 2, 3][1] * 4
+label{i} = "row {i}"
+'''
+NODES_PER_BLOCK = 67
+
+
+def generate(nodes):
+    """MathScript source of about `nodes` AST nodes."""
+    return ''.join(BLOCK.format(i=i) for i in range(-(-nodes // NODES_PER_BLOCK)))
+
+
+def measure(build):
+    """(result, bytes it holds, seconds of a full collection while it is alive)."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    gc.collect()
+    return result, size, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure AST memory.')
+    parser.add_argument('--nodes', type=int, default=1000000, help='approximate AST size')
+    args = parser.parse_args(argv)
+
+    code = generate(args.nodes)
+    ast, ast_size, ast_gc = measure(lambda: Parser(Lexer(code).stream()).parse())
+    del ast
+    arena, arena_size, arena_gc = measure(lambda: Arena(Parser(Lexer(code).stream()).statements()))
+    start = time.perf_counter()
+    arena.to_ast()
+    rebuild = time.perf_counter() - start
+
+    print(f'source:  {len(code) / 2**20:.1f} MB, {len(arena)} nodes')
+    print(f'objects: {ast_size / 2**20:7.1f} MB, {ast_size / len(arena):5.1f} B/node, gc.collect() {ast_gc:.3f} s')
+    print(f'arena:   {arena_size / 2**20:7.1f} MB, {arena_size / len(arena):5.1f} B/node, gc.collect() {arena_gc:.3f} s')
+    print(f'rebuilding the nodes from the arena: {rebuild:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# benchmarks/lexer.py
+#
+# Lexer throughput on a generated multi-megabyte script:
+#
+#     python benchmarks/lexer.py [--size MB] [--repeat N]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from mathscript.lexer import Lexer
+
+# One block of typical generated code; {i} makes every copy's names unique
+BLOCK = '''\
+# block {i}
+function model_{i}(x, weights, bias) {{
+    total = bias  # running sum
+    for k in range(0, len(weights)) {{
+        total = total + weights[k] * x ^ k
+    }}
+    if total >= 1000 and not (total == 0) {{
+        return total % 7.25
+    }} else {{
+        if total < 0 or total != total {{
+            return -total
+        }}
+    }}
+    return total / {i}.5
+}}
+series_{i} = ∑(n=1, 100, 1 / (n * n))
+values_{i} = [1, 2.5, 3, 0.75, 1 > 0, 1 < 0]
+label_{i} = "label {i}" + " (generated)"
+print("model", model_{i}(0.5, values_{i}, 0.125), series_{i})
+'''
+
+
+def generate(size):
+    """MathScript source of at least `size` bytes."""
+    parts = []
+    length = 0
+    i = 0
+    while length < size:
+        block = BLOCK.format(i=i)
+        parts.append(block)
+        length += len(block)
+        i += 1
+    return ''.join(parts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure lexer throughput.')
+    parser.add_argument('--size', type=float, default=4, help='script size in megabytes')
+    parser.add_argument('--repeat', type=int, default=5, help='runs; the fastest is reported')
+    args = parser.parse_args(argv)
+
+    code = generate(int(args.size * 1024 * 1024))
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        tokens = Lexer(code).tokenize()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    megabytes = len(code.encode('utf-8')) / (1024 * 1024)
+    print(f'source:  {megabytes:.2f} MB, {code.count(chr(10))} lines, {len(tokens)} tokens')
+    print(f'time:    {best:.3f} s (best of {args.repeat})')
+    print(f'rate:    {len(tokens) / best:,.0f} tokens/s, {megabytes / best:.2f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
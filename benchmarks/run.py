@@ -0,0 +1,266 @@
+# benchmarks/run.py
+#
+# The benchmark suite: lexes, parses and runs representative workloads,
+# reporting per-phase time, throughput and peak memory.
+#
+#     python benchmarks/run.py                          # everything
+#     python benchmarks/run.py -w recursion --modes vm  # a subset
+#     python benchmarks/run.py --output base.json       # save results
+#     python benchmarks/run.py --baseline base.json     # compare; exit 1 on regressions
+
+import argparse
+import contextlib
+import gc
+import glob
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from mathscript.lexer import Lexer
+from mathscript.parser import Parser
+from mathscript.interpreter import Interpreter
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+
+# Slowdown (fraction of the baseline) above which a result is a regression
+DEFAULT_THRESHOLD = 0.10
+
+# Below these a phase is all noise, so its changes are not regressions
+MIN_COMPARED = {'time': 0.01, 'peak_memory': 1 << 16}
+
+# Each workload takes the scale factor and returns (source, work, unit):
+# the run phase's throughput is `work` units per second
+WORKLOADS = {}
+
+
+def workload(func):
+    WORKLOADS[func.__name__] = func
+    return func
+
+
+@workload
+def examples(scale):
+    """The programs in examples/, run one after another `scale` times."""
+    sources = []
+    for path in sorted(glob.glob(os.path.join(EXAMPLES_DIR, '*.ms'))):
+        with open(path, encoding='utf-8') as f:
+            sources.append(f.read())
+    return '\n'.join(sources * scale), len(sources) * scale, 'programs'
+
+
+@workload
+def deep_expressions(scale):
+    """Generated assignments of randomly nested expressions, 8 levels deep."""
+    rng = random.Random(0)
+
+    def expression(depth):
+        if depth == 0:
+            return rng.choice(('x', 'y', 'z[1]', '1.5', '2'))
+        op = rng.choice((' + ', ' - ', ' * ', ' < ', ' and '))
+        return f'({expression(depth - 1)}{op}{expression(depth - 1)})'
+
+    count = 200 * scale
+    lines = ['x = 0.5', 'y = 3', 'z = [1, 2, 3]']
+    lines.extend(f'v{i} = {expression(8)} / 3' for i in range(count))
+    return '\n'.join(lines) + '\n', count, 'expressions'
+
+
+@workload
+def numeric_loop(scale):
+    """Tight while and for loops over scalar arithmetic."""
+    n = 20000 * scale
+    source = f'''\
+s = 0
+i = 0
+while i < {n} {{
+    s = s + i * i % 7 - i / 3
+    i = i + 1
+}}
+t = 0
+for j in range(0, {n}) {{
+    if j % 2 == 0 {{
+        t = t + j ^ 0.5
+    }} else {{
+        t = t - 1
+    }}
+}}
+'''
+    return source, 2 * n, 'iterations'
+
+
+@workload
+def recursion(scale):
+    """Naive recursive Fibonacci: function calls and returns."""
+    source = f'''\
+function fib(n) {{
+    if n < 2 {{
+        return n
+    }}
+    return fib(n - 1) + fib(n - 2)
+}}
+for k in range(0, {scale}) {{
+    r = fib(18)
+}}
+'''
+    # fib(18) makes 2 * fib(19) - 1 calls
+    return source, 8361 * scale, 'calls'
+
+
+@workload
+def arrays(scale):
+    """Building, indexing and transforming large arrays."""
+    n = 50000 * scale
+    source = f'''\
+x = []
+for i in range(0, {n}) {{
+    x.append(i / {n})
+}}
+y = []
+for i in range(0, {n}) {{
+    y.append(x[i] * 2 + 1)
+}}
+z = x * y + 3
+total = 0
+for i in range(0, {n}) {{
+    total = total + z[i] - y[i]
+}}
+'''
+    return source, 3 * n, 'elements'
+
+
+def measure(func, repeat):
+    """(best time of `repeat` calls, peak traced memory of one more, last result)."""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # Tracing slows everything down, so memory gets a run of its own
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+
+def run_program(ast, mode):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        Interpreter(mode).interpret(ast)
+
+
+def run_workload(name, scale, modes, repeat):
+    """Benchmark every phase of one workload; returns {phase: result}."""
+    source, work, unit = WORKLOADS[name](scale)
+    results = {}
+
+    lex_time, lex_peak, tokens = measure(lambda: Lexer(source).tokenize(), repeat)
+    results['lex'] = {'time': lex_time, 'throughput': len(tokens) / lex_time, 'unit': 'tokens',
+                      'peak_memory': lex_peak}
+
+    parse_time, parse_peak, ast = measure(lambda: Parser(tokens).parse(), repeat)
+    results['parse'] = {'time': parse_time, 'throughput': len(tokens) / parse_time, 'unit': 'tokens',
+                        'peak_memory': parse_peak}
+    del tokens
+
+    for mode in modes:
+        run_time, run_peak, _ = measure(lambda: run_program(ast, mode), repeat)
+        results[f'run:{mode}'] = {'time': run_time, 'throughput': work / run_time, 'unit': unit,
+                                  'peak_memory': run_peak}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare time and peak memory against a baseline's; returns the list of
+    (key, metric, old, new) that grew by more than `threshold`. Metrics
+    under MIN_COMPARED in both runs are skipped.
+    """
+    regressions = []
+    for key, result in results.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        for metric in ('time', 'peak_memory'):
+            if max(old[metric], result[metric]) < MIN_COMPARED[metric]:
+                continue
+            if result[metric] > old[metric] * (1 + threshold):
+                regressions.append((key, metric, old[metric], result[metric]))
+    return regressions
+
+
+def print_result(key, result, baseline):
+    line = (f'{key:<32} {result["time"]:9.4f} s {result["throughput"]:>14,.0f} {result["unit"]}/s'
+            f'  {result["peak_memory"] / 2**20:9.2f} MB')
+    old = baseline.get(key)
+    if old:
+        line += f'  time {change(old["time"], result["time"])}, memory {change(old["peak_memory"], result["peak_memory"])}'
+    print(line, flush=True)
+
+
+def change(old, new):
+    if not old:
+        return 'n/a'
+    return f'{(new - old) / old:+.1%}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the MathScript benchmark suite.')
+    parser.add_argument('-w', '--workload', action='append', choices=sorted(WORKLOADS),
+                        help='workload to run (repeatable; default: all)')
+    parser.add_argument('--modes', default=','.join(Interpreter.MODES),
+                        help='comma-separated interpreter modes to run (default: all)')
+    parser.add_argument('--scale', type=int, default=1, help='workload size multiplier')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per phase; the fastest counts')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='regression threshold as a fraction (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    modes = [mode for mode in args.modes.split(',') if mode]
+    for mode in modes:
+        if mode not in Interpreter.MODES:
+            parser.error(f"unknown mode '{mode}'")
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    for name in args.workload or WORKLOADS:
+        for phase, result in run_workload(name, args.scale, modes, args.repeat).items():
+            key = f'{name}/{phase}'
+            results[key] = result
+            print_result(key, result, baseline)
+
+    if args.output:
+        report = {
+            'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                     'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'scale': args.scale, 'repeat': args.repeat},
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        regressions = compare(results, baseline, args.threshold)
+        for key, metric, old, new in regressions:
+            print(f'REGRESSION {key} {metric}: {old:.6g} -> {new:.6g} ({change(old, new)})')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions above {args.threshold:.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,613 @@
+# mathscript/bytecode.py
+
+import marshal
+from array import array
+
+from .parser import *
+from .interpreter import Context, Function
+from .compiler import BINARY_OPERATORS, UNARY_OPERATORS
+from .memo import MISSING
+from .vectorize import run_plan
+from .series import SeriesPlanner, evaluate_series
+from .integrate import integral_plan
+from .arrays import Array, get_item, call_method
+
+# Bump whenever the instruction set or the serialized layout changes.
+BYTECODE_VERSION = 9
+
+# Opcodes. Every instruction is one opcode byte plus one integer operand.
+LOAD_CONST = 1       # push consts[arg]
+LOAD_NAME = 2        # push variable names[arg]
+STORE_NAME = 3       # pop into variable names[arg]
+POP_TOP = 4
+BINARY_OP = 5        # pop right, left; push BINARY_OPS[arg](left, right)
+UNARY_OP = 6         # pop value; push UNARY_OPS[arg](value)
+JUMP = 7             # pc = arg
+POP_JUMP_IF_FALSE = 8
+GET_ITER = 9         # replace the iterable on top of the stack by an iterator
+FOR_ITER = 10        # push next item, or pop the iterator and jump to arg
+MAKE_FUNCTION = 11   # bind functions[arg] to the current context
+LOAD_FUNCTION = 12   # arg = name << 8 | argc; push the callee
+CALL_FUNCTION = 13   # pop arg values and the callee; push the result
+RETURN_VALUE = 14
+RETURN_NONE = 15
+TAIL_CALL = 16       # like CALL_FUNCTION, but reuses the current frame
+BUILD_LIST = 17      # pop arg values; push an Array of them
+BINARY_SUBSCR = 18   # pop index, target; push target[index]
+BUILD_SLICE = 19     # arg bit 0: start present, bit 1: stop present; push a slice
+CALL_METHOD = 20     # arg = name << 8 | argc; pop args and target; push the result
+VECTOR_FOR = 21      # run the loop over the iterable on top as plan consts[arg];
+                     # on success replace the iterable by an empty one
+SERIES = 22          # arg = function << 1 | product; pop plan, end, start;
+                     # push ∑/∏ of functions[function] over the index range
+INTEGRAL = 23        # pop plan, tol, upper, lower; push ∫ of functions[arg]
+PARALLEL_FOR = 24    # pop the iterable, run parallel loop arg on the workers
+
+OPNAMES = {value: name for name, value in list(globals().items())
+           if name.isupper() and isinstance(value, int) and name not in ('BYTECODE_VERSION',)}
+
+BINARY_OPS = tuple(BINARY_OPERATORS)
+UNARY_OPS = tuple(UNARY_OPERATORS)
+BINARY_FUNCS = tuple(BINARY_OPERATORS.values())
+UNARY_FUNCS = tuple(UNARY_OPERATORS.values())
+
+MAX_ARGS = 255
+
+# Default limit on the number of nested (non-tail) MathScript calls
+MAX_CALL_DEPTH = 1000000
+
+
+class CodeObject:
+    """
+    A compiled MathScript program or function body.
+
+    Instructions live in two parallel arrays: `ops` holds opcode bytes and
+    `args` the integer operand of each instruction. Constants, names and
+    nested function bodies are referenced by index.
+    """
+
+    def __init__(self, name='<module>', param_names=(), memoize=False):
+        self.name = name
+        self.param_names = tuple(param_names)
+        self.memoize = memoize
+        self.ops = array('B')
+        self.args = array('i')
+        self.consts = []
+        self.names = []
+        self.functions = []
+        # Indices into consts and names, so emitting an instruction does
+        # not scan them
+        self.const_indices = {}
+        self.name_indices = {}
+        # Statements of a function's body, for the Function values made
+        # from it (parallel for workers rebuild functions from them); not
+        # kept by dumps()
+        self.body = None
+
+    def emit(self, op, arg=0):
+        self.ops.append(op)
+        self.args.append(arg)
+        return len(self.ops) - 1
+
+    def patch(self, index, arg):
+        self.args[index] = arg
+
+    def const(self, value):
+        # Equal constants of the same type share an entry; 1 and True do not
+        key = (type(value), value)
+        try:
+            return self.const_indices[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable, e.g. a loop plan: each gets its own entry
+            key = None
+        self.consts.append(value)
+        if key is not None:
+            self.const_indices[key] = len(self.consts) - 1
+        return len(self.consts) - 1
+
+    def name_index(self, name):
+        try:
+            return self.name_indices[name]
+        except KeyError:
+            self.names.append(name)
+            self.name_indices[name] = len(self.names) - 1
+            return len(self.names) - 1
+
+    def to_tuple(self):
+        return (
+            self.name,
+            self.param_names,
+            self.memoize,
+            self.ops.tobytes(),
+            self.args.tobytes(),
+            tuple(self.consts),
+            tuple(self.names),
+            tuple(func.to_tuple() for func in self.functions),
+        )
+
+    @classmethod
+    def from_tuple(cls, data):
+        name, param_names, memoize, ops, args, consts, names, functions = data
+        code = cls(name, param_names, memoize)
+        code.ops.frombytes(ops)
+        code.args.frombytes(args)
+        code.consts = list(consts)
+        code.names = list(names)
+        for index, value in enumerate(code.consts):
+            try:
+                code.const_indices.setdefault((type(value), value), index)
+            except TypeError:
+                pass
+        code.name_indices = {name: index for index, name in enumerate(code.names)}
+        code.functions = [cls.from_tuple(func) for func in functions]
+        return code
+
+    def dumps(self):
+        return marshal.dumps((BYTECODE_VERSION, self.to_tuple()))
+
+    @classmethod
+    def loads(cls, data):
+        version, code = marshal.loads(data)
+        if version != BYTECODE_VERSION:
+            raise ValueError(f'Unsupported bytecode version {version}')
+        return cls.from_tuple(code)
+
+    def disassemble(self):
+        lines = [f'code {self.name}({", ".join(self.param_names)}){" memoized" if self.memoize else ""}']
+        for pc, (op, arg) in enumerate(zip(self.ops, self.args)):
+            detail = ''
+            if op == LOAD_CONST:
+                detail = repr(self.consts[arg])
+            elif op in (LOAD_NAME, STORE_NAME):
+                detail = self.names[arg]
+            elif op == BINARY_OP:
+                detail = BINARY_OPS[arg]
+            elif op == UNARY_OP:
+                detail = UNARY_OPS[arg]
+            elif op == MAKE_FUNCTION:
+                detail = self.functions[arg].name
+            elif op == VECTOR_FOR:
+                detail = f'plan for {self.consts[arg][0]}'
+            elif op == SERIES:
+                detail = self.functions[arg >> 1].name
+            elif op == INTEGRAL:
+                detail = self.functions[arg].name
+            elif op == PARALLEL_FOR:
+                detail = f'loop {arg}'
+            elif op in (LOAD_FUNCTION, CALL_METHOD):
+                detail = f'{self.names[arg >> 8]} argc={arg & 0xFF}'
+            lines.append(f'{pc:5d} {OPNAMES[op]:<18} {arg:<6d} {detail}'.rstrip())
+        for func in self.functions:
+            lines.append('')
+            lines.append(func.disassemble())
+        return '\n'.join(lines)
+
+
+class BytecodeCompiler:
+    def __init__(self, memo_nodes=(), vector_plans=None, parallel_loops=None):
+        # FuncDefNodes whose calls the VM should memoize
+        self.memo_nodes = memo_nodes
+        # {ForNode: plan} of loops the VM may run vectorized
+        self.vector_plans = vector_plans or {}
+        # {ParallelForNode: index} of the loops the interpreter's runner runs
+        self.parallel_loops = parallel_loops or {}
+
+    def compile(self, ast, name='<module>', param_names=()):
+        code = CodeObject(name, param_names)
+        self.compile_block(code, ast)
+        code.emit(RETURN_NONE)
+        return code
+
+    def compile_block(self, code, statements):
+        for stmt in statements:
+            self.compile_statement(code, stmt)
+
+    def compile_statement(self, code, node):
+        method = getattr(self, f'compile_{type(node).__name__}', None)
+        if method is None:
+            raise Exception(f'No visit_{type(node).__name__} method')
+        if method(code, node):
+            # Expression statements leave their value on the stack
+            code.emit(POP_TOP)
+
+    def compile_expr(self, code, node):
+        method = getattr(self, f'compile_{type(node).__name__}', None)
+        if method is None or not method(code, node):
+            raise Exception(f'Cannot use {type(node).__name__} as an expression')
+
+    # Statements return False, expressions return True.
+
+    def compile_NumberNode(self, code, node):
+        code.emit(LOAD_CONST, code.const(node.value))
+        return True
+
+    def compile_StringNode(self, code, node):
+        code.emit(LOAD_CONST, code.const(node.value))
+        return True
+
+    def compile_VarAccessNode(self, code, node):
+        code.emit(LOAD_NAME, code.name_index(node.var_name))
+        return True
+
+    def compile_VarAssignNode(self, code, node):
+        self.compile_expr(code, node.expr)
+        code.emit(STORE_NAME, code.name_index(node.var_name))
+        return False
+
+    def compile_BinOpNode(self, code, node):
+        op = node.op_token.value
+        if op not in BINARY_OPERATORS:
+            raise Exception(f'Unknown operator {op}')
+        self.compile_expr(code, node.left_node)
+        self.compile_expr(code, node.right_node)
+        code.emit(BINARY_OP, BINARY_OPS.index(op))
+        return True
+
+    def compile_UnaryOpNode(self, code, node):
+        op = node.op_token.value
+        if op not in UNARY_OPERATORS:
+            raise Exception(f'Unknown operator {op}')
+        self.compile_expr(code, node.node)
+        code.emit(UNARY_OP, UNARY_OPS.index(op))
+        return True
+
+    def compile_IfNode(self, code, node):
+        self.compile_expr(code, node.condition)
+        jump_else = code.emit(POP_JUMP_IF_FALSE)
+        self.compile_block(code, node.body)
+        if node.else_body:
+            jump_end = code.emit(JUMP)
+            code.patch(jump_else, len(code.ops))
+            self.compile_block(code, node.else_body)
+            code.patch(jump_end, len(code.ops))
+        else:
+            code.patch(jump_else, len(code.ops))
+        return False
+
+    def compile_WhileNode(self, code, node):
+        start = len(code.ops)
+        self.compile_expr(code, node.condition)
+        jump_end = code.emit(POP_JUMP_IF_FALSE)
+        self.compile_block(code, node.body)
+        code.emit(JUMP, start)
+        code.patch(jump_end, len(code.ops))
+        return False
+
+    def compile_ForNode(self, code, node):
+        self.compile_expr(code, node.iterable)
+        plan = self.vector_plans.get(node)
+        if plan is not None:
+            code.emit(VECTOR_FOR, code.const(plan))
+        code.emit(GET_ITER)
+        start = code.emit(FOR_ITER)
+        code.emit(STORE_NAME, code.name_index(node.var_name))
+        self.compile_block(code, node.body)
+        code.emit(JUMP, start)
+        code.patch(start, len(code.ops))
+        return False
+
+    def compile_ParallelForNode(self, code, node):
+        self.compile_expr(code, node.iterable)
+        code.emit(PARALLEL_FOR, self.parallel_loops[node])
+        return False
+
+    def compile_FuncDefNode(self, code, node):
+        func_code = self.compile(node.body, node.func_name, node.param_names)
+        func_code.memoize = node in self.memo_nodes
+        func_code.body = node.body
+        code.functions.append(func_code)
+        code.emit(MAKE_FUNCTION, len(code.functions) - 1)
+        code.emit(STORE_NAME, code.name_index(node.func_name))
+        return False
+
+    def compile_ListNode(self, code, node):
+        for element in node.elements:
+            self.compile_expr(code, element)
+        code.emit(BUILD_LIST, len(node.elements))
+        return True
+
+    def compile_IndexNode(self, code, node):
+        self.compile_expr(code, node.target)
+        index = node.index
+        if isinstance(index, SliceNode):
+            flags = 0
+            if index.start is not None:
+                self.compile_expr(code, index.start)
+                flags |= 1
+            if index.stop is not None:
+                self.compile_expr(code, index.stop)
+                flags |= 2
+            code.emit(BUILD_SLICE, flags)
+        else:
+            self.compile_expr(code, index)
+        code.emit(BINARY_SUBSCR)
+        return True
+
+    def compile_MethodCallNode(self, code, node):
+        argc = len(node.args)
+        if argc > MAX_ARGS:
+            raise SyntaxError(f"Too many arguments in call to '{node.method_name}'")
+        self.compile_expr(code, node.target)
+        for arg in node.args:
+            self.compile_expr(code, arg)
+        code.emit(CALL_METHOD, code.name_index(node.method_name) << 8 | argc)
+        return True
+
+    def compile_SeriesNode(self, code, node):
+        product = isinstance(node, ProductNode)
+        self.compile_expr(code, node.start)
+        self.compile_expr(code, node.end)
+        code.emit(LOAD_CONST, code.const(SeriesPlanner().plan(node)))
+        body = self.compile([ReturnNode(node.body)], '∏' if product else '∑', [node.var_name])
+        code.functions.append(body)
+        code.emit(SERIES, (len(code.functions) - 1) << 1 | product)
+        return True
+
+    compile_SumNode = compile_ProductNode = compile_SeriesNode
+
+    def compile_IntegralNode(self, code, node):
+        self.compile_expr(code, node.start)
+        self.compile_expr(code, node.end)
+        if node.tol is None:
+            code.emit(LOAD_CONST, code.const(None))
+        else:
+            self.compile_expr(code, node.tol)
+        code.emit(LOAD_CONST, code.const(integral_plan(node)))
+        code.functions.append(self.compile([ReturnNode(node.body)], '∫', [node.var_name]))
+        code.emit(INTEGRAL, len(code.functions) - 1)
+        return True
+
+    def compile_FuncCallNode(self, code, node, call_op=CALL_FUNCTION):
+        argc = len(node.args)
+        if argc > MAX_ARGS:
+            raise SyntaxError(f"Too many arguments in call to '{node.func_name}'")
+        code.emit(LOAD_FUNCTION, code.name_index(node.func_name) << 8 | argc)
+        for arg in node.args:
+            self.compile_expr(code, arg)
+        code.emit(call_op, argc)
+        return True
+
+    def compile_ReturnNode(self, code, node):
+        if isinstance(node.expr, FuncCallNode):
+            # Tail call: the callee's frame replaces ours. A builtin callee
+            # leaves its result for the RETURN_VALUE that follows.
+            self.compile_FuncCallNode(code, node.expr, TAIL_CALL)
+        else:
+            self.compile_expr(code, node.expr)
+        code.emit(RETURN_VALUE)
+        return False
+
+
+class VM:
+    """
+    Execute CodeObjects with a value stack and an explicit call stack.
+
+    MathScript function calls push a frame instead of recursing in Python,
+    so recursion depth is bounded by `max_depth` rather than the Python
+    recursion limit, and `return f(...)` reuses the caller's frame, so tail
+    recursion runs in constant space.
+    """
+
+    def __init__(self, interpreter, max_depth=MAX_CALL_DEPTH):
+        self.interpreter = interpreter
+        self.max_depth = max_depth
+
+    def lookup(self, ctx, name):
+        while ctx is not None:
+            value = ctx.variables.get(name)
+            if value is not None:
+                return value
+            ctx = ctx.parent
+        return self.interpreter.builtins.get(name)
+
+    def run(self, code, ctx):
+        """Run `code` in `ctx`; return the value of a top-level return."""
+        builtins_get = self.interpreter.builtins.get
+        max_depth = self.max_depth
+        binary_funcs = BINARY_FUNCS
+        unary_funcs = UNARY_FUNCS
+        # Jumps (loops) and calls are the steps towards the checkpoint
+        ticks = self.interpreter.ticks
+        checkpoint = self.interpreter.checkpoint
+
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        frames = []
+
+        ops = code.ops
+        args = code.args
+        consts = code.consts
+        names = code.names
+        base = 0
+        pc = 0
+
+        while True:
+            op = ops[pc]
+            arg = args[pc]
+            pc += 1
+
+            if op == LOAD_NAME:
+                name = names[arg]
+                scope = ctx
+                while scope is not None:
+                    value = scope.variables.get(name)
+                    if value is not None:
+                        break
+                    scope = scope.parent
+                else:
+                    value = builtins_get(name)
+                    if value is None:
+                        raise NameError(f"Variable '{name}' is not defined")
+                push(value)
+            elif op == LOAD_CONST:
+                push(consts[arg])
+            elif op == BINARY_OP:
+                right = pop()
+                stack[-1] = binary_funcs[arg](stack[-1], right)
+            elif op == STORE_NAME:
+                ctx.variables[names[arg]] = pop()
+            elif op == POP_JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+                if ticks is not None and next(ticks):
+                    checkpoint()
+            elif op == FOR_ITER:
+                try:
+                    push(next(stack[-1]))
+                except StopIteration:
+                    pop()
+                    pc = arg
+            elif op == LOAD_FUNCTION:
+                name = names[arg >> 8]
+                scope = ctx
+                while scope is not None:
+                    func = scope.variables.get(name)
+                    if func is not None:
+                        break
+                    scope = scope.parent
+                else:
+                    func = builtins_get(name)
+                    if func is None:
+                        raise NameError(f"Function '{name}' is not defined")
+                    push(func)
+                    continue
+                if not isinstance(func, Function):
+                    raise TypeError(f"'{name}' is not a function")
+                argc = arg & 0xFF
+                if argc != len(func.param_names):
+                    raise TypeError(f"Function '{name}' expected {len(func.param_names)} arguments but got {argc}")
+                push(func)
+            elif op == CALL_FUNCTION or op == TAIL_CALL:
+                if arg:
+                    call_args = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    call_args = ()
+                func = pop()
+                if not isinstance(func, Function):
+                    push(func(*call_args))
+                    continue
+                memo = func.memo
+                key = None
+                if memo is not None:
+                    key = memo.key(call_args)
+                    result = memo.get(key)
+                    if result is not MISSING:
+                        push(result)
+                        continue
+                if ticks is not None and next(ticks):
+                    checkpoint()
+                if op == TAIL_CALL and memo is None:
+                    # Drop iterators of loops the return jumps out of
+                    del stack[base:]
+                else:
+                    # Memoized callees always get a frame so their result
+                    # can be stored when they return
+                    if len(frames) >= max_depth:
+                        raise RecursionError(f"Maximum call depth exceeded in '{func.name}'")
+                    frames.append((code, pc, ctx, base, memo, key))
+                    base = len(stack)
+                ctx = Context(func.context)
+                ctx.variables.update(zip(func.param_names, call_args))
+                code = func.code
+                ops = code.ops
+                args = code.args
+                consts = code.consts
+                names = code.names
+                pc = 0
+            elif op == RETURN_VALUE or op == RETURN_NONE:
+                if op == RETURN_VALUE:
+                    ctx.variables['return_value'] = pop()
+                if not frames:
+                    return ctx.get('return_value') if op == RETURN_VALUE else None
+                result = ctx.get('return_value')
+                # Drop iterators of loops the return jumped out of
+                del stack[base:]
+                code, pc, ctx, base, memo, key = frames.pop()
+                if memo is not None:
+                    memo.put(key, result)
+                ops = code.ops
+                args = code.args
+                consts = code.consts
+                names = code.names
+                push(result)
+            elif op == POP_TOP:
+                pop()
+            elif op == UNARY_OP:
+                stack[-1] = unary_funcs[arg](stack[-1])
+            elif op == GET_ITER:
+                iterable = stack[-1]
+                if not hasattr(iterable, '__iter__'):
+                    raise TypeError(f"Object '{iterable}' is not iterable")
+                stack[-1] = iter(iterable)
+            elif op == VECTOR_FOR:
+                updates = run_plan(consts[arg], stack[-1], lambda name, ctx=ctx: self.lookup(ctx, name))
+                if updates is not None:
+                    ctx.variables.update(updates)
+                    stack[-1] = ()
+            elif op == SERIES:
+                plan = pop()
+                end = pop()
+                stack[-1] = self.series(code.functions[arg >> 1], arg & 1, plan, stack[-1], end, ctx)
+            elif op == PARALLEL_FOR:
+                ctx.variables.update(self.interpreter.parallel.run(
+                    arg, pop(), lambda name, ctx=ctx: self.lookup(ctx, name)))
+            elif op == INTEGRAL:
+                plan = pop()
+                tol = pop()
+                upper = pop()
+                stack[-1] = self.integral(code.functions[arg], plan, stack[-1], upper, tol, ctx)
+            elif op == BINARY_SUBSCR:
+                index = pop()
+                stack[-1] = get_item(stack[-1], index)
+            elif op == CALL_METHOD:
+                argc = arg & 0xFF
+                if argc:
+                    call_args = stack[-argc:]
+                    del stack[-argc:]
+                else:
+                    call_args = []
+                stack[-1] = call_method(stack[-1], names[arg >> 8], call_args)
+            elif op == BUILD_LIST:
+                if arg:
+                    elements = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    elements = []
+                push(Array(elements))
+            elif op == BUILD_SLICE:
+                stop = pop() if arg & 2 else None
+                start = pop() if arg & 1 else None
+                push(slice(start, stop))
+            elif op == MAKE_FUNCTION:
+                func_code = code.functions[arg]
+                memo = None
+                if func_code.memoize:
+                    memo = self.interpreter.memo_cache(func_code, func_code.name)
+                push(Function(func_code.name, func_code.param_names, func_code.body, ctx, code=func_code, memo=memo))
+            else:
+                raise RuntimeError(f'Bad opcode {op} at {pc - 1} in {code.name}')
+
+    def series(self, body, product, plan, start, end, ctx):
+        var_name = body.param_names[0]
+
+        def evaluate(i):
+            frame = Context(ctx)
+            frame.variables[var_name] = i
+            return self.run(body, frame)
+        return evaluate_series(product, plan, start, end, lambda name: self.lookup(ctx, name), evaluate)
+
+    def integral(self, body, plan, lower, upper, tol, ctx):
+        var_name = body.param_names[0]
+
+        def evaluate(x):
+            frame = Context(ctx)
+            frame.variables[var_name] = x
+            return self.run(body, frame)
+        return self.interpreter.integrator.integrate(plan, lower, upper, lambda name: self.lookup(ctx, name),
+                                                     evaluate, tol)
@@ -1,22 +1,246 @@
 # cli.py
 
+import argparse
+import contextlib
+import glob
+import hashlib
+import io
+import json
+import os
 import sys
-from mathscript import MathScript
-
-def main():
-    if len(sys.argv) < 2:
-        print('Usage: python cli.py <filename.ms>')
-        sys.exit(1)
-    filename = sys.argv[1]
-    with open(filename, 'r') as f:
-        code = f.read()
-    ms = MathScript()
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from mathscript.interpreter import Interpreter, Context, Function
+from mathscript.sweep import from_value
+from mathscript.msc import load_source, source_key
+from mathscript.profiler import Profiler, MemoryProfiler, format_summary, write_collapsed
+
+# Compiled programs each worker keeps, keyed by source hash
+PROGRAM_CACHE_SIZE = 128
+
+# Lines, functions and node types listed in a file's profile report
+PROFILE_LIMIT = 20
+
+# What --profile can measure
+PROFILERS = {'time': Profiler, 'memory': MemoryProfiler}
+
+
+def expand(patterns):
+    """Expand files, directories (every .ms file below them) and globs, in order."""
+    files = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, '**', '*.ms'), recursive=True))
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+        else:
+            matches = [pattern]
+        for path in matches:
+            if path not in seen:
+                seen.add(path)
+                files.append(path)
+    return files
+
+
+class BatchWorker:
+    """
+    Runs MathScript files, reusing the compiled program of every source it
+    has seen: files with the same content are compiled once per worker,
+    then each run gets a fresh global Context. Parsing goes through the
+    .msc artifacts (see msc.py) unless `use_cache` is false, so workers and
+    later runs share it too.
+
+    With `profile` ('time' or 'memory', see PROFILERS), every file runs on
+    its own profiled tree-walking Interpreter and its result carries the
+    profile summary.
+    """
+
+    def __init__(self, mode='tree', options=None, variables=None, use_cache=True, cache_dir=None,
+                 profile=None):
+        self.mode = mode
+        self.options = dict(options or {})
+        # The artifact holds the optimized program already
+        self.optimize = self.options.pop('optimize', False)
+        self.variables = variables
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+        self.profile = profile
+        self.programs = OrderedDict()
+
+    def parse(self, code, path):
+        if self.use_cache:
+            return load_source(code, path, self.cache_dir, self.optimize)
+        return load_source(code, optimize=self.optimize)
+
+    def program(self, code, path):
+        key = source_key(code, self.optimize)
+        program = self.programs.get(key)
+        if program is None:
+            program = Interpreter(self.mode, **self.options).load(self.parse(code, path))
+            self.programs[key] = program
+            if len(self.programs) > PROGRAM_CACHE_SIZE:
+                self.programs.popitem(last=False)
+        else:
+            self.programs.move_to_end(key)
+        return program
+
+    def run_files(self, tasks):
+        return [self.run_file(index, path) for index, path in tasks]
+
+    def run_file(self, index, path):
+        result = {'index': index, 'file': path}
+        start = time.perf_counter()
+        output = io.StringIO()
+        profiler = code = None
+        try:
+            with open(path, encoding='utf-8') as f:
+                code = f.read()
+            if self.profile:
+                # A fresh interpreter per file, so profiles do not mix
+                profiler = PROFILERS[self.profile]()
+                # A memory profile counts what the parsed program holds too
+                profiler.start()
+                program = Interpreter(self.mode, profiler=profiler, **self.options).load(self.parse(code, path))
+            else:
+                program = self.program(code, path)
+            context = Context()
+            with contextlib.redirect_stdout(output):
+                program(context)
+        except Exception as e:
+            result.update(ok=False, error=f'{type(e).__name__}: {e}')
+        else:
+            names = self.variables if self.variables is not None else context.variables
+            result.update(ok=True, variables={name: from_value(context.variables.get(name)) for name in names
+                                              if not isinstance(context.variables.get(name), Function)})
+        result['output'] = output.getvalue()
+        result['time'] = round(time.perf_counter() - start, 6)
+        if profiler is not None:
+            profiler.stop()
+            result['profile'] = profiler.summary(code, PROFILE_LIMIT)
+        return result
+
+
+# The worker of each pool process, built once by init_worker
+worker = None
+
+
+def init_worker(*args):
+    global worker
+    worker = BatchWorker(*args)
+
+
+def run_files(tasks):
+    return worker.run_files(tasks)
+
+
+def batches(files, contents_key):
+    """Group files with identical content into one task, so it compiles once."""
+    groups = OrderedDict()
+    for index, path in enumerate(files):
+        groups.setdefault(contents_key(path), []).append((index, path))
+    return list(groups.values())
+
+
+def file_key(path):
     try:
-        ms.execute(code)
-        variables = ms.get_variables()
-        print('Variables:', variables)
-    except Exception as e:
-        print(f'Error: {e}')
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return path
+
+
+def run_batch(files, workers=None, mode='tree', options=None, variables=None, out=None,
+              use_cache=True, cache_dir=None, profile=None, profile_out=None, profile_output=None):
+    """
+    Run every file, writing one JSON line per file to `out` (default
+    sys.stdout) as soon as it finishes. Returns the number of files that
+    failed.
+
+    With `profile` (which needs mode 'tree'), each file's hot-spot report
+    goes to `profile_out` (default sys.stderr) instead of its JSON line, and the collapsed
+    stacks of all files, each under its file name, to the file
+    `profile_output` if given.
+    """
+    # Looked up per call, so redirecting sys.stdout takes effect
+    out = sys.stdout if out is None else out
+    profile_out = sys.stderr if profile_out is None else profile_out
+    args = (mode, options, variables, use_cache, cache_dir, profile)
+    tasks = batches(files, file_key)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(tasks))
+    failed = 0
+    stacks = []
+
+    def emit(results):
+        nonlocal failed
+        for result in results:
+            failed += not result['ok']
+            summary = result.pop('profile', None)
+            out.write(json.dumps(result) + '\n')
+            if summary is not None:
+                profile_out.write(f'\nProfile of {result["file"]}:\n')
+                format_summary(summary, profile_out)
+                stacks.append((result['file'], summary['stacks']))
+        out.flush()
+
+    if workers <= 1:
+        local = BatchWorker(*args)
+        for task in tasks:
+            emit(local.run_files(task))
+    else:
+        # The files already keep every worker busy; parallel loops run in-process
+        args = (mode, {**(options or {}), 'workers': 0}, variables, use_cache, cache_dir, profile)
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=args) as pool:
+            futures = [pool.submit(run_files, task) for task in tasks]
+            for future in as_completed(futures):
+                emit(future.result())
+
+    if profile_output is not None:
+        with open(profile_output, 'w') as f:
+            for path, file_stacks in stacks:
+                write_collapsed(file_stacks, f, root=path)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run MathScript files, printing one JSON line per file.')
+    parser.add_argument('files', nargs='+', help='files, directories or glob patterns')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU, 0: run in this process)')
+    # Batch files usually run once, so the tree walker, which compiles
+    # nothing, is the default
+    parser.add_argument('--mode', choices=Interpreter.MODES, default='tree', help='execution engine (default: tree)')
+    parser.add_argument('--optimize', action='store_true', help='run the AST optimizer')
+    parser.add_argument('--memoize', action='store_true', help='memoize every pure function')
+    parser.add_argument('--vars', help='comma-separated variables to report (default: all)')
+    parser.add_argument('--no-cache', action='store_true', help='do not read or write .msc artifacts')
+    parser.add_argument('--cache-dir', help='keep .msc artifacts in this directory instead of __mscache__')
+    parser.add_argument('--profile', action='store_const', const='time',
+                        help='profile where each file spends its time, on the tree walker; reports go to stderr')
+    parser.add_argument('--profile-memory', dest='profile', action='store_const', const='memory',
+                        help='like --profile, but for memory allocations (tracemalloc)')
+    parser.add_argument('--profile-output', metavar='PATH',
+                        help='with --profile(-memory), write collapsed stacks (microseconds or bytes) for flamegraph tools to PATH')
+    args = parser.parse_args(argv)
+    if args.profile and args.mode != 'tree':
+        parser.error(f'--profile{"-memory" if args.profile == "memory" else ""} needs --mode tree')
+    if args.profile_output and not args.profile:
+        parser.error('--profile-output needs --profile')
+
+    files = expand(args.files)
+    if not files:
+        parser.error('no files matched')
+    options = {'optimize': args.optimize, 'memoize': args.memoize}
+    variables = args.vars.split(',') if args.vars else None
+    failed = run_batch(files, args.workers, args.mode, options, variables,
+                       use_cache=not args.no_cache, cache_dir=args.cache_dir,
+                       profile=args.profile, profile_output=args.profile_output)
+    sys.exit(1 if failed else 0)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,594 @@
+# mathscript/compiler.py
+
+import operator
+
+from .parser import *
+from .interpreter import Function, RETURN
+from .memo import MISSING
+from .arrays import Array, get_item, call_method
+from .vectorize import run_plan, plan_names
+from .series import evaluate_series, series_names
+from .integrate import integral_names
+from .resolver import Resolver, Scope
+
+def divide(left, right):
+    if isinstance(right, (int, float)) and right == 0:
+        raise ZeroDivisionError('Division by zero')
+    return left / right
+
+
+def modulo(left, right):
+    if isinstance(right, (int, float)) and right == 0:
+        raise ZeroDivisionError('Modulo by zero')
+    return left % right
+
+
+def logical_and(left, right):
+    return left and right
+
+
+def logical_or(left, right):
+    return left or right
+
+
+BINARY_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': divide,
+    '%': modulo,
+    '^': operator.pow,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+    'and': logical_and,
+    'or': logical_or,
+}
+
+# Closures for the operators Python evaluates directly, to save the
+# operator call and a cell per node
+BINARY_CLOSURES = {
+    '+': lambda left, right: lambda frame: left(frame) + right(frame),
+    '-': lambda left, right: lambda frame: left(frame) - right(frame),
+    '*': lambda left, right: lambda frame: left(frame) * right(frame),
+    '==': lambda left, right: lambda frame: left(frame) == right(frame),
+    '!=': lambda left, right: lambda frame: left(frame) != right(frame),
+    '<': lambda left, right: lambda frame: left(frame) < right(frame),
+    '>': lambda left, right: lambda frame: left(frame) > right(frame),
+    '<=': lambda left, right: lambda frame: left(frame) <= right(frame),
+    '>=': lambda left, right: lambda frame: left(frame) >= right(frame),
+}
+
+UNARY_OPERATORS = {
+    '+': operator.pos,
+    '-': operator.neg,
+    'not': operator.not_,
+}
+
+
+class ClosureCompiler:
+    """
+    Compile a parsed MathScript program into a tree of Python closures.
+
+    Every node is turned into a function taking the current frame. Node
+    dispatch, operator lookup, constant conversion and scope resolution
+    happen once at compile time, so running the result only pays for the
+    actual computation. The compiled program has the same semantics as
+    Interpreter.visit.
+
+    Top-level code runs directly against the global Context. Function
+    bodies run against slot-indexed frames laid out by resolver.Scope; a
+    local slot that is still None falls back to the enclosing scopes, then
+    to the globals and builtins, exactly like Context.get does.
+    """
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.resolver = Resolver()
+        # Loop iterations and calls are the steps towards the
+        # interpreter's checkpoint
+        self.ticks = interpreter.ticks
+        self.checkpoint = interpreter.checkpoint
+        # Large programs would otherwise allocate a closure per leaf: nodes
+        # share one for the same constant, or the same variable in the
+        # same scope. constant_values maps a constant's closure back to
+        # its value, for folding.
+        self.constants = {}
+        self.constant_values = {}
+        self.accesses = {}
+
+    def compile(self, ast):
+        return self.compile_block(ast, None)
+
+    def compile_node(self, node, scope):
+        method = getattr(self, f'compile_{type(node).__name__}', None)
+        if method is None:
+            raise Exception(f'No visit_{type(node).__name__} method')
+        return method(node, scope)
+
+    def compile_block(self, statements, scope):
+        stmts = tuple(self.compile_node(stmt, scope) for stmt in statements)
+        if len(stmts) == 1:
+            return stmts[0]
+
+        def block(frame):
+            for stmt in stmts:
+                if stmt(frame) is RETURN:
+                    return RETURN
+        return block
+
+    def compile_function(self, param_names, body, scope):
+        """Compile a function body into invoke(outer, arg_values)."""
+        code = self.compile_block(body, scope)
+        padding = (None,) * (scope.frame_size - 1 - len(param_names))
+        return_slot = scope.slots.get('return_value')
+        find_return = self.make_finder('return_value', scope, skip_local=True)
+        ticks, checkpoint = self.ticks, self.checkpoint
+
+        def invoke(outer, values):
+            if ticks is not None and next(ticks):
+                checkpoint()
+            frame = [outer, *values, *padding]
+            code(frame)
+            if return_slot is not None:
+                value = frame[return_slot]
+                if value is not None:
+                    return value
+            return find_return(frame)
+        return invoke
+
+    def make_finder(self, name, scope, skip_local=False):
+        """
+        Build find(frame) returning the value bound to `name` in the
+        enclosing scopes or the globals, or None. Builtins are not searched.
+        """
+        if scope is None:
+            def find_global(ctx):
+                while ctx is not None:
+                    value = ctx.variables.get(name)
+                    if value is not None:
+                        return value
+                    ctx = ctx.parent
+                return None
+            return find_global
+
+        path = scope.resolve(name)
+        if skip_local and path and path[0][0] == 0:
+            path = path[1:]
+        depth = scope.depth
+
+        if not path and depth == 1:
+            def find_outer(frame):
+                ctx = frame[0]
+                while ctx is not None:
+                    value = ctx.variables.get(name)
+                    if value is not None:
+                        return value
+                    ctx = ctx.parent
+                return None
+            return find_outer
+
+        def find(frame):
+            hops = 0
+            for target, slot in path:
+                while hops < target:
+                    frame = frame[0]
+                    hops += 1
+                value = frame[slot]
+                if value is not None:
+                    return value
+            while hops < depth:
+                frame = frame[0]
+                hops += 1
+            ctx = frame
+            while ctx is not None:
+                value = ctx.variables.get(name)
+                if value is not None:
+                    return value
+                ctx = ctx.parent
+            return None
+        return find
+
+    def compile_constant(self, value):
+        key = (type(value), value)
+        constant = self.constants.get(key)
+        if constant is None:
+            constant = self.constants[key] = lambda frame: value
+            self.constant_values[constant] = value
+        return constant
+
+    def compile_NumberNode(self, node, scope):
+        return self.compile_constant(node.value)
+
+    def compile_StringNode(self, node, scope):
+        return self.compile_constant(node.value)
+
+    def compile_VarAccessNode(self, node, scope):
+        key = (scope, node.var_name)
+        access = self.accesses.get(key)
+        if access is None:
+            access = self.accesses[key] = self.compile_access(node.var_name, scope)
+        return access
+
+    def compile_access(self, var_name, scope):
+        builtins_get = self.interpreter.builtins.get
+
+        if scope is None:
+            def global_access(ctx):
+                while ctx is not None:
+                    value = ctx.variables.get(var_name)
+                    if value is not None:
+                        return value
+                    ctx = ctx.parent
+                value = builtins_get(var_name)
+                if value is None:
+                    raise NameError(f"Variable '{var_name}' is not defined")
+                return value
+            return global_access
+
+        slot = scope.slots.get(var_name)
+        if slot is not None:
+            find_outer = self.make_finder(var_name, scope, skip_local=True)
+
+            def local_access(frame):
+                value = frame[slot]
+                if value is None:
+                    value = find_outer(frame)
+                    if value is None:
+                        value = builtins_get(var_name)
+                        if value is None:
+                            raise NameError(f"Variable '{var_name}' is not defined")
+                return value
+            return local_access
+
+        find = self.make_finder(var_name, scope)
+
+        def outer_access(frame):
+            value = find(frame)
+            if value is None:
+                value = builtins_get(var_name)
+                if value is None:
+                    raise NameError(f"Variable '{var_name}' is not defined")
+            return value
+        return outer_access
+
+    def compile_VarAssignNode(self, node, scope):
+        expr = self.compile_node(node.expr, scope)
+        if scope is None:
+            var_name = node.var_name
+
+            def global_assign(ctx):
+                value = ctx.variables[var_name] = expr(ctx)
+                return value
+            return global_assign
+
+        slot = scope.slots[node.var_name]
+
+        def local_assign(frame):
+            value = frame[slot] = expr(frame)
+            return value
+        return local_assign
+
+    def compile_BinOpNode(self, node, scope):
+        left = self.compile_node(node.left_node, scope)
+        right = self.compile_node(node.right_node, scope)
+        op = node.op_token.value
+        func = BINARY_OPERATORS.get(op)
+        if func is None:
+            def unknown(frame):
+                left(frame)
+                right(frame)
+                raise Exception(f'Unknown operator {op}')
+            return unknown
+        # Constant operands are passed in rather than called, and constant
+        # subtrees are evaluated once, here; if that raises, the program
+        # raises when it gets there
+        left_value = self.constant_values.get(left, MISSING)
+        right_value = self.constant_values.get(right, MISSING)
+        if left_value is not MISSING and right_value is not MISSING:
+            try:
+                return self.compile_constant(func(left_value, right_value))
+            except Exception:
+                pass
+        elif left_value is not MISSING:
+            return lambda frame: func(left_value, right(frame))
+        elif right_value is not MISSING:
+            return lambda frame: func(left(frame), right_value)
+        closure = BINARY_CLOSURES.get(op)
+        if closure is not None:
+            return closure(left, right)
+        return lambda frame: func(left(frame), right(frame))
+
+    def compile_UnaryOpNode(self, node, scope):
+        operand = self.compile_node(node.node, scope)
+        op = node.op_token.value
+        func = UNARY_OPERATORS.get(op)
+        if func is None:
+            def unknown(frame):
+                operand(frame)
+                raise Exception(f'Unknown operator {op}')
+            return unknown
+        value = self.constant_values.get(operand, MISSING)
+        if value is not MISSING:
+            try:
+                return self.compile_constant(func(value))
+            except Exception:
+                pass
+        return lambda frame: func(operand(frame))
+
+    def compile_IfNode(self, node, scope):
+        condition = self.compile_node(node.condition, scope)
+        body = self.compile_block(node.body, scope)
+        else_body = self.compile_block(node.else_body, scope) if node.else_body else None
+
+        def if_(frame):
+            if condition(frame):
+                if body(frame) is RETURN:
+                    return RETURN
+            elif else_body is not None:
+                if else_body(frame) is RETURN:
+                    return RETURN
+        return if_
+
+    def compile_WhileNode(self, node, scope):
+        condition = self.compile_node(node.condition, scope)
+        body = self.compile_block(node.body, scope)
+        ticks, checkpoint = self.ticks, self.checkpoint
+
+        def while_(frame):
+            while condition(frame):
+                if ticks is not None and next(ticks):
+                    checkpoint()
+                if body(frame) is RETURN:
+                    return RETURN
+        return while_
+
+    def compile_ForNode(self, node, scope):
+        iterable = self.compile_node(node.iterable, scope)
+        body = self.compile_block(node.body, scope)
+        vector_for = self.compile_vector_for(node, scope)
+        ticks, checkpoint = self.ticks, self.checkpoint
+
+        if scope is None:
+            var_name = node.var_name
+
+            def global_for(ctx):
+                items = iterable(ctx)
+                if not hasattr(items, '__iter__'):
+                    raise TypeError(f"Object '{items}' is not iterable")
+                if vector_for is not None and vector_for(ctx, items):
+                    return
+                variables = ctx.variables
+                for item in items:
+                    variables[var_name] = item
+                    if ticks is not None and next(ticks):
+                        checkpoint()
+                    if body(ctx) is RETURN:
+                        return RETURN
+            return global_for
+
+        slot = scope.slots[node.var_name]
+
+        def local_for(frame):
+            items = iterable(frame)
+            if not hasattr(items, '__iter__'):
+                raise TypeError(f"Object '{items}' is not iterable")
+            if vector_for is not None and vector_for(frame, items):
+                return
+            for item in items:
+                frame[slot] = item
+                if ticks is not None and next(ticks):
+                    checkpoint()
+                if body(frame) is RETURN:
+                    return RETURN
+        return local_for
+
+    def compile_vector_for(self, node, scope):
+        """
+        Build vector_for(frame, items) running the loop as one NumPy
+        evaluation and returning True, or returning False when it must be
+        interpreted. None if the loop has no vectorization plan.
+        """
+        plan = self.interpreter.vector_plans.get(node)
+        if plan is None:
+            return None
+        builtins_get = self.interpreter.builtins.get
+        finders = {name: self.make_finder(name, scope) for name in plan_names(plan)}
+
+        def vector_for(frame, items):
+            def lookup(name):
+                value = finders[name](frame)
+                return builtins_get(name) if value is None else value
+            updates = run_plan(plan, items, lookup)
+            if updates is None:
+                return False
+            if scope is None:
+                frame.variables.update(updates)
+            else:
+                for name, value in updates.items():
+                    frame[scope.slots[name]] = value
+            return True
+        return vector_for
+
+    def compile_ParallelForNode(self, node, scope):
+        iterable = self.compile_node(node.iterable, scope)
+        index = self.interpreter.parallel_loops[node]
+        runner = self.interpreter.parallel
+        builtins_get = self.interpreter.builtins.get
+        finders = {name: self.make_finder(name, scope) for name in runner.lookup_names(index)}
+
+        def parallel_for(frame):
+            def lookup(name):
+                value = finders[name](frame)
+                return builtins_get(name) if value is None else value
+            updates = runner.run(index, iterable(frame), lookup)
+            if scope is None:
+                frame.variables.update(updates)
+            else:
+                for name, value in updates.items():
+                    frame[scope.slots[name]] = value
+        return parallel_for
+
+    def compile_FuncDefNode(self, node, scope):
+        func_name = node.func_name
+        param_names = node.param_names
+        raw_body = node.body
+        invoke = self.compile_function(param_names, node.body,
+                                       self.resolver.resolve_function(node, scope))
+        memo = None
+        if node in self.interpreter.memo_nodes:
+            memo = self.interpreter.memo_cache(node, func_name)
+            invoke = self.memoized(invoke, memo)
+
+        if scope is None:
+            def global_def(ctx):
+                ctx.variables[func_name] = Function(func_name, param_names, raw_body, ctx, code=invoke, memo=memo)
+            return global_def
+
+        slot = scope.slots[func_name]
+
+        def local_def(frame):
+            frame[slot] = Function(func_name, param_names, raw_body, frame, code=invoke, memo=memo)
+        return local_def
+
+    def memoized(self, invoke, memo):
+        key_of = memo.key
+        get = memo.get
+        put = memo.put
+
+        def memo_invoke(outer, values):
+            key = key_of(values)
+            result = get(key)
+            if result is MISSING:
+                result = invoke(outer, values)
+                put(key, result)
+            return result
+        return memo_invoke
+
+    def compile_ListNode(self, node, scope):
+        elements = tuple(self.compile_node(element, scope) for element in node.elements)
+
+        def build_list(frame):
+            return Array([element(frame) for element in elements])
+        return build_list
+
+    def compile_IndexNode(self, node, scope):
+        target = self.compile_node(node.target, scope)
+        index = node.index
+        if isinstance(index, SliceNode):
+            none = lambda frame: None
+            start = none if index.start is None else self.compile_node(index.start, scope)
+            stop = none if index.stop is None else self.compile_node(index.stop, scope)
+
+            def get_slice(frame):
+                return get_item(target(frame), slice(start(frame), stop(frame)))
+            return get_slice
+        index = self.compile_node(index, scope)
+
+        def get_index(frame):
+            return get_item(target(frame), index(frame))
+        return get_index
+
+    def compile_MethodCallNode(self, node, scope):
+        target = self.compile_node(node.target, scope)
+        method_name = node.method_name
+        args = tuple(self.compile_node(arg, scope) for arg in node.args)
+
+        def method_call(frame):
+            return call_method(target(frame), method_name, [arg(frame) for arg in args])
+        return method_call
+
+    def compile_series_body(self, node, scope):
+        """
+        Compile the body of a ∑/∏/∫ node into body(outer, i). The index gets
+        a scope of its own, so it does not leak into the enclosing one.
+        """
+        expr = self.compile_node(node.body, Scope([node.var_name], scope))
+
+        def body(outer, i):
+            return expr([outer, i])
+        return body
+
+    def compile_SeriesNode(self, node, scope):
+        start = self.compile_node(node.start, scope)
+        end = self.compile_node(node.end, scope)
+        body = self.compile_series_body(node, scope)
+        product = isinstance(node, ProductNode)
+        plan = self.interpreter.series_plan(node)
+        builtins_get = self.interpreter.builtins.get
+        finders = {name: self.make_finder(name, scope) for name in series_names(plan)}
+
+        def series(frame):
+            def lookup(name):
+                value = finders[name](frame)
+                return builtins_get(name) if value is None else value
+            return evaluate_series(product, plan, start(frame), end(frame), lookup,
+                                   lambda i: body(frame, i))
+        return series
+
+    compile_SumNode = compile_ProductNode = compile_SeriesNode
+
+    def compile_IntegralNode(self, node, scope):
+        start = self.compile_node(node.start, scope)
+        end = self.compile_node(node.end, scope)
+        tol = None if node.tol is None else self.compile_node(node.tol, scope)
+        body = self.compile_series_body(node, scope)
+        plan = self.interpreter.series_plan(node)
+        integrate = self.interpreter.integrator.integrate
+        builtins_get = self.interpreter.builtins.get
+        finders = {name: self.make_finder(name, scope) for name in integral_names(plan)}
+
+        def integral(frame):
+            def lookup(name):
+                value = finders[name](frame)
+                return builtins_get(name) if value is None else value
+            return integrate(plan, start(frame), end(frame), lookup, lambda x: body(frame, x),
+                             None if tol is None else tol(frame))
+        return integral
+
+    def compile_FuncCallNode(self, node, scope):
+        func_name = node.func_name
+        args = tuple(self.compile_node(arg, scope) for arg in node.args)
+        nargs = len(args)
+        find = self.make_finder(func_name, scope)
+        builtins_get = self.interpreter.builtins.get
+        compile_function = self.compile_function
+        resolve_function = self.resolver.resolve_function
+
+        def func_call(frame):
+            func = find(frame)
+            if func is None:
+                func = builtins_get(func_name)
+                if func is None:
+                    raise NameError(f"Function '{func_name}' is not defined")
+                return func(*[arg(frame) for arg in args])
+            if isinstance(func, Function):
+                if nargs != len(func.param_names):
+                    raise TypeError(f"Function '{func_name}' expected {len(func.param_names)} arguments but got {nargs}")
+                code = func.code
+                if code is None:
+                    # Defined by another engine: compile it as a top-level function
+                    code = func.code = compile_function(
+                        func.param_names, func.body,
+                        resolve_function(FuncDefNode(func.name, func.param_names, func.body)))
+                return code(func.context, [arg(frame) for arg in args])
+            raise TypeError(f"'{func_name}' is not a function")
+        return func_call
+
+    def compile_ReturnNode(self, node, scope):
+        expr = self.compile_node(node.expr, scope)
+        if scope is None:
+            def global_return(ctx):
+                ctx.variables['return_value'] = expr(ctx)
+                return RETURN
+            return global_return
+
+        slot = scope.slots['return_value']
+
+        def local_return(frame):
+            frame[slot] = expr(frame)
+            return RETURN
+        return local_return
@@ -0,0 +1,188 @@
+# mathscript/expression.py
+
+from .lexer import Lexer
+from .parser import *
+from .arrays import np, require_numpy
+from .interpreter import load_builtins
+from . import vectorize
+
+# Rows evaluated per pass over the expression: the temporaries of one pass
+# stay in cache, which beats evaluating whole columns at once
+EXPRESSION_CHUNK = 1 << 14
+
+
+def compile_expression(src, params=(), constants=None, functions=None):
+    """
+    Compile one MathScript expression into a function of columns.
+
+    Parameters:
+    - src (str): The expression, e.g. 'a * sin(x) + b'.
+    - params (list): The names of the columns, in positional order.
+    - constants (dict): Values of other names the expression uses; builtin
+      constants such as pi are always available.
+    - functions (dict): Extra functions the expression may call.
+
+    Returns:
+    - A CompiledExpression.
+    """
+    require_numpy()
+    lexer = Lexer(src)
+    parser = Parser(lexer.tokenize())
+    node = parser.expr()
+    if parser.current_tok.type != 'EOF':
+        raise SyntaxError(f"Unexpected '{parser.current_tok.value}' after expression")
+    return CompiledExpression(src, params, node, constants, functions)
+
+
+class CompiledExpression:
+    """
+    A MathScript expression evaluated over whole columns with NumPy.
+
+    Call it with one column per parameter, positionally or by name. A
+    column is a NumPy array, a buffer of doubles or a sequence of numbers;
+    a number is broadcast to every row. The result is a float64 array with
+    one value per row.
+
+    Arithmetic follows MathScript arrays: division by zero and domain
+    errors give inf and nan instead of raising. Comparisons, `and`, `or`
+    and `not` give 1.0 and 0.0 like their element-wise Array versions.
+    Math builtins run as their NumPy ufuncs; any other function is called
+    once per row.
+    """
+
+    def __init__(self, source, params, node, constants=None, functions=None):
+        self.source = source
+        self.params = tuple(params)
+        if len(set(self.params)) != len(self.params):
+            raise ValueError('Duplicate parameter name')
+        self.names = {**load_builtins(), **(constants or {}), **(functions or {})}
+        self.node = node
+        self.chunk = EXPRESSION_CHUNK
+        is_const, value = self.compile_node(node)
+        if is_const:
+            self.evaluate = lambda columns: value
+        else:
+            self.evaluate = value
+
+    def __call__(self, *columns, out=None, **named):
+        if len(columns) > len(self.params):
+            raise TypeError(f'Expected at most {len(self.params)} columns, got {len(columns)}')
+        values = dict(zip(self.params, columns))
+        for name, column in named.items():
+            if name not in self.params:
+                raise TypeError(f"Unknown parameter '{name}'")
+            if name in values:
+                raise TypeError(f"Parameter '{name}' given twice")
+            values[name] = column
+        missing = [name for name in self.params if name not in values]
+        if missing:
+            raise TypeError(f"Missing column for '{missing[0]}'")
+
+        columns = [self.column(values[name]) for name in self.params]
+        length = None
+        for name, column in zip(self.params, columns):
+            if column.ndim:
+                if length is not None and len(column) != length:
+                    raise ValueError(f"Column '{name}' has {len(column)} rows, expected {length}")
+                length = len(column)
+        if length is None:
+            length = 1 if out is None else len(out)
+        if out is None:
+            out = np.empty(length, dtype=np.float64)
+        elif out.shape != (length,):
+            raise ValueError(f'out must have shape ({length},)')
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for start in range(0, length, self.chunk):
+                end = min(start + self.chunk, length)
+                chunk = [column[start:end] if column.ndim else column for column in columns]
+                out[start:end] = self.evaluate(chunk)
+        return out
+
+    def column(self, value):
+        if isinstance(value, (bytes, bytearray)):
+            return np.frombuffer(value, dtype=np.float64)
+        try:
+            column = np.asarray(value, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise TypeError('Columns must hold numbers')
+        if column.ndim > 1:
+            raise ValueError('Columns must be one-dimensional')
+        return column
+
+    def compile_node(self, node):
+        """Return (True, constant) or (False, function of the chunk's columns)."""
+        method = getattr(self, f'compile_{type(node).__name__}', None)
+        if method is None:
+            raise SyntaxError(f'{type(node).__name__} cannot be evaluated over columns')
+        return method(node)
+
+    def compile_NumberNode(self, node):
+        return True, np.float64(node.value)
+
+    def compile_VarAccessNode(self, node):
+        name = node.var_name
+        if name in self.params:
+            position = self.params.index(name)
+            return False, lambda columns: columns[position]
+        value = self.names.get(name)
+        if type(value) not in (int, float, bool):
+            raise NameError(f"Name '{name}' is not a parameter or a numeric constant")
+        return True, np.float64(value)
+
+    def compile_UnaryOpNode(self, node):
+        op = node.op_token.value
+        if op == '-':
+            func = np.negative
+        elif op == '+':
+            func = np.positive
+        elif op == 'not':
+            func = lambda value: np.equal(value, 0).astype(np.float64)
+        else:
+            raise SyntaxError(f"Unsupported operator '{op}'")
+        return self.combine(func, [self.compile_node(node.node)])
+
+    def compile_BinOpNode(self, node):
+        op = node.op_token.value
+        if op == 'and':
+            func = lambda left, right: np.where(left != 0, right, left)
+        elif op == 'or':
+            func = lambda left, right: np.where(left != 0, left, right)
+        elif op in vectorize.COMPARISON_OPS:
+            ufunc = vectorize.BINARY_UFUNCS[op]
+            func = lambda left, right: ufunc(left, right).astype(np.float64)
+        elif op in vectorize.BINARY_UFUNCS:
+            func = vectorize.BINARY_UFUNCS[op]
+        else:
+            raise SyntaxError(f"Unsupported operator '{op}'")
+        return self.combine(func, [self.compile_node(node.left_node), self.compile_node(node.right_node)])
+
+    def compile_FuncCallNode(self, node):
+        name = node.func_name
+        func = self.names.get(name)
+        if not callable(func):
+            raise NameError(f"Function '{name}' is not defined")
+        args = [self.compile_node(arg) for arg in node.args]
+        variants = vectorize.MATH_UFUNCS.get(func)
+        if variants and 1 <= len(args) <= len(variants) and variants[len(args) - 1] is not None:
+            return self.combine(variants[len(args) - 1], args)
+        if isinstance(func, np.ufunc):
+            return self.combine(func, args)
+        if not args:
+            return True, np.float64(func())
+        per_row = np.frompyfunc(func, len(args), 1)
+        return self.combine(lambda *values: np.asarray(per_row(*values), dtype=np.float64), args)
+
+    def combine(self, func, operands):
+        """Apply func to compiled operands, folding it if they are all constant."""
+        if all(is_const for is_const, _ in operands):
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                return True, np.float64(func(*[value for _, value in operands]))
+        getters = [(lambda columns, value=value: value) if is_const else value for is_const, value in operands]
+        if len(getters) == 1:
+            operand, = getters
+            return False, lambda columns: func(operand(columns))
+        if len(getters) == 2:
+            left, right = getters
+            return False, lambda columns: func(left(columns), right(columns))
+        return False, lambda columns: func(*[getter(columns) for getter in getters])
@@ -3,11 +3,11 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
 from tkinter.font import Font
+import asyncio
 import threading
-import sys
-import io
 
-from mathscript import Lexer, Parser, Interpreter
+from mathscript.session import Session
+from mathscript.msc import load_source
 
 class MathScriptGUI:
     def __init__(self, root):
@@ -15,6 +15,12 @@ class MathScriptGUI:
         self.root.title("MathScript IDE")
         self.filename = None
 
+        # Programs run on Sessions driven by an event loop in a background
+        # thread; `running` is the future of the current run
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.running = None
+
         # Create GUI elements
         self.create_widgets()
         self.create_menu()
@@ -45,6 +51,10 @@ class MathScriptGUI:
         self.run_button = tk.Button(self.button_frame, text="Run", command=self.run_code)
         self.run_button.pack(side=tk.LEFT, padx=5, pady=5)
 
+        # Stop button
+        self.stop_button = tk.Button(self.button_frame, text="Stop", command=self.stop_code)
+        self.stop_button.pack(side=tk.LEFT, padx=5, pady=5)
+
     def create_menu(self):
         # Menu bar
         self.menu_bar = tk.Menu(self.root)
@@ -135,41 +145,36 @@ class MathScriptGUI:
         self.console.delete(1.0, tk.END)
         self.console.config(state='disabled')
 
-        # Run the code in a separate thread to avoid freezing the GUI
-        threading.Thread(target=self.execute_code, args=(code,), daemon=True).start()
-
-    def execute_code(self, code):
-        try:
-            # Redirect print statements to the console
-            old_stdout = sys.stdout
-            redirected_output = sys.stdout = io.StringIO()
-
-            # Lexing
-            lexer = Lexer(code)
-            tokens = lexer.tokenize()
-
-            # Parsing
-            parser = Parser(tokens)
-            ast = parser.parse()
+        # Run the code on the event loop's thread to avoid freezing the GUI;
+        # a new run replaces the one still going
+        self.stop_code()
+        self.running = asyncio.run_coroutine_threadsafe(self.execute_code(code), self.loop)
 
-            # Interpreting
-            interpreter = Interpreter()
-            interpreter.interpret(ast)
+    def stop_code(self):
+        if self.running is not None:
+            self.running.cancel()
+            self.running = None
 
-            # Restore stdout
-            sys.stdout = old_stdout
-
-            output = redirected_output.getvalue()
-
-            self.console.config(state='normal')
-            self.console.insert(tk.END, output)
-            self.console.config(state='disabled')
+    async def execute_code(self, code):
+        session = Session()
+        try:
+            # Lexing and parsing, skipped when the file's .msc artifact
+            # matches the code
+            ast = await self.loop.run_in_executor(None, load_source, code, self.filename)
 
+            # Interpreting, showing each printed line as it comes
+            async for line in session.stream(ast):
+                self.root.after(0, self.write_console, line + '\n')
         except Exception as e:
-            sys.stdout = old_stdout
-            self.console.config(state='normal')
-            self.console.insert(tk.END, f'Error: {e}')
-            self.console.config(state='disabled')
+            self.root.after(0, self.write_console, f'Error: {e}')
+        finally:
+            session.close()
+
+    def write_console(self, text):
+        # Tk widgets may only be used from the GUI thread
+        self.console.config(state='normal')
+        self.console.insert(tk.END, text)
+        self.console.config(state='disabled')
 
 def main():
     root = tk.Tk()
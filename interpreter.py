@@ -1,12 +1,55 @@
 # mathscript/interpreter.py
 
+import itertools
+
+from .lexer import RESERVED_PREFIX
 from .parser import *
 from .stdlib import mathlib, iolib, utils
+from .memo import MemoCache, PurityAnalyzer, MEMO_SIZE, MISSING
+from .arrays import Array, get_item, call_method, has_items
+from .vectorize import LoopVectorizer, run_plan
+from .series import SeriesPlanner, evaluate_series
+from .integrate import Integrator, integral_plan
+from .parallel import ParallelRunner
+from .arena import Arena
+from .profiler import MODULE
+
+def load_builtins():
+    builtins = {}
+    builtins.update(mathlib.__dict__)
+    builtins.update(iolib.__dict__)
+    builtins.update(utils.__dict__)
+    # Library functions use a trailing underscore to avoid shadowing
+    # Python builtins; scripts call them by their plain names.
+    for name, value in list(builtins.items()):
+        if name.endswith('_') and not name.startswith('_'):
+            builtins.setdefault(name[:-1], value)
+    # Reserved for the optimizer; scripts cannot name it
+    builtins[RESERVED_PREFIX + 'has_items'] = has_items
+    return builtins
+
+# Returned by visit() for a statement that executed 'return'; the value
+# itself is stored in the frame's 'return_value' variable.
+RETURN = object()
+
+# Maximum number of released call frames kept for reuse
+FRAME_POOL_SIZE = 64
+
+# Top-level statements interpret_stream() loads and runs at a time
+STREAM_BATCH = 256
+
+# Evaluation steps (loop iterations and function calls) between two calls
+# of an Interpreter's checkpoint
+CHECK_INTERVAL = 1000
 
 class Context:
+    __slots__ = ('variables', 'parent', 'captured')
+
     def __init__(self, parent=None):
         self.variables = {}
         self.parent = parent
+        # Set once a function defined in this context may outlive the call
+        self.captured = False
 
     def get(self, name):
         value = self.variables.get(name, None)
@@ -17,28 +60,245 @@ class Context:
     def set(self, name, value):
         self.variables[name] = value
 
+    def drop_temporaries(self):
+        # The optimizer's top-level temporaries only live as long as the run
+        for name in [name for name in self.variables if name.startswith(RESERVED_PREFIX)]:
+            del self.variables[name]
+
 class Function:
-    def __init__(self, name, param_names, body, context):
+    def __init__(self, name, param_names, body, context, code=None, memo=None):
         self.name = name
         self.param_names = param_names
         self.body = body
         self.context = context
+        self.code = code  # compiled body used by the 'closure' and 'vm' modes
+        self.memo = memo  # MemoCache if calls are memoized
 
 class Interpreter:
-    def __init__(self):
+    # 'tree' walks the AST with visit(); 'closure' compiles it once into
+    # Python closures (see compiler.py) and runs those instead; 'vm' compiles
+    # it to bytecode and runs it on the stack machine in bytecode.py, which
+    # keeps call frames on the heap and eliminates tail calls, so deep
+    # recursion does not hit Python's recursion limit.
+    MODES = ('tree', 'closure', 'vm')
+
+    def __init__(self, mode='tree', memoize=False, memo_size=MEMO_SIZE, optimize=False,
+                 vectorize=True, integrator=None, workers=None, profiler=None,
+                 checkpoint=None, check_interval=CHECK_INTERVAL):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown interpreter mode '{mode}'")
+        if profiler is not None and mode != 'tree':
+            # The compiled modes fuse statements and calls into closures
+            # and bytecode, leaving nothing per node to time
+            raise ValueError(f"Profiling needs the 'tree' mode, not '{mode}'")
+        self.mode = mode
         self.context = Context()
         self.builtins = self.init_builtins()
+        self.frame_pool = []
+        # Memoize every pure function, not just those marked @memo
+        self.memoize = memoize
+        self.memo_size = memo_size
+        self.memo_nodes = set()
+        self.memo_caches = {}
+        # Run the AST optimizer before executing; what it changed is kept
+        # in self.optimizations
+        self.optimize = optimize
+        self.optimizations = []
+        # Run reduction and map loops over ranges as one NumPy evaluation
+        # when they qualify and the results are the same (see vectorize.py);
+        # 'approximate' also vectorizes %, ^ and math builtins, whose
+        # results may then differ in the last bit
+        self.vectorize = vectorize
+        self.vector_plans = {}
+        # {node: plan} and compiled bodies of ∑/∏/∫ nodes, built on first use
+        self.series_plans = {}
+        self.series_bodies = {}
+        # Evaluates ∫ nodes; holds the tolerances, budget and result cache
+        self.integrator = integrator or Integrator()
+        # Worker processes for parallel for loops (None: one per CPU, 0:
+        # run them in this process) and the runner of the loaded program
+        self.workers = workers
+        self.parallel = None
+        self.parallel_loops = {}
+        # Times statements and calls (see profiler.py)
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.instrument(self)
+        # Called every `check_interval` steps in every mode; it may raise to
+        # stop the program (see session.py). next(self.ticks) is true once
+        # per interval, the cheapest countdown there is, and no engine
+        # counts anything when there is no checkpoint.
+        self.checkpoint = checkpoint
+        self.ticks = None
+        if checkpoint is not None:
+            self.ticks = itertools.cycle((False,) * (check_interval - 1) + (True,))
+            self.execute_block = self.checked_block
 
     def init_builtins(self):
-        builtins = {}
-        builtins.update(mathlib.__dict__)
-        builtins.update(iolib.__dict__)
-        builtins.update(utils.__dict__)
-        return builtins
+        return load_builtins()
 
     def interpret(self, ast):
-        for node in ast:
-            self.visit(node)
+        self.load(ast)(self.context)
+
+    def interpret_stream(self, statements, batch_size=STREAM_BATCH):
+        """
+        Run top-level statements as they arrive, e.g. from
+        Parser(Lexer(file).stream()).statements(), so execution starts
+        before the whole source is read. They are loaded in batches of
+        `batch_size`; like REPL lines, each batch is analyzed and compiled
+        on its own and sees what the earlier ones defined.
+        """
+        batch = []
+        for stmt in statements:
+            batch.append(stmt)
+            if len(batch) >= batch_size:
+                self.interpret(batch)
+                batch = []
+        if batch:
+            self.interpret(batch)
+
+    def load(self, ast):
+        """
+        Optimize, analyze and compile a program once; return run(context),
+        which executes it against a global Context and can be called again
+        with a fresh one to rerun the program without recompiling.
+        `ast` is a list of statements or an Arena.
+        """
+        if isinstance(ast, Arena):
+            ast = ast.to_ast()
+        if self.optimize:
+            from .optimizer import Optimizer
+            optimizer = Optimizer()
+            ast = optimizer.optimize(ast)
+            self.optimizations = optimizer.changes
+        self.prepare_memo(ast)
+        if self.vectorize:
+            vectorizer = LoopVectorizer(approximate=self.vectorize == 'approximate')
+            self.vector_plans.update(vectorizer.analyze(ast))
+        runner = self.parallel = self.prepare_parallel(ast)
+        if self.mode == 'closure':
+            program = self.compile(ast)
+        elif self.mode == 'vm':
+            from .bytecode import BytecodeCompiler, VM
+            code = BytecodeCompiler(self.memo_nodes, self.vector_plans, self.parallel_loops).compile(ast)
+            vm = VM(self)
+            program = lambda context: vm.run(code, context)
+        else:
+            program = self.execute_block
+
+        def run(context):
+            # lookup() and the tree walker resolve globals through self.context
+            self.context = context
+            self.parallel = runner
+            if self.profiler is not None:
+                self.profiler.enter_call(MODULE)
+            try:
+                if self.mode == 'tree':
+                    program(ast)
+                else:
+                    program(context)
+            finally:
+                context.drop_temporaries()
+                if self.profiler is not None:
+                    self.profiler.exit_call()
+                if runner is not None:
+                    runner.shutdown()
+        return run
+
+    def prepare_parallel(self, ast):
+        """Check the parallel for loops of a program and set up their runner."""
+        nodes = []
+        stack = list(reversed(ast))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, ParallelForNode):
+                nodes.append(node)
+            elif isinstance(node, (IfNode, WhileNode, ForNode, FuncDefNode)):
+                stack.extend(reversed((node.else_body or []) if isinstance(node, IfNode) else []))
+                stack.extend(reversed(node.body))
+        if not nodes:
+            return None
+        # Functions defined by earlier programs, e.g. previous REPL lines,
+        # then this program's top-level ones. Those from bytecode loaded
+        # without its source have no body to send to the workers.
+        functions = {name: FuncDefNode(value.name, value.param_names, value.body, [])
+                     for name, value in self.context.variables.items()
+                     if isinstance(value, Function) and value.body is not None}
+        functions.update((stmt.func_name, stmt) for stmt in ast if isinstance(stmt, FuncDefNode))
+        self.parallel_loops.update((node, index) for index, node in enumerate(nodes))
+        return ParallelRunner(self, functions, nodes, self.workers)
+
+    def run_parallel(self, node, items, lookup):
+        return self.parallel.run(self.parallel_loops[node], items, lookup)
+
+    def compile(self, ast):
+        from .compiler import ClosureCompiler
+        return ClosureCompiler(self).compile(ast)
+
+    def prepare_memo(self, ast):
+        reasons = PurityAnalyzer(self.builtins).analyze(ast)
+        for node, reason in reasons.items():
+            for annotation in node.annotations:
+                if annotation != 'memo':
+                    raise SyntaxError(f"Unknown annotation '@{annotation}' on function '{node.func_name}'")
+            annotated = 'memo' in node.annotations
+            if not (annotated or self.memoize):
+                continue
+            if reason is None:
+                self.memo_nodes.add(node)
+            elif annotated:
+                raise SyntaxError(f"Function '{node.func_name}' is marked @memo but is not pure: {reason}")
+
+    def lookup(self, name):
+        value = self.context.get(name)
+        if value is None:
+            return self.builtins.get(name)
+        return value
+
+    def series_plan(self, node):
+        plan = self.series_plans.get(node)
+        if plan is None:
+            if isinstance(node, IntegralNode):
+                plan = integral_plan(node)
+            else:
+                plan = SeriesPlanner().plan(node)
+            self.series_plans[node] = plan
+        return plan
+
+    def memo_cache(self, key, name):
+        cache = self.memo_caches.get(key)
+        if cache is None:
+            cache = self.memo_caches[key] = MemoCache(name, self.memo_size)
+        return cache
+
+    def memo_stats(self):
+        return {cache.name: cache.stats() for cache in self.memo_caches.values()}
+
+    def execute_block(self, statements):
+        for stmt in statements:
+            if self.visit(stmt) is RETURN:
+                return RETURN
+
+    def checked_block(self, statements):
+        # execute_block() while there is a checkpoint: every loop iteration
+        # and function call runs a block
+        if next(self.ticks):
+            self.checkpoint()
+        return type(self).execute_block(self, statements)
+
+    def new_frame(self, parent):
+        if self.frame_pool:
+            frame = self.frame_pool.pop()
+            frame.parent = parent
+            return frame
+        return Context(parent)
+
+    def release_frame(self, frame):
+        if frame.captured or len(self.frame_pool) >= FRAME_POOL_SIZE:
+            return
+        frame.variables.clear()
+        frame.parent = None
+        self.frame_pool.append(frame)
 
     def visit(self, node):
         method_name = f'visit_{type(node).__name__}'
@@ -81,9 +341,14 @@ class Interpreter:
         elif op == '*':
             return left * right
         elif op == '/':
-            if right == 0:
+            # Arrays divide element-wise, yielding inf/nan like NumPy
+            if isinstance(right, (int, float)) and right == 0:
                 raise ZeroDivisionError('Division by zero')
             return left / right
+        elif op == '%':
+            if isinstance(right, (int, float)) and right == 0:
+                raise ZeroDivisionError('Modulo by zero')
+            return left % right
         elif op == '^':
             return left ** right
         elif op == '==':
@@ -121,30 +386,88 @@ class Interpreter:
     def visit_IfNode(self, node):
         condition = self.visit(node.condition)
         if condition:
-            for stmt in node.body:
-                self.visit(stmt)
+            return self.execute_block(node.body)
         elif node.else_body:
-            for stmt in node.else_body:
-                self.visit(stmt)
+            return self.execute_block(node.else_body)
 
     def visit_WhileNode(self, node):
         while self.visit(node.condition):
-            for stmt in node.body:
-                self.visit(stmt)
+            if self.execute_block(node.body) is RETURN:
+                return RETURN
 
     def visit_ForNode(self, node):
         iterable = self.visit(node.iterable)
         if not hasattr(iterable, '__iter__'):
             raise TypeError(f"Object '{iterable}' is not iterable")
+        plan = self.vector_plans.get(node)
+        if plan is not None:
+            updates = run_plan(plan, iterable, self.lookup)
+            if updates is not None:
+                for name, value in updates.items():
+                    self.context.set(name, value)
+                return
         for item in iterable:
             self.context.set(node.var_name, item)
-            for stmt in node.body:
-                self.visit(stmt)
+            if self.execute_block(node.body) is RETURN:
+                return RETURN
+
+    def visit_ParallelForNode(self, node):
+        updates = self.run_parallel(node, self.visit(node.iterable), self.lookup)
+        for name, value in updates.items():
+            self.context.set(name, value)
 
     def visit_FuncDefNode(self, node):
         func = Function(node.func_name, node.param_names, node.body, self.context)
+        if node in self.memo_nodes:
+            func.memo = self.memo_cache(node, node.func_name)
+        self.context.captured = True
         self.context.set(node.func_name, func)
 
+    def visit_ListNode(self, node):
+        return Array([self.visit(element) for element in node.elements])
+
+    def visit_IndexNode(self, node):
+        target = self.visit(node.target)
+        index = node.index
+        if isinstance(index, SliceNode):
+            start = None if index.start is None else self.visit(index.start)
+            stop = None if index.stop is None else self.visit(index.stop)
+            return get_item(target, slice(start, stop))
+        return get_item(target, self.visit(index))
+
+    def visit_MethodCallNode(self, node):
+        target = self.visit(node.target)
+        args = [self.visit(arg) for arg in node.args]
+        return call_method(target, node.method_name, args)
+
+    def visit_SeriesNode(self, node):
+        start = self.visit(node.start)
+        end = self.visit(node.end)
+        body = self.series_body(node)
+        context = self.context
+        return evaluate_series(isinstance(node, ProductNode), self.series_plan(node), start, end,
+                               self.lookup, lambda i: body(context, i))
+
+    visit_SumNode = visit_ProductNode = visit_SeriesNode
+
+    def visit_IntegralNode(self, node):
+        start = self.visit(node.start)
+        end = self.visit(node.end)
+        tol = None if node.tol is None else self.visit(node.tol)
+        body = self.series_body(node)
+        context = self.context
+        return self.integrator.integrate(self.series_plan(node), start, end, self.lookup,
+                                         lambda x: body(context, x), tol)
+
+    def series_body(self, node):
+        body = self.series_bodies.get(node)
+        if body is None:
+            # Per-index evaluation runs the body compiled to closures,
+            # never through visit()
+            from .compiler import ClosureCompiler
+            body = self.series_bodies[node] = ClosureCompiler(self).compile_series_body(node, None)
+        return body
+
     def visit_FuncCallNode(self, node):
         func = self.context.get(node.func_name)
         if func is None:
@@ -157,19 +480,33 @@ class Interpreter:
         elif isinstance(func, Function):
             if len(node.args) != len(func.param_names):
                 raise TypeError(f"Function '{node.func_name}' expected {len(func.param_names)} arguments but got {len(node.args)}")
-            new_context = Context(parent=func.context)
-            for param_name, arg in zip(func.param_names, node.args):
-                arg_value = self.visit(arg)
-                new_context.set(param_name, arg_value)
-            interpreter = Interpreter()
-            interpreter.context = new_context
-            interpreter.builtins = self.builtins
-            interpreter.interpret(func.body)
-            return interpreter.context.get('return_value')
+            values = [self.visit(arg) for arg in node.args]
+            memo = func.memo
+            if memo is None:
+                return self.call_function(func, values)
+            key = memo.key(values)
+            result = memo.get(key)
+            if result is MISSING:
+                result = self.call_function(func, values)
+                memo.put(key, result)
+            return result
         else:
             raise TypeError(f"'{node.func_name}' is not a function")
 
+    def call_function(self, func, values):
+        frame = self.new_frame(func.context)
+        frame.variables.update(zip(func.param_names, values))
+        caller = self.context
+        self.context = frame
+        try:
+            self.execute_block(func.body)
+            result = frame.get('return_value')
+        finally:
+            self.context = caller
+            self.release_frame(frame)
+        return result
+
     def visit_ReturnNode(self, node):
         value = self.visit(node.expr)
         self.context.set('return_value', value)
-        raise StopIteration('Return statement encountered')
+        return RETURN
@@ -1,8 +1,45 @@
 # mathscript/lexer.py
 
+import codecs
+import io
 import re
 
+# Token patterns, tried in order at each position. Keywords are lexed as
+# identifiers and told apart by KEYWORDS, so `iffy` or `format` stay names.
+# The parser matches operators and punctuation as ('OP', value), so they
+# share one group.
+TOKEN_SPECIFICATION = [
+    ('NUMBER',   r'\d+(?:\.\d*)?'),               # Integer or decimal number
+    ('IDENT',    r'[^\W\d]\w*'),                  # Identifiers and keywords, including π
+    ('OP',       r'==|!=|<=|>=|'                  # Comparison operators
+                 r'[-+*/^%<>=(){}\[\].,:@∑∏∫]'),  # Arithmetic, assignment, punctuation, ∑ ∏ ∫
+    ('NEWLINE',  r'\n'),                          # Line endings
+    ('STRING',   r'"[^"\\]*(?:\\.[^"\\]*)*"'),    # String literals
+    ('MISMATCH', r'.'),                           # Any other character
+]
+
+KEYWORDS = frozenset({'function', 'if', 'else', 'elif', 'for', 'while', 'return',
+                      'and', 'or', 'not', 'in', 'true', 'false'})
+
+# Keywords the parser treats as operators
+OP_KEYWORDS = frozenset({'and', 'or', 'not'})
+
+# Names with this prefix are the implementation's own, e.g. the
+# optimizer's temporaries, so scripts may not use them
+RESERVED_PREFIX = '__'
+
+# Spaces, tabs and comments before a token are consumed by the same match,
+# so they cost no trip through the loop. Compiled once, at import.
+TOKEN_REGEX = re.compile(r'(?:[ \t]+|#[^\n]*)*(?:%s|\Z)' % '|'.join(
+    '(?P<%s>%s)' % pair for pair in TOKEN_SPECIFICATION))
+
+# Characters (or bytes) read from a file source at a time
+READ_SIZE = 1 << 16
+
+
 class Token:
+    __slots__ = ('type', 'value', 'line', 'column')
+
     def __init__(self, type_, value=None, line=1, column=1):
         self.type = type_
         self.value = value
@@ -12,57 +49,106 @@ class Token:
     def __repr__(self):
         return f'Token({self.type}, {self.value}, line={self.line}, column={self.column})'
 
+
 class Lexer:
-    def __init__(self, code):
+    """
+    Splits MathScript source into tokens.
+
+    `code` is a string, bytes, or anything with a read() method: a file
+    opened in text or binary mode, or an mmap. Binary sources are decoded
+    as UTF-8. tokenize() returns the list of all tokens; stream() yields
+    them one at a time, reading a file in chunks of `read_size`, so memory
+    stays bounded by the longest line rather than the source.
+    """
+
+    def __init__(self, code, read_size=READ_SIZE):
         self.code = code
+        self.read_size = read_size
         self.tokens = []
-        self.current_pos = 0
         self.line = 1
         self.column = 1
 
-        # Define token patterns
-        self.token_specification = [
-            ('NUMBER',   r'\d+(\.\d*)?'),               # Integer or decimal number
-            ('STRING',   r'"[^"\\]*(\\.[^"\\]*)*"'),    # String literals
-            ('IDENT',    r'[A-Za-z_][A-Za-z0-9_]*'),    # Identifiers
-            ('ASSIGN',   r'='),                         # Assignment operator
-            ('LPAREN',   r'\('),                        # Left Parenthesis
-            ('RPAREN',   r'\)'),                        # Right Parenthesis
-            ('LBRACE',   r'\{'),                        # Left Brace
-            ('RBRACE',   r'\}'),                        # Right Brace
-            ('COMMA',    r','),                         # Comma
-            ('COLON',    r':'),                         # Colon
-            ('OP',       r'[\+\-\*/\^%]'),              # Arithmetic operators
-            ('COMPARE',  r'==|!=|<=|>=|<|>'),           # Comparison operators
-            ('NEWLINE',  r'\n'),                        # Line endings
-            ('SKIP',     r'[ \t]+'),                    # Skip spaces and tabs
-            ('COMMENT',  r'#.*'),                       # Comments
-            ('KEYWORD',  r'\b(function|if|else|elif|for|while|return|and|or|not|in|true|false)\b'),  # Keywords
-            ('MISMATCH', r'.'),                         # Any other character
-        ]
-
-        self.token_regex = '|'.join('(?P<%s>%s)' % pair for pair in self.token_specification)
-        self.get_token = re.compile(self.token_regex).match
-
     def tokenize(self):
-        code = self.code
-        pos = 0
-        while pos < len(code):
-            match = self.get_token(code, pos)
-            if match:
+        # Every token stays alive in the list, so large sources keep the
+        # collector busy; to only parse, pass stream() to the Parser
+        self.tokens.extend(self.stream())
+        return self.tokens
+
+    def chunks(self):
+        source = self.code
+        if isinstance(source, str):
+            yield source
+            return
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        decoder = None
+        while True:
+            data = source.read(self.read_size)
+            if not data:
+                break
+            if isinstance(data, str):
+                yield data
+                continue
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder('utf-8')()
+            yield decoder.decode(data)
+        if decoder is not None:
+            yield decoder.decode(b'', final=True)
+
+    def stream(self):
+        """Yield the tokens one at a time, ending with EOF."""
+        chunks = self.chunks()
+        line = self.line
+        # Unscanned text, and the offset in it where the current line
+        # starts (negative once that line began in an earlier chunk)
+        text = ''
+        line_start = 0
+        final = False
+        while not final:
+            chunk = next(chunks, None)
+            if chunk is None:
+                final = True
+                limit = len(text)
+            else:
+                text += chunk
+                # Scan whole lines only: no token but a string crosses one
+                limit = text.rfind('\n') + 1
+                if not limit:
+                    continue
+            scanned = limit
+            for match in TOKEN_REGEX.finditer(text, 0, limit):
                 kind = match.lastgroup
-                value = match.group(kind)
+                if kind is None:
+                    # Only blanks and comments were left
+                    break
                 if kind == 'NEWLINE':
-                    self.line += 1
-                    self.column = 1
-                elif kind == 'SKIP' or kind == 'COMMENT':
-                    pass
+                    line += 1
+                    line_start = match.end()
+                    continue
+                value = match[kind]
+                column = match.end() - len(value) - line_start + 1
+                if kind == 'IDENT':
+                    if value in KEYWORDS:
+                        kind = 'OP' if value in OP_KEYWORDS else 'KEYWORD'
+                    elif value.startswith(RESERVED_PREFIX):
+                        raise RuntimeError(f'{value!r} on line {line}, column {column}: '
+                                           f'names starting with {RESERVED_PREFIX!r} are reserved')
                 elif kind == 'MISMATCH':
-                    raise RuntimeError(f'{value!r} unexpected on line {self.line}')
-                else:
-                    self.tokens.append(Token(kind, value, self.line, self.column))
-                pos = match.end()
-            else:
-                raise RuntimeError(f'Unexpected character {code[pos]} on line {self.line}')
-        self.tokens.append(Token('EOF', line=self.line, column=self.column))
-        return self.tokens
+                    if value == '"' and not final:
+                        # A string running past the scanned lines; rescan
+                        # it once more text has been read
+                        scanned = match.start()
+                        break
+                    raise RuntimeError(f'{value!r} unexpected on line {line}, column {column}')
+                elif kind == 'STRING' and '\n' in value:
+                    # A string spanning lines moves the following tokens down
+                    yield Token(kind, value, line, column)
+                    line += value.count('\n')
+                    line_start = match.end() - len(value) + value.rindex('\n') + 1
+                    continue
+                yield Token(kind, value, line, column)
+            text = text[scanned:]
+            line_start -= scanned
+        self.line = line
+        self.column = len(text) - line_start + 1
+        yield Token('EOF', line=line, column=self.column)
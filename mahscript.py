@@ -1,22 +1,120 @@
+# mathscript.py
 
+import hashlib
+import keyword
+
+from .lexer import Lexer
+from .parser import *
+from .interpreter import load_builtins
+from .optimizer import Optimizer
+from .compiler import logical_and, logical_or
+from .arrays import Array, get_item, call_method, has_items
+from .series import SeriesPlanner, evaluate_series, series_names
+from .integrate import Integrator, integral_plan, integral_names
+
+# Bump whenever generate_python_code changes its output, so stale cached
+# code objects are never reused.
+TRANSPILER_VERSION = 5
+
+
+def run_series(product, plan, start, end, body, scope):
+    # scope() returns the values of the names the plan may use; one that
+    # is not bound yet just rules out the closed form and NumPy paths
+    try:
+        names = scope()
+    except NameError:
+        names = {}
+    return evaluate_series(product, plan, start, end, names.get, body)
+
+
+def run_integral(integrator, plan, start, end, body, scope, tol=None):
+    try:
+        names = scope()
+    except NameError:
+        names = {}
+    return integrator.integrate(plan, start, end, names.get, body, tol)
+
+
+# Stands for a name that is not a builtin
+MISSING = object()
+
+
+class StopProgram(Exception):
+    # Raised by a top-level 'return' to end the program
+    pass
+
+
+# Helpers the generated code calls; the leading underscores keep them out
+# of `variables` and away from MathScript identifiers.
+RUNTIME = {
+    '__array': Array,
+    '__get_item': get_item,
+    '__call_method': call_method,
+    '__has_items': has_items,
+    '__slice': slice,
+    '__series': run_series,
+    # Both operands are evaluated, as in the interpreter
+    '__and': logical_and,
+    '__or': logical_or,
+    '__stop': StopProgram,
+}
 
-# mathscript.py
 
-import re
-import sys
-import math
+class Scope:
+    """
+    The names a generated function (or series body) binds.
+
+    Reading one of them mirrors Context.get(): while it holds None the
+    name falls back to the enclosing scope that binds it, or to the
+    globals. Python resolves names statically, so a function reads the
+    shadowed value of an enclosing function through a getter,
+    __outer<depth>_<name>, defined at the top of that function.
+    """
+
+    def __init__(self, bound, series=False):
+        self.bound = bound
+        self.series = series  # a lambda parameter, never None
+        self.getters = set()
+
+
+def bound_names(statements, names=None):
+    """
+    Collect the names a function body assigns, not counting those of the
+    functions it defines. 'return' sets 'return_value', like the
+    interpreter's frames.
+    """
+    if names is None:
+        names = set()
+    for stmt in statements:
+        if isinstance(stmt, VarAssignNode):
+            names.add(stmt.var_name)
+        elif isinstance(stmt, IfNode):
+            bound_names(stmt.body, names)
+            if stmt.else_body:
+                bound_names(stmt.else_body, names)
+        elif isinstance(stmt, WhileNode):
+            bound_names(stmt.body, names)
+        elif isinstance(stmt, (ForNode, ParallelForNode)):
+            names.add(stmt.var_name)
+            bound_names(stmt.body, names)
+        elif isinstance(stmt, FuncDefNode):
+            names.add(stmt.func_name)
+        elif isinstance(stmt, ReturnNode):
+            names.add('return_value')
+    return names
+
 
 class MathScript:
-    def __init__(self):
+    # Compiled code objects shared by all instances, keyed by source hash
+    code_cache = {}
+    code_cache_size = 256
+
+    def __init__(self, optimize=False, integrator=None):
+        self.optimize = optimize
+        self.integrator = integrator or Integrator()
         self.variables = {}
-        self.functions = {
-            'sin': math.sin,
-            'cos': math.cos,
-            'tan': math.tan,
-            'log': math.log,
-            'exp': math.exp,
-            'sqrt': math.sqrt,
-        }
+        self.functions = {name: value for name, value in load_builtins().items()
+                          if not name.startswith('__')}
 
     def transpile(self, code):
         """
@@ -32,10 +130,34 @@ class MathScript:
         tokens = self.tokenize(code)
         # Parse tokens into an abstract syntax tree (AST)
         ast = self.parse(tokens)
+        if self.optimize:
+            ast = Optimizer().optimize(ast)
         # Generate Python code from the AST
         python_code = self.generate_python_code(ast)
         return python_code
 
+    def compile(self, code):
+        """
+        Transpile and compile MathScript code, reusing a cached code object
+        when the same source has been compiled before.
+
+        Parameters:
+        - code (str): The MathScript code to compile.
+
+        Returns:
+        - A Python code object.
+        """
+        key = hashlib.sha256(f'{TRANSPILER_VERSION}\0{self.optimize}\0{code}'.encode('utf-8')).hexdigest()
+        cache = MathScript.code_cache
+        code_object = cache.get(key)
+        if code_object is None:
+            code_object = compile(self.transpile(code), '<mathscript>', 'exec')
+            if len(cache) >= self.code_cache_size:
+                # Evict the oldest entry
+                del cache[next(iter(cache))]
+            cache[key] = code_object
+        return code_object
+
     def tokenize(self, code):
         """
         Convert the input code into a list of tokens.
@@ -46,40 +168,7 @@ class MathScript:
         Returns:
         - A list of tokens.
         """
-        token_specification = [
-            ('NUMBER',   r'\d+(\.\d*)?'),  # Integer or decimal number
-            ('IDENT',    r'[A-Za-z_][A-Za-z0-9_]*'),  # Identifiers
-            ('OP',       r'[+\-*/^∑∏∫=<>≤≥≠()]'),  # Operators and delimiters
-            ('SKIP',     r'[ \t]+'),       # Skip over spaces and tabs
-            ('NEWLINE',  r'\n'),           # Line endings
-            ('MISMATCH', r'.'),            # Any other character
-        ]
-        tok_regex = '|'.join('(?P<%s>%s)' % pair for pair in token_specification)
-        get_token = re.compile(tok_regex).match
-        line_num = 1
-        line_start = 0
-        tokens = []
-        pos = 0
-        mo = get_token(code)
-        while mo is not None:
-            kind = mo.lastgroup
-            value = mo.group(kind)
-            if kind == 'NUMBER':
-                tokens.append(('NUMBER', value))
-            elif kind == 'IDENT':
-                tokens.append(('IDENT', value))
-            elif kind == 'OP':
-                tokens.append(('OP', value))
-            elif kind == 'NEWLINE':
-                line_num += 1
-                line_start = mo.end()
-            elif kind == 'SKIP':
-                pass
-            elif kind == 'MISMATCH':
-                raise RuntimeError(f'{value!r} unexpected on line {line_num}')
-            pos = mo.end()
-            mo = get_token(code, pos)
-        return tokens
+        return Lexer(code).tokenize()
 
     def parse(self, tokens):
         """
@@ -89,34 +178,195 @@ class MathScript:
         - tokens (list): The list of tokens to parse.
 
         Returns:
-        - An abstract syntax tree representing the code.
+        - A list of statement nodes.
         """
-        # For simplicity, we'll assume the code is a single expression
-        # In a full implementation, we would build a complete parser
-        return tokens
+        return Parser(tokens).parse()
 
     def generate_python_code(self, ast):
         """
         Generate Python code from the AST.
 
         Parameters:
-        - ast: The abstract syntax tree.
+        - ast: The list of statement nodes.
 
         Returns:
         - Python code as a string.
         """
-        python_code = ''
-        for token in ast:
-            token_type, value = token
-            if token_type == 'NUMBER':
-                python_code += value
-            elif token_type == 'IDENT':
-                python_code += value
-            elif token_type == 'OP':
-                python_code += self.map_operator(value)
+        lines = []
+        # Enclosing function and series scopes of the code being generated
+        self.scopes = []
+        self.generate_block(ast, lines, 0)
+        return '\n'.join(lines) + '\n'
+
+    def generate_block(self, statements, lines, indent):
+        start = len(lines)
+        for stmt in statements:
+            self.generate_statement(stmt, lines, indent)
+        if len(lines) == start:
+            lines.append('    ' * indent + 'pass')
+
+    def generate_statement(self, node, lines, indent):
+        pad = '    ' * indent
+        if isinstance(node, VarAssignNode):
+            lines.append(f'{pad}{self.map_name(node.var_name)} = {self.generate_expr(node.expr)}')
+        elif isinstance(node, IfNode):
+            lines.append(f'{pad}if {self.generate_expr(node.condition)}:')
+            self.generate_block(node.body, lines, indent + 1)
+            if node.else_body:
+                lines.append(f'{pad}else:')
+                self.generate_block(node.else_body, lines, indent + 1)
+        elif isinstance(node, WhileNode):
+            lines.append(f'{pad}while {self.generate_expr(node.condition)}:')
+            self.generate_block(node.body, lines, indent + 1)
+        elif isinstance(node, (ForNode, ParallelForNode)):
+            # Parallel loops run serially in the generated code
+            lines.append(f'{pad}for {self.map_name(node.var_name)} in {self.generate_expr(node.iterable)}:')
+            self.generate_block(node.body, lines, indent + 1)
+        elif isinstance(node, FuncDefNode):
+            self.generate_function(node, lines, indent)
+        elif isinstance(node, ReturnNode):
+            value = self.generate_expr(node.expr)
+            lines.append(f'{pad}return_value = {value}')
+            if self.scopes:
+                # The frame's return_value, falling back like any variable
+                lines.append(f'{pad}return {self.read_name("return_value")}')
             else:
-                pass  # Handle other token types if necessary
-        return python_code
+                lines.append(f'{pad}raise __stop')
+        else:
+            lines.append(pad + self.generate_expr(node))
+
+    def generate_function(self, node, lines, indent):
+        pad = '    ' * (indent + 1)
+        params = [self.map_name(name) for name in node.param_names]
+        lines.append(f"{'    ' * indent}def {self.map_name(node.func_name)}({', '.join(params)}):")
+        scope = Scope(bound_names(node.body) | set(node.param_names))
+        self.scopes.append(scope)
+        try:
+            start = len(lines)
+            self.generate_block(node.body, lines, indent + 1)
+            # Falling off the end returns return_value, as the interpreter
+            # does; it may come from an enclosing scope or be None
+            if not node.body or not isinstance(node.body[-1], ReturnNode):
+                if 'return_value' in scope.bound:
+                    value = self.read_name('return_value')
+                else:
+                    value = self.outer_name('return_value', len(self.scopes) - 1)
+                lines.append(f'{pad}return {value}')
+            # Locals start out unset, so reading one before it is assigned
+            # falls back instead of raising UnboundLocalError
+            header = []
+            unset = sorted(scope.bound - set(node.param_names))
+            if unset:
+                header.append(f"{pad}{' = '.join(self.map_name(name) for name in unset)} = None")
+            depth = len(self.scopes) - 1
+            for name in sorted(scope.getters):
+                header.append(f'{pad}__outer{depth}_{self.map_name(name)} = lambda: {self.read_name(name)}')
+            lines[start:start] = header
+        finally:
+            self.scopes.pop()
+
+    def read_name(self, name):
+        """
+        Generate the expression reading a variable, falling back through
+        the enclosing scopes like the interpreter's Context.get().
+
+        Parameters:
+        - name (str): The MathScript identifier.
+
+        Returns:
+        - A Python expression as a string.
+        """
+        mapped = self.map_name(name)
+        for index in range(len(self.scopes) - 1, -1, -1):
+            scope = self.scopes[index]
+            if name in scope.bound:
+                if scope.series:
+                    return mapped
+                return f'({mapped} if {mapped} is not None else {self.outer_name(name, index)})'
+        return mapped
+
+    def outer_name(self, name, index):
+        # The value `name` has where it is unset in self.scopes[index]
+        for depth in range(index - 1, -1, -1):
+            scope = self.scopes[depth]
+            if name in scope.bound:
+                if scope.series:
+                    return self.map_name(name)
+                scope.getters.add(name)
+                return f'__outer{depth}_{self.map_name(name)}()'
+        return f'__global({name!r})'
+
+    def generate_expr(self, node):
+        if isinstance(node, NumberNode):
+            return repr(node.value)
+        elif isinstance(node, StringNode):
+            return repr(node.value)
+        elif isinstance(node, VarAccessNode):
+            return self.read_name(node.var_name)
+        elif isinstance(node, BinOpNode):
+            left = self.generate_expr(node.left_node)
+            right = self.generate_expr(node.right_node)
+            op = node.op_token.value
+            if op in ('and', 'or'):
+                return f'__{op}({left}, {right})'
+            return f'({left} {self.map_operator(op)} {right})'
+        elif isinstance(node, UnaryOpNode):
+            op = self.map_operator(node.op_token.value)
+            return f'({op} {self.generate_expr(node.node)})'
+        elif isinstance(node, FuncCallNode):
+            args = ', '.join(self.generate_expr(arg) for arg in node.args)
+            return f'{self.read_name(node.func_name)}({args})'
+        elif isinstance(node, ListNode):
+            elements = ', '.join(self.generate_expr(element) for element in node.elements)
+            return f'__array([{elements}])'
+        elif isinstance(node, IndexNode):
+            index = node.index
+            if isinstance(index, SliceNode):
+                start = 'None' if index.start is None else self.generate_expr(index.start)
+                stop = 'None' if index.stop is None else self.generate_expr(index.stop)
+                key = f'__slice({start}, {stop})'
+            else:
+                key = self.generate_expr(index)
+            return f'__get_item({self.generate_expr(node.target)}, {key})'
+        elif isinstance(node, MethodCallNode):
+            args = ', '.join(self.generate_expr(arg) for arg in node.args)
+            return f'__call_method({self.generate_expr(node.target)}, {node.method_name!r}, [{args}])'
+        elif isinstance(node, SeriesNode):
+            plan = SeriesPlanner().plan(node)
+            scope = ', '.join(f'{name!r}: {self.read_name(name)}' for name in sorted(series_names(plan)))
+            body = self.generate_series_body(node)
+            return (f'__series({isinstance(node, ProductNode)}, {plan!r}, {self.generate_expr(node.start)}, '
+                    f'{self.generate_expr(node.end)}, {body}, lambda: {{{scope}}})')
+        elif isinstance(node, IntegralNode):
+            plan = integral_plan(node)
+            scope = ', '.join(f'{name!r}: {self.read_name(name)}' for name in sorted(integral_names(plan)))
+            body = self.generate_series_body(node)
+            tol = 'None' if node.tol is None else self.generate_expr(node.tol)
+            return (f'__integral({plan!r}, {self.generate_expr(node.start)}, {self.generate_expr(node.end)}, '
+                    f'{body}, lambda: {{{scope}}}, {tol})')
+        else:
+            raise SyntaxError(f'Cannot transpile {type(node).__name__}')
+
+    def generate_series_body(self, node):
+        self.scopes.append(Scope({node.var_name}, series=True))
+        try:
+            return f'lambda {self.map_name(node.var_name)}: {self.generate_expr(node.body)}'
+        finally:
+            self.scopes.pop()
+
+    def map_name(self, name):
+        """
+        Map a MathScript identifier to a valid Python identifier.
+
+        Parameters:
+        - name (str): The MathScript identifier.
+
+        Returns:
+        - The identifier, suffixed if it is a Python keyword.
+        """
+        if keyword.iskeyword(name):
+            return name + '_ms'
+        return name
 
     def map_operator(self, op):
         """
@@ -129,22 +379,10 @@ class MathScript:
         - The corresponding Python operator as a string.
         """
         operator_mapping = {
-            '+': '+',
-            '-': '-',
-            '*': '*',
-            '/': '/',
             '^': '**',
-            '=': '=',
-            '<': '<',
-            '>': '>',
             '≤': '<=',
             '≥': '>=',
             '≠': '!=',
-            '∑': 'sum',  # Special handling required
-            '∏': 'product',  # Special handling required
-            '∫': 'integrate',  # Special handling required
-            '(': '(',
-            ')': ')',
         }
         return operator_mapping.get(op, op)
 
@@ -158,24 +396,18 @@ class MathScript:
         Returns:
         - The result of the execution.
         """
-        python_code = self.transpile(code)
+        code_object = self.compile(code)
         # Prepare the execution environment
-        exec_env = {**self.functions, **self.variables}
+        exec_env = {**self.functions, **self.variables, **RUNTIME,
+                    '__integral': lambda *args: run_integral(self.integrator, *args)}
+        # Where functions' unset variables fall back to
+        exec_env['__global'] = exec_env.get
         # Execute the Python code
-        exec(python_code, exec_env)
+        try:
+            exec(code_object, exec_env)
+        except StopProgram:
+            pass
         # Update variables with any changes
-        self.variables.update(exec_env)
+        self.variables.update((name, value) for name, value in exec_env.items()
+                              if not name.startswith('__') and self.functions.get(name, MISSING) is not value)
         return exec_env
-
-# Example usage
-if __name__ == "__main__":
-    ms = MathScript()
-    code = """
-    x = 10
-    y = ∑(i=1 to x) i
-    z = ∏(i=1 to 5) i
-    area = ∫(x=0 to π) sin(x) dx
-    result = x + y + z + area
-    """
-    ms.execute(code)
-    print("Variables:", ms.variables)
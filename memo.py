@@ -0,0 +1,263 @@
+# mathscript/memo.py
+
+from collections import OrderedDict
+
+from .parser import *
+from .resolver import Resolver
+
+# Builtins with side effects; a function calling them is never pure
+IMPURE_BUILTINS = {'print', 'print_', 'input', 'input_'}
+
+# Default number of entries kept per memoized function
+MEMO_SIZE = 1024
+
+# Returned by MemoCache.get on a miss
+MISSING = object()
+
+
+class ImpureError(Exception):
+    pass
+
+
+class MemoCache:
+    """Bounded LRU cache of one pure function's results."""
+
+    def __init__(self, name, maxsize=MEMO_SIZE):
+        self.name = name
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(args):
+        # 1 and 1.0 hash alike but may produce differently typed results
+        return (*args, *map(type, args))
+
+    def get(self, key):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return MISSING
+        except TypeError:
+            # Unhashable argument, e.g. a list: not cacheable
+            return MISSING
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if value.__hash__ is None:
+            # Mutable result, e.g. an array: callers must get a fresh one
+            return
+        try:
+            self.entries[key] = value
+        except TypeError:
+            return
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+        }
+
+
+class PurityAnalyzer:
+    """
+    Decide which top-level functions of a program are pure.
+
+    A function is pure when its result depends only on its arguments: it
+    reads no variable that may come from an outer scope, calls only pure
+    builtins and other pure functions, defines no nested functions and
+    returns on every path (falling off the end would return whatever
+    'return_value' holds in the caller's scope).
+    """
+
+    def __init__(self, builtins=()):
+        self.builtins = set(builtins)
+
+    def analyze(self, ast):
+        """Return {FuncDefNode: None if pure, else the reason it is not}."""
+        functions = []
+        assigned = set()
+        self.collect(ast, functions, assigned)
+
+        names = {}
+        for node in functions:
+            names.setdefault(node.func_name, []).append(node)
+        self.function_names = set(names)
+
+        reasons = {}
+        for node in functions:
+            if len(names[node.func_name]) > 1:
+                reasons[node] = f"'{node.func_name}' is defined more than once"
+            elif node.func_name in assigned:
+                reasons[node] = f"'{node.func_name}' is reassigned"
+            else:
+                reasons[node] = self.check_function(node, assigned)
+
+        # A call to an impure function makes the caller impure; iterate
+        # until nothing changes so (mutual) recursion is handled.
+        changed = True
+        while changed:
+            changed = False
+            for node in functions:
+                if reasons[node] is not None:
+                    continue
+                for callee in self.called_functions(node.body):
+                    targets = names.get(callee)
+                    if targets and reasons[targets[0]] is not None:
+                        reasons[node] = f"calls impure function '{callee}'"
+                        changed = True
+                        break
+        return reasons
+
+    def collect(self, statements, functions, assigned):
+        # Top-level function definitions, including those inside top-level
+        # control flow, and every name the top level assigns
+        for node in statements:
+            if isinstance(node, FuncDefNode):
+                functions.append(node)
+            elif isinstance(node, VarAssignNode):
+                assigned.add(node.var_name)
+            elif isinstance(node, ForNode):
+                assigned.add(node.var_name)
+                self.collect(node.body, functions, assigned)
+            elif isinstance(node, ParallelForNode):
+                assigned.add(node.var_name)
+                assigned.update(name for _, name in node.reductions)
+            elif isinstance(node, WhileNode):
+                self.collect(node.body, functions, assigned)
+            elif isinstance(node, IfNode):
+                self.collect(node.body, functions, assigned)
+                if node.else_body:
+                    self.collect(node.else_body, functions, assigned)
+
+    def check_function(self, node, global_assigned):
+        self.global_assigned = global_assigned
+        self.local_names = set(Resolver().resolve_function(node).slots)
+        try:
+            returns = self.check_block(node.body, set(node.param_names))
+        except ImpureError as e:
+            return str(e)
+        if not returns:
+            return 'does not return on every path'
+        return None
+
+    def check_block(self, statements, defined):
+        """Check statements in order; return True if the block always returns."""
+        for stmt in statements:
+            if self.check_statement(stmt, defined):
+                return True
+        return False
+
+    def check_statement(self, node, defined):
+        if isinstance(node, VarAssignNode):
+            self.check_expr(node.expr, defined)
+            defined.add(node.var_name)
+        elif isinstance(node, ReturnNode):
+            self.check_expr(node.expr, defined)
+            return True
+        elif isinstance(node, IfNode):
+            self.check_expr(node.condition, defined)
+            body_defined = set(defined)
+            body_returns = self.check_block(node.body, body_defined)
+            if node.else_body:
+                else_defined = set(defined)
+                else_returns = self.check_block(node.else_body, else_defined)
+                if body_returns and else_returns:
+                    return True
+                if body_returns:
+                    defined |= else_defined
+                elif else_returns:
+                    defined |= body_defined
+                else:
+                    defined |= body_defined & else_defined
+        elif isinstance(node, WhileNode):
+            self.check_expr(node.condition, defined)
+            self.check_block(node.body, set(defined))
+        elif isinstance(node, ForNode):
+            self.check_expr(node.iterable, defined)
+            self.check_block(node.body, defined | {node.var_name})
+        elif isinstance(node, FuncDefNode):
+            raise ImpureError(f"defines nested function '{node.func_name}'")
+        elif isinstance(node, ParallelForNode):
+            raise ImpureError('runs a parallel for loop')
+        else:
+            self.check_expr(node, defined)
+        return False
+
+    def check_expr(self, node, defined):
+        if isinstance(node, VarAccessNode):
+            name = node.var_name
+            if name in defined:
+                return
+            if name in self.local_names:
+                # May be read before it is assigned, falling back to a global
+                raise ImpureError(f"'{name}' may be read before assignment")
+            if name in self.builtins and name not in self.global_assigned:
+                return
+            raise ImpureError(f"reads outer variable '{name}'")
+        elif isinstance(node, BinOpNode):
+            self.check_expr(node.left_node, defined)
+            self.check_expr(node.right_node, defined)
+        elif isinstance(node, UnaryOpNode):
+            self.check_expr(node.node, defined)
+        elif isinstance(node, FuncCallNode):
+            name = node.func_name
+            if name in self.local_names:
+                raise ImpureError(f"calls local function value '{name}'")
+            if name not in self.function_names:
+                if name in IMPURE_BUILTINS:
+                    raise ImpureError(f"calls '{name}'")
+                if name not in self.builtins or name in self.global_assigned:
+                    raise ImpureError(f"calls unknown function '{name}'")
+            for arg in node.args:
+                self.check_expr(arg, defined)
+        elif isinstance(node, ListNode):
+            for element in node.elements:
+                self.check_expr(element, defined)
+        elif isinstance(node, IndexNode):
+            self.check_expr(node.target, defined)
+            index = node.index
+            if isinstance(index, SliceNode):
+                for bound in (index.start, index.stop):
+                    if bound is not None:
+                        self.check_expr(bound, defined)
+            else:
+                self.check_expr(index, defined)
+        elif isinstance(node, MethodCallNode):
+            raise ImpureError(f"calls method '{node.method_name}'")
+        elif isinstance(node, (SeriesNode, IntegralNode)):
+            self.check_expr(node.start, defined)
+            self.check_expr(node.end, defined)
+            if isinstance(node, IntegralNode) and node.tol is not None:
+                self.check_expr(node.tol, defined)
+            self.check_expr(node.body, defined | {node.var_name})
+        elif isinstance(node, (NumberNode, StringNode)):
+            pass
+        else:
+            raise ImpureError(f'uses {type(node).__name__}')
+
+    def called_functions(self, statements):
+        calls = set()
+        stack = list(statements)
+        while stack:
+            node = stack.pop()
+            if isinstance(node, FuncCallNode):
+                calls.add(node.func_name)
+            if isinstance(node, ASTNode):
+                for value in node.field_values():
+                    if isinstance(value, ASTNode):
+                        stack.append(value)
+                    elif isinstance(value, list):
+                        stack.extend(value)
+        return calls
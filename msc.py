@@ -0,0 +1,190 @@
+# mathscript/msc.py
+
+import hashlib
+import hmac
+import os
+import pickle
+import secrets
+
+from .lexer import Lexer
+from .parser import Parser
+from .optimizer import Optimizer
+from .arena import Arena
+
+# Bump whenever the lexer, the parser, the AST node classes or the
+# optimizer change what a source compiles to, so stale artifacts are
+# never loaded
+LANGUAGE_VERSION = 6
+
+# Artifacts hold the program as a pickled Arena: a few arrays load far
+# faster than one object (and its pickled state) per node. Unpickling
+# can run arbitrary code, so each artifact carries an HMAC of its
+# contents under a secret only its writer has (see artifact_secret());
+# one that does not verify, e.g. planted in a shared cache directory, is
+# never unpickled.
+MAGIC = b'MSC\x02'
+
+# Artifacts of a .ms file live in this directory next to it, like __pycache__
+CACHE_DIR_NAME = '__mscache__'
+
+# Set to a directory to keep every artifact there instead, named by hash
+CACHE_DIR_ENV = 'MATHSCRIPT_CACHE_DIR'
+
+# Set to a non-empty value to stop writing artifacts (they are still read)
+NO_WRITE_ENV = 'MATHSCRIPT_DONT_WRITE_MSC'
+
+# Set to the secret artifacts are authenticated with, e.g. to share a
+# cache between machines; otherwise it is kept in SECRET_PATH
+SECRET_ENV = 'MATHSCRIPT_MSC_SECRET'
+
+# The user's secret, created (readable by the user only) on first use
+SECRET_PATH = os.path.join('~', '.mathscript', 'msc.key')
+
+# The secret read from or created at each path
+_secrets = {}
+
+
+def source_key(code, optimize=False):
+    """Hash identifying what `code` compiles to under this language version."""
+    text = f'{LANGUAGE_VERSION}\0{int(optimize)}\0{code}'
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+def artifact_path(key, path=None, cache_dir=None, optimize=False):
+    """
+    Where the artifact of a source lives: `cache_dir`/<hash>.msc when a
+    cache directory is set, else __mscache__/<name>.msc next to `path`.
+    None when there is neither.
+    """
+    cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV)
+    if cache_dir:
+        return os.path.join(cache_dir, key.hex() + '.msc')
+    if path is None:
+        return None
+    directory, name = os.path.split(os.path.abspath(path))
+    suffix = '.opt.msc' if optimize else '.msc'
+    return os.path.join(directory, CACHE_DIR_NAME, os.path.splitext(name)[0] + suffix)
+
+
+def artifact_secret():
+    """
+    The secret artifacts are signed with: $MATHSCRIPT_MSC_SECRET, else the
+    contents of SECRET_PATH, which is created if missing. When it cannot
+    be, a random secret for this process only: its artifacts then work
+    within the process and are never trusted by another.
+    """
+    secret = os.environ.get(SECRET_ENV)
+    if secret:
+        return secret.encode('utf-8')
+    path = os.path.expanduser(SECRET_PATH)
+    secret = _secrets.get(path)
+    if secret is None:
+        try:
+            secret = read_secret(path) or create_secret(path)
+        except OSError:
+            secret = None
+        if not secret or len(secret) < 16:
+            secret = secrets.token_bytes(32)
+        _secrets[path] = secret
+    return secret
+
+
+def read_secret(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def create_secret(path):
+    """Store a new random secret at `path`, or return one another process stored first."""
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return read_secret(path)
+    secret = secrets.token_bytes(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(secret)
+    return secret
+
+
+def signature(header, payload):
+    return hmac.new(artifact_secret(), header + payload, hashlib.sha256).digest()
+
+
+def read_artifact(artifact, key):
+    """Return the program stored in `artifact` for `key`, or None."""
+    try:
+        with open(artifact, 'rb') as f:
+            header = f.read(len(MAGIC) + len(key))
+            if header != MAGIC + key:
+                return None
+            mac = f.read(hashlib.sha256().digest_size)
+            payload = f.read()
+        # Only unpickle what was written with our secret
+        if not hmac.compare_digest(mac, signature(header, payload)):
+            return None
+        arena = pickle.loads(payload)
+        if not isinstance(arena, Arena):
+            return None
+        return arena.to_ast()
+    except (OSError, EOFError, RecursionError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+
+def write_artifact(artifact, key, ast):
+    """Store `ast` for `key`; failures (read-only directory, too deep) are ignored."""
+    try:
+        os.makedirs(os.path.dirname(artifact), exist_ok=True)
+        payload = pickle.dumps(Arena(ast), protocol=pickle.HIGHEST_PROTOCOL)
+        header = MAGIC + key
+        # Write then rename, so a concurrent reader never sees half a file
+        temp = f'{artifact}.{os.getpid()}.tmp'
+        with open(temp, 'wb') as f:
+            f.write(header + signature(header, payload) + payload)
+        os.replace(temp, artifact)
+    except (OSError, RecursionError, pickle.PicklingError):
+        return False
+    return True
+
+
+def parse(code):
+    return Parser(Lexer(code).stream()).parse()
+
+
+def load_source(code, path=None, cache_dir=None, optimize=False, write=True):
+    """
+    Parse MathScript source, reusing its .msc artifact when one matches.
+
+    Parameters:
+    - code (str): The source.
+    - path (str): The file it came from, which places the artifact.
+    - cache_dir (str): Directory for artifacts instead.
+    - optimize (bool): Return (and cache) the optimized program; run it
+      with an Interpreter that does not optimize again.
+    - write (bool): Write a missing or stale artifact.
+
+    Returns:
+    - A list of statement nodes.
+    """
+    key = source_key(code, optimize)
+    artifact = artifact_path(key, path, cache_dir, optimize)
+    if artifact is not None:
+        ast = read_artifact(artifact, key)
+        if ast is not None:
+            return ast
+    ast = parse(code)
+    if optimize:
+        ast = Optimizer().optimize(ast)
+    if artifact is not None and write and not os.environ.get(NO_WRITE_ENV):
+        write_artifact(artifact, key, ast)
+    return ast
+
+
+def load_file(path, cache_dir=None, optimize=False, write=True):
+    """Read and parse a .ms file through its artifact; see load_source()."""
+    with open(path, encoding='utf-8') as f:
+        code = f.read()
+    return load_source(code, path, cache_dir, optimize, write)
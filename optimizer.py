@@ -0,0 +1,508 @@
+# mathscript/optimizer.py
+
+from .lexer import RESERVED_PREFIX
+from .parser import *
+from .compiler import BINARY_OPERATORS, UNARY_OPERATORS
+from .memo import IMPURE_BUILTINS
+
+
+def format_expr(node):
+    """Render an expression node back to MathScript source, for reports."""
+    if isinstance(node, NumberNode):
+        return repr(node.value)
+    elif isinstance(node, StringNode):
+        return f'"{node.value}"'
+    elif isinstance(node, VarAccessNode):
+        return node.var_name
+    elif isinstance(node, BinOpNode):
+        return f'({format_expr(node.left_node)} {node.op_token.value} {format_expr(node.right_node)})'
+    elif isinstance(node, UnaryOpNode):
+        return f'({node.op_token.value} {format_expr(node.node)})'
+    elif isinstance(node, FuncCallNode):
+        return f'{node.func_name}({", ".join(format_expr(arg) for arg in node.args)})'
+    elif isinstance(node, ListNode):
+        return f'[{", ".join(format_expr(element) for element in node.elements)}]'
+    elif isinstance(node, IndexNode):
+        index = node.index
+        if isinstance(index, SliceNode):
+            start = '' if index.start is None else format_expr(index.start)
+            stop = '' if index.stop is None else format_expr(index.stop)
+            return f'{format_expr(node.target)}[{start}:{stop}]'
+        return f'{format_expr(node.target)}[{format_expr(index)}]'
+    elif isinstance(node, MethodCallNode):
+        return f'{format_expr(node.target)}.{node.method_name}({", ".join(format_expr(arg) for arg in node.args)})'
+    elif isinstance(node, SeriesNode):
+        symbol = '∏' if isinstance(node, ProductNode) else '∑'
+        return f'{symbol}({node.var_name}={format_expr(node.start)}, {format_expr(node.end)}, {format_expr(node.body)})'
+    elif isinstance(node, IntegralNode):
+        tol = '' if node.tol is None else f', {format_expr(node.tol)}'
+        return f'∫({node.var_name}={format_expr(node.start)}, {format_expr(node.end)}, {format_expr(node.body)}{tol})'
+    return type(node).__name__
+
+
+class Optimizer:
+    """
+    Rewrite a parsed program into a cheaper equivalent one.
+
+    Passes, in order:
+    - constant folding of BinOpNode/UnaryOpNode subtrees with constant
+      operands (folds that would raise are left for runtime);
+    - removal of if/while statements whose condition is constant;
+    - loop-invariant code motion: arithmetic over variables the loop never
+      assigns is computed once into a temporary before the loop;
+    - common subexpression elimination within a single statement.
+
+    The input AST is not modified. Every change is described in `changes`.
+
+    Hoisting keeps the loop's error behaviour: the temporaries are only
+    computed when the loop runs at least once (the loop is wrapped in a
+    check of its condition or iterable), and only from statements that run
+    unconditionally on each iteration before anything with side effects.
+    Arrays are mutable, so nothing is hoisted out of a loop that may mutate
+    one through a method call.
+
+    Temporaries are named with the lexer's RESERVED_PREFIX, so they cannot
+    clash with the program's names; top-level ones are globals while the
+    program runs and are dropped when it finishes (see Interpreter.load),
+    so the program's variables are the same as without optimizing.
+    """
+
+    def __init__(self, fold=True, dead_code=True, hoist=True, cse=True):
+        self.fold = fold
+        self.dead_code = dead_code
+        self.hoist = hoist
+        self.cse = cse
+        self.changes = []
+        self.temp_count = 0
+
+    def optimize(self, ast):
+        self.changes = []
+        self.user_functions = set()
+        self.collect_functions(ast)
+        # Any user function may mutate an array once the program calls methods
+        self.has_methods = False
+        self.has_methods = self.may_mutate(ast)
+        return self.optimize_block(ast)
+
+    def collect_functions(self, statements):
+        for node in statements:
+            if isinstance(node, FuncDefNode):
+                self.user_functions.add(node.func_name)
+                self.collect_functions(node.body)
+            for block in self.child_blocks(node):
+                self.collect_functions(block)
+
+    def child_blocks(self, node):
+        if isinstance(node, IfNode):
+            return [node.body, node.else_body or []]
+        elif isinstance(node, (WhileNode, ForNode)):
+            return [node.body]
+        return []
+
+    def may_mutate(self, statements):
+        """True if running `statements` may mutate an array in place."""
+        stack = list(statements)
+        while stack:
+            node = stack.pop()
+            if isinstance(node, MethodCallNode):
+                return True
+            if isinstance(node, FuncCallNode) and self.has_methods and node.func_name in self.user_functions:
+                return True
+            if isinstance(node, ASTNode):
+                for value in node.field_values():
+                    if isinstance(value, ASTNode):
+                        stack.append(value)
+                    elif isinstance(value, list):
+                        stack.extend(value)
+        return False
+
+    def report(self, message):
+        self.changes.append(message)
+
+    def new_temp(self, prefix):
+        name = f'{RESERVED_PREFIX}{prefix}{self.temp_count}'
+        self.temp_count += 1
+        return name
+
+    # Blocks and statements
+
+    def optimize_block(self, statements):
+        result = []
+        for stmt in statements:
+            line = getattr(stmt, 'line', None)
+            for new in self.optimize_statement(stmt):
+                # Replacements, hoisted temporaries included, report the
+                # line of the statement they came from
+                if line is not None and getattr(new, 'line', None) is None:
+                    new.line = line
+                result.append(new)
+        return result
+
+    def optimize_statement(self, node):
+        """Return the list of statements replacing `node`."""
+        if isinstance(node, VarAssignNode):
+            stmts = [VarAssignNode(node.var_name, self.optimize_expr(node.expr))]
+        elif isinstance(node, ReturnNode):
+            stmts = [ReturnNode(self.optimize_expr(node.expr))]
+        elif isinstance(node, IfNode):
+            condition = self.optimize_expr(node.condition)
+            known, value = self.static_value(condition)
+            if known and self.dead_code:
+                kept = node.body if value else (node.else_body or [])
+                self.report(f'removed dead {"else" if value else "if"} branch of if {format_expr(node.condition)}')
+                return self.optimize_block(kept)
+            else_body = self.optimize_block(node.else_body) if node.else_body else None
+            stmts = [IfNode(condition, self.optimize_block(node.body), else_body)]
+        elif isinstance(node, WhileNode):
+            condition = self.optimize_expr(node.condition)
+            known, value = self.static_value(condition)
+            if known and not value and self.dead_code:
+                self.report(f'removed while loop with false condition {format_expr(node.condition)}')
+                return []
+            loop = WhileNode(condition, self.optimize_block(node.body))
+            return self.hoist_invariants(loop) if self.hoist else [loop]
+        elif isinstance(node, ForNode):
+            loop = ForNode(node.var_name, self.optimize_expr(node.iterable), self.optimize_block(node.body))
+            return self.hoist_invariants(loop) if self.hoist else [loop]
+        elif isinstance(node, ParallelForNode):
+            # The body is optimized by the workers, after it was checked
+            return [ParallelForNode(node.var_name, self.optimize_expr(node.iterable), node.body,
+                                    node.reductions)]
+        elif isinstance(node, FuncDefNode):
+            return [FuncDefNode(node.func_name, node.param_names, self.optimize_block(node.body),
+                                list(node.annotations))]
+        else:
+            stmts = [self.optimize_expr(node)]
+        if self.cse and self.cse_safe(stmts[0]):
+            stmts = self.eliminate_common_subexpressions(stmts[0])
+        return stmts
+
+    # Constant folding
+
+    def constant_value(self, node):
+        if isinstance(node, (NumberNode, StringNode)):
+            return True, node.value
+        return False, None
+
+    def static_value(self, node):
+        """Evaluate a constant expression of any result type, e.g. (1 < 2)."""
+        if isinstance(node, BinOpNode):
+            func = BINARY_OPERATORS.get(node.op_token.value)
+            left_known, left = self.static_value(node.left_node)
+            right_known, right = self.static_value(node.right_node)
+            if func and left_known and right_known:
+                try:
+                    return True, func(left, right)
+                except Exception:
+                    pass
+            return False, None
+        elif isinstance(node, UnaryOpNode):
+            func = UNARY_OPERATORS.get(node.op_token.value)
+            known, value = self.static_value(node.node)
+            if func and known:
+                try:
+                    return True, func(value)
+                except Exception:
+                    pass
+            return False, None
+        return self.constant_value(node)
+
+    def make_constant(self, value):
+        if isinstance(value, float):
+            return NumberNode(value)
+        if isinstance(value, str):
+            node = StringNode('')
+            node.value = value
+            return node
+        return None
+
+    def optimize_expr(self, node):
+        if isinstance(node, BinOpNode):
+            left = self.optimize_expr(node.left_node)
+            right = self.optimize_expr(node.right_node)
+            folded = self.fold_binary(node.op_token.value, left, right)
+            if folded is not None:
+                return folded
+            return BinOpNode(left, node.op_token, right)
+        elif isinstance(node, UnaryOpNode):
+            operand = self.optimize_expr(node.node)
+            folded = self.fold_unary(node.op_token.value, operand)
+            if folded is not None:
+                return folded
+            return UnaryOpNode(node.op_token, operand)
+        elif isinstance(node, FuncCallNode):
+            return FuncCallNode(node.func_name, [self.optimize_expr(arg) for arg in node.args])
+        elif isinstance(node, (ListNode, IndexNode, MethodCallNode)):
+            return self.map_expr_children(node, self.optimize_expr)
+        elif isinstance(node, SeriesNode):
+            return type(node)(node.var_name, self.optimize_expr(node.start),
+                              self.optimize_expr(node.end), self.optimize_expr(node.body))
+        elif isinstance(node, IntegralNode):
+            return IntegralNode(node.var_name, self.optimize_expr(node.start), self.optimize_expr(node.end),
+                                self.optimize_expr(node.body),
+                                None if node.tol is None else self.optimize_expr(node.tol))
+        return node
+
+    def fold_binary(self, op, left, right):
+        func = BINARY_OPERATORS.get(op)
+        left_known, left_value = self.constant_value(left)
+        right_known, right_value = self.constant_value(right)
+        if not (self.fold and func and left_known and right_known):
+            return None
+        try:
+            value = func(left_value, right_value)
+        except Exception:
+            # Leave the error to runtime
+            return None
+        folded = self.make_constant(value)
+        if folded is not None:
+            self.report(f'folded ({format_expr(left)} {op} {format_expr(right)}) to {format_expr(folded)}')
+        return folded
+
+    def fold_unary(self, op, operand):
+        func = UNARY_OPERATORS.get(op)
+        known, value = self.constant_value(operand)
+        if not (self.fold and func and known):
+            return None
+        try:
+            value = func(value)
+        except Exception:
+            return None
+        folded = self.make_constant(value)
+        if folded is not None:
+            self.report(f'folded ({op} {format_expr(operand)}) to {format_expr(folded)}')
+        return folded
+
+    # Helpers shared by hoisting and CSE
+
+    def expr_key(self, node):
+        """Structural key of a side-effect-free arithmetic expression, or None."""
+        if isinstance(node, NumberNode):
+            return ('num', node.value)
+        elif isinstance(node, StringNode):
+            return ('str', node.value)
+        elif isinstance(node, VarAccessNode):
+            return ('var', node.var_name)
+        elif isinstance(node, BinOpNode):
+            left = self.expr_key(node.left_node)
+            right = self.expr_key(node.right_node)
+            if left is None or right is None:
+                return None
+            return ('bin', node.op_token.value, left, right)
+        elif isinstance(node, UnaryOpNode):
+            operand = self.expr_key(node.node)
+            if operand is None:
+                return None
+            return ('unary', node.op_token.value, operand)
+        return None
+
+    def key_variables(self, key, names):
+        if key[0] == 'var':
+            names.add(key[1])
+        elif key[0] == 'bin':
+            self.key_variables(key[2], names)
+            self.key_variables(key[3], names)
+        elif key[0] == 'unary':
+            self.key_variables(key[2], names)
+        return names
+
+    def is_compound(self, node):
+        return isinstance(node, (BinOpNode, UnaryOpNode))
+
+    def has_side_effects(self, node):
+        """True if evaluating `node` may call a user function or an I/O builtin."""
+        if isinstance(node, FuncCallNode):
+            if node.func_name in self.user_functions or node.func_name in IMPURE_BUILTINS:
+                return True
+            return any(self.has_side_effects(arg) for arg in node.args)
+        elif isinstance(node, BinOpNode):
+            return self.has_side_effects(node.left_node) or self.has_side_effects(node.right_node)
+        elif isinstance(node, UnaryOpNode):
+            return self.has_side_effects(node.node)
+        elif isinstance(node, (VarAssignNode, ReturnNode)):
+            return self.has_side_effects(node.expr)
+        elif isinstance(node, ListNode):
+            return any(self.has_side_effects(element) for element in node.elements)
+        elif isinstance(node, IndexNode):
+            index = node.index
+            parts = [index.start, index.stop] if isinstance(index, SliceNode) else [index]
+            return any(self.has_side_effects(part) for part in [node.target, *parts] if part is not None)
+        elif isinstance(node, SeriesNode):
+            return any(self.has_side_effects(part) for part in (node.start, node.end, node.body))
+        elif isinstance(node, IntegralNode):
+            parts = (node.start, node.end, node.body, node.tol)
+            return any(self.has_side_effects(part) for part in parts if part is not None)
+        elif isinstance(node, (NumberNode, StringNode, VarAccessNode)):
+            return False
+        return True
+
+    def map_expr(self, node, func):
+        """Rebuild an expression bottom-up, giving func a chance at each node."""
+        replaced = func(node)
+        if replaced is not None:
+            return replaced
+        if isinstance(node, BinOpNode):
+            return BinOpNode(self.map_expr(node.left_node, func), node.op_token,
+                             self.map_expr(node.right_node, func))
+        elif isinstance(node, UnaryOpNode):
+            return UnaryOpNode(node.op_token, self.map_expr(node.node, func))
+        return self.map_expr_children(node, func)
+
+    def map_statement(self, node, func):
+        if isinstance(node, VarAssignNode):
+            return VarAssignNode(node.var_name, self.map_expr(node.expr, func))
+        elif isinstance(node, ReturnNode):
+            return ReturnNode(self.map_expr(node.expr, func))
+        return self.map_expr(node, func)
+
+    # Loop-invariant code motion
+
+    def assigned_names(self, statements, names):
+        for node in statements:
+            if isinstance(node, VarAssignNode):
+                names.add(node.var_name)
+            elif isinstance(node, ForNode):
+                names.add(node.var_name)
+            elif isinstance(node, FuncDefNode):
+                names.add(node.func_name)
+            elif isinstance(node, ParallelForNode):
+                names.add(node.var_name)
+                names.update(name for _, name in node.reductions)
+            for block in self.child_blocks(node):
+                self.assigned_names(block, names)
+        return names
+
+    def hoist_invariants(self, loop):
+        if self.may_mutate(loop.body):
+            return [loop]
+        assigned = self.assigned_names(loop.body, set())
+        if isinstance(loop, ForNode):
+            assigned.add(loop.var_name)
+        elif self.has_side_effects(loop.condition) or self.expr_key(loop.condition) is None:
+            # The guard re-evaluates the condition, which must be harmless
+            return [loop]
+
+        hoisted = {}
+
+        def invariant(node):
+            if not self.is_compound(node):
+                return None
+            key = self.expr_key(node)
+            if key is None or self.key_variables(key, set()) & assigned:
+                return None
+            if not self.key_variables(key, set()):
+                return None
+            if key not in hoisted:
+                hoisted[key] = (self.new_temp('licm'), node)
+            return VarAccessNode(hoisted[key][0])
+
+        body = list(loop.body)
+        for i, stmt in enumerate(body):
+            # Only statements that run on every iteration, before any side
+            # effect, so a failing hoisted expression fails the same way
+            if not isinstance(stmt, (VarAssignNode, FuncCallNode, BinOpNode, UnaryOpNode)):
+                break
+            if self.has_side_effects(stmt):
+                break
+            body[i] = self.map_statement(stmt, invariant)
+
+        if not hoisted:
+            return [loop]
+
+        prelude = []
+        for temp, node in hoisted.values():
+            self.report(f'hoisted loop-invariant {format_expr(node)} into {temp}')
+            prelude.append(VarAssignNode(temp, node))
+
+        if isinstance(loop, WhileNode):
+            new_loop = WhileNode(loop.condition, body)
+            return [IfNode(loop.condition, prelude + [new_loop])]
+
+        items = self.new_temp('iter')
+        new_loop = ForNode(loop.var_name, VarAccessNode(items), body)
+        return [
+            VarAssignNode(items, loop.iterable),
+            # Not the truth value of the iterable, which raises for arrays
+            IfNode(FuncCallNode(RESERVED_PREFIX + 'has_items', [VarAccessNode(items)]),
+                   prelude + [new_loop]),
+        ]
+
+    # Common subexpression elimination
+
+    def cse_safe(self, stmt):
+        # Temporaries are computed before the statement, so nothing with
+        # side effects may run before them. An outermost call is fine:
+        # its arguments are evaluated before it runs.
+        expr = stmt.expr if isinstance(stmt, (VarAssignNode, ReturnNode)) else stmt
+        if isinstance(expr, FuncCallNode):
+            return not any(self.has_side_effects(arg) for arg in expr.args)
+        return not self.has_side_effects(expr)
+
+    def eliminate_common_subexpressions(self, stmt):
+        counts = {}
+
+        def count(node):
+            if self.is_compound(node):
+                key = self.expr_key(node)
+                if key is not None:
+                    counts[key] = counts.get(key, 0) + 1
+            return None
+
+        # Count every compound subexpression (map_expr visits children
+        # only when count returns None, so all of them are seen)
+        self.map_statement(stmt, count)
+        repeated = {key for key, n in counts.items() if n > 1}
+        if not repeated:
+            return [stmt]
+
+        temps = {}
+
+        def replace(node):
+            if not self.is_compound(node):
+                return None
+            key = self.expr_key(node)
+            if key not in repeated:
+                return None
+            if key not in temps:
+                # Replace nested repeats first so temps build on each other
+                inner = self.map_expr_children(node, replace)
+                temps[key] = (self.new_temp('cse'), inner)
+            return VarAccessNode(temps[key][0])
+
+        new_stmt = self.map_statement(stmt, replace)
+        prelude = []
+        for temp, node in temps.values():
+            self.report(f'reused common subexpression {format_expr(node)} as {temp}')
+            prelude.append(VarAssignNode(temp, node))
+        return prelude + [new_stmt]
+
+    def map_expr_children(self, node, func):
+        if isinstance(node, BinOpNode):
+            return BinOpNode(self.map_expr(node.left_node, func), node.op_token,
+                             self.map_expr(node.right_node, func))
+        elif isinstance(node, UnaryOpNode):
+            return UnaryOpNode(node.op_token, self.map_expr(node.node, func))
+        elif isinstance(node, FuncCallNode):
+            return FuncCallNode(node.func_name, [self.map_expr(arg, func) for arg in node.args])
+        elif isinstance(node, ListNode):
+            return ListNode([self.map_expr(element, func) for element in node.elements])
+        elif isinstance(node, IndexNode):
+            index = node.index
+            if isinstance(index, SliceNode):
+                index = SliceNode(None if index.start is None else self.map_expr(index.start, func),
+                                  None if index.stop is None else self.map_expr(index.stop, func))
+            else:
+                index = self.map_expr(index, func)
+            return IndexNode(self.map_expr(node.target, func), index)
+        elif isinstance(node, MethodCallNode):
+            return MethodCallNode(self.map_expr(node.target, func), node.method_name,
+                                  [self.map_expr(arg, func) for arg in node.args])
+        elif isinstance(node, SeriesNode):
+            # The body binds the index, so it is left alone: hoisting or
+            # sharing its subexpressions would evaluate them outside
+            return type(node)(node.var_name, self.map_expr(node.start, func),
+                              self.map_expr(node.end, func), node.body)
+        elif isinstance(node, IntegralNode):
+            return IntegralNode(node.var_name, self.map_expr(node.start, func), self.map_expr(node.end, func),
+                                node.body, None if node.tol is None else self.map_expr(node.tol, func))
+        return node
@@ -0,0 +1,354 @@
+# mathscript/parallel.py
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .parser import *
+from .arrays import Array
+
+# Stands for the chunk of items a worker iterates over; '@' cannot start
+# an identifier, so no script can name it
+ITEMS = '@items'
+
+# Chunks per worker process, so a slow chunk does not leave the others idle
+CHUNKS_PER_WORKER = 4
+
+# Operators that may update each kind of reduction, and its identity
+REDUCTIONS = {
+    'sum': (('+', '-'), 0.0),
+    'product': (('*', '/'), 1.0),
+}
+
+
+def node_children(node):
+    for value in node.field_values():
+        if isinstance(value, ASTNode):
+            yield value
+        elif isinstance(value, list):
+            yield from (item for item in value if isinstance(item, ASTNode))
+
+
+def expr_names(node, reads, calls):
+    """Add the variables an expression reads and the functions it calls."""
+    if isinstance(node, VarAccessNode):
+        reads.add(node.var_name)
+    elif isinstance(node, FuncCallNode):
+        calls.add(node.func_name)
+    elif isinstance(node, (SeriesNode, IntegralNode)):
+        # The body's index is bound by the node itself
+        body_reads = set()
+        expr_names(node.body, body_reads, calls)
+        body_reads.discard(node.var_name)
+        reads |= body_reads
+        for part in (node.start, node.end, getattr(node, 'tol', None)):
+            if part is not None:
+                expr_names(part, reads, calls)
+        return
+    for child in node_children(node):
+        expr_names(child, reads, calls)
+
+
+def function_names(node):
+    """(free variables, called functions) of a function definition."""
+    reads = set()
+    calls = set()
+    local = set(node.param_names)
+    stack = list(node.body)
+    while stack:
+        stmt = stack.pop()
+        if isinstance(stmt, VarAssignNode):
+            local.add(stmt.var_name)
+        elif isinstance(stmt, (ForNode, ParallelForNode)):
+            local.add(stmt.var_name)
+        elif isinstance(stmt, FuncDefNode):
+            local.add(stmt.func_name)
+        if isinstance(stmt, (IfNode, WhileNode, ForNode, ParallelForNode, FuncDefNode)):
+            stack.extend(stmt.body)
+            if isinstance(stmt, IfNode) and stmt.else_body:
+                stack.extend(stmt.else_body)
+            for part in (getattr(stmt, 'condition', None), getattr(stmt, 'iterable', None)):
+                if part is not None:
+                    expr_names(part, reads, calls)
+        else:
+            expr_names(stmt, reads, calls)
+    return reads - local, calls - local
+
+
+class ParallelChecker:
+    """
+    Check that the iterations of a parallel for loop are independent.
+
+    The body may assign only:
+    - private variables, whose first use in the body is an unconditional
+      top-level assignment, so every iteration starts by setting them;
+    - the declared reductions, only as `r = r + e` or `r = e + r` (`-`
+      too) for sum and `r = r * e` or `r = e * r` (`/` too, r on the
+      left) for product, where e does not read r.
+
+    It may not read a reduction anywhere else, read a variable it assigns
+    before assigning it, call a method on a shared variable, assign the
+    loop variable, define functions, return, or nest another parallel
+    loop. Every function it calls must be a builtin or a top-level
+    function of the program.
+
+    check() raises SyntaxError or returns the names the body reads from
+    outside, including those read by the functions it calls.
+    """
+
+    def __init__(self, functions, builtins):
+        self.functions = functions
+        self.builtins = builtins
+
+    def check(self, node):
+        self.var_name = node.var_name
+        self.reductions = {}
+        for kind, name in node.reductions:
+            if name in self.reductions or name == node.var_name:
+                raise SyntaxError(f"parallel for: '{name}' cannot be a reduction twice or the loop variable")
+            self.reductions[name] = kind
+        self.assigned = set()
+        self.collect_assigned(node.body)
+        self.private = set()
+        self.reads = set()
+        self.calls = set()
+        self.check_block(node.body, True)
+
+        free = self.reads - self.private - {node.var_name}
+        # Follow the calls into top-level functions for the globals they read
+        pending = list(self.calls)
+        seen = set()
+        while pending:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            func = self.functions.get(name)
+            if func is None:
+                if name not in self.builtins:
+                    raise SyntaxError(f"parallel for: '{name}' is not a top-level function or builtin")
+                continue
+            reads, calls = function_names(func)
+            free |= reads
+            pending.extend(calls)
+        return free - set(self.functions)
+
+    def collect_assigned(self, statements):
+        for stmt in statements:
+            if isinstance(stmt, VarAssignNode):
+                self.assigned.add(stmt.var_name)
+            elif isinstance(stmt, ForNode):
+                self.assigned.add(stmt.var_name)
+            if isinstance(stmt, (IfNode, WhileNode, ForNode)):
+                self.collect_assigned(stmt.body)
+                if isinstance(stmt, IfNode) and stmt.else_body:
+                    self.collect_assigned(stmt.else_body)
+
+    def fail(self, message):
+        raise SyntaxError(f'parallel for: {message}')
+
+    def check_block(self, statements, top):
+        for stmt in statements:
+            if isinstance(stmt, VarAssignNode):
+                if stmt.var_name in self.reductions:
+                    self.check_reduction(stmt)
+                    continue
+                self.check_expr(stmt.expr)
+                self.check_write(stmt.var_name, top)
+            elif isinstance(stmt, ForNode):
+                self.check_expr(stmt.iterable)
+                self.check_write(stmt.var_name, top)
+                self.check_block(stmt.body, False)
+            elif isinstance(stmt, WhileNode):
+                self.check_expr(stmt.condition)
+                self.check_block(stmt.body, False)
+            elif isinstance(stmt, IfNode):
+                self.check_expr(stmt.condition)
+                self.check_block(stmt.body, False)
+                if stmt.else_body:
+                    self.check_block(stmt.else_body, False)
+            elif isinstance(stmt, ParallelForNode):
+                self.fail('loops cannot be nested')
+            elif isinstance(stmt, FuncDefNode):
+                self.fail(f"the body cannot define function '{stmt.func_name}'")
+            elif isinstance(stmt, ReturnNode):
+                self.fail('the body cannot return')
+            else:
+                self.check_expr(stmt)
+
+    def check_write(self, name, top):
+        if name == self.var_name:
+            self.fail(f"the body assigns the loop variable '{name}'")
+        if name in self.private:
+            return
+        if not top:
+            self.fail(f"writes to shared variable '{name}'; assign it at the top of the body first "
+                      f"or declare a reduction")
+        self.private.add(name)
+
+    def check_reduction(self, stmt):
+        name = stmt.var_name
+        ops, _ = REDUCTIONS[self.reductions[name]]
+        expr = stmt.expr
+        if isinstance(expr, BinOpNode) and expr.op_token.value in ops:
+            left, right = expr.left_node, expr.right_node
+            if isinstance(left, VarAccessNode) and left.var_name == name:
+                self.check_expr(right)
+                return
+            if (isinstance(right, VarAccessNode) and right.var_name == name
+                    and expr.op_token.value == ops[0]):
+                self.check_expr(left)
+                return
+        self.fail(f"{self.reductions[name]} reduction '{name}' must be updated as "
+                  f"{name} = {name} {ops[0]} expression")
+
+    def check_expr(self, node):
+        reads = set()
+        calls = set()
+        expr_names(node, reads, calls)
+        for name in reads:
+            if name in self.reductions:
+                self.fail(f"reads reduction '{name}' outside its update")
+            if name in self.assigned and name not in self.private:
+                self.fail(f"reads '{name}' before the iteration assigns it")
+        stack = [node]
+        while stack:
+            expr = stack.pop()
+            if isinstance(expr, MethodCallNode):
+                target = expr.target
+                if not (isinstance(target, VarAccessNode) and target.var_name in self.private):
+                    self.fail(f"calls '{expr.method_name}' on a shared value")
+            stack.extend(node_children(expr))
+        self.reads |= reads
+        self.calls |= calls
+
+
+class ParallelWorker:
+    """
+    Runs chunks of the parallel loops of one program.
+
+    Built once per worker process from the loop bodies and the program's
+    top-level functions; each body is compiled once, as an ordinary for
+    loop over its chunk of items.
+    """
+
+    def __init__(self, mode, options, functions, loops):
+        from .interpreter import Interpreter, Context
+        self.interpreter = Interpreter(mode, **options)
+        self.globals = Context()
+        self.interpreter.load(functions)(self.globals)
+        self.functions = dict(self.globals.variables)
+        self.loops = [(self.interpreter.load([ForNode(var_name, VarAccessNode(ITEMS), body)]), reductions)
+                      for var_name, body, reductions in loops]
+
+    def run(self, index, items, values):
+        program, reductions = self.loops[index]
+        # The functions read globals through the Context they were defined
+        # in, so each chunk runs directly in it, reset to the shipped values
+        variables = self.globals.variables
+        variables.clear()
+        variables.update(self.functions)
+        variables.update(values)
+        for kind, name in reductions:
+            variables[name] = REDUCTIONS[kind][1]
+        variables[ITEMS] = items
+        program(self.globals)
+        return [variables[name] for _, name in reductions]
+
+
+# The worker of each pool process, built once by init_worker
+worker = None
+
+
+def init_worker(*args):
+    global worker
+    worker = ParallelWorker(*args)
+
+
+def run_chunk(index, items, values):
+    return worker.run(index, items, values)
+
+
+class ParallelRunner:
+    """
+    Executes the parallel for loops of one loaded program.
+
+    The loops are checked when the program is loaded. The process pool is
+    started by the first loop that runs, and its workers receive the loop
+    bodies and top-level functions once, through the pool initializer;
+    each run then only sends chunks of items and the values of the
+    variables the body reads. `workers` of 0 (or a single CPU) runs the
+    chunks in this process instead.
+
+    Each chunk starts its reductions at 0 (sum) or 1 (product); the
+    partial results are combined in chunk order with the values the
+    reductions had before the loop. The loop variable is left at the last
+    item; variables private to the body are not copied back.
+    """
+
+    def __init__(self, interpreter, functions, nodes, workers=None):
+        checker = ParallelChecker(functions, set(interpreter.builtins))
+        self.nodes = list(nodes)
+        self.free_names = [checker.check(node) for node in self.nodes]
+        bodies = [(node.var_name, node.body, node.reductions) for node in self.nodes]
+        options = {'memoize': interpreter.memoize, 'memo_size': interpreter.memo_size,
+                   'optimize': interpreter.optimize, 'vectorize': interpreter.vectorize}
+        self.init_args = (interpreter.mode, options, list(functions.values()), bodies)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.pool = None
+        self.local = None
+
+    def lookup_names(self, index):
+        """Every name run() may look up for loop `index`."""
+        return self.free_names[index] | {name for _, name in self.nodes[index].reductions}
+
+    def run(self, index, items, lookup):
+        """Run loop `index` over `items`; return {name: value} to assign after it."""
+        node = self.nodes[index]
+        if not hasattr(items, '__iter__'):
+            raise TypeError(f"Object '{items}' is not iterable")
+        if not isinstance(items, (range, list, Array)):
+            items = list(items)
+        if not len(items):
+            return {}
+        initial = {}
+        for kind, name in node.reductions:
+            value = lookup(name)
+            if value is None:
+                raise NameError(f"Reduction variable '{name}' is not defined")
+            initial[name] = value
+        values = {}
+        for name in self.free_names[index]:
+            value = lookup(name)
+            if value is not None and not callable(value):
+                values[name] = value
+
+        workers = min(self.workers, len(items))
+        chunk_size = max(1, math.ceil(len(items) / max(1, workers * CHUNKS_PER_WORKER)))
+        chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+        if workers <= 1:
+            if self.local is None:
+                self.local = ParallelWorker(*self.init_args)
+            partials = [self.local.run(index, chunk, values) for chunk in chunks]
+        else:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                                initargs=self.init_args)
+            futures = [self.pool.submit(run_chunk, index, chunk, values) for chunk in chunks]
+            partials = [future.result() for future in futures]
+
+        updates = {}
+        for position, (kind, name) in enumerate(node.reductions):
+            total = initial[name]
+            for partial in partials:
+                total = total + partial[position] if kind == 'sum' else total * partial[position]
+            updates[name] = total
+        updates[node.var_name] = items[-1]
+        return updates
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -2,93 +2,249 @@
 
 from .lexer import Token
 
+# One shared token per operator, so nodes do not keep the token of every
+# occurrence (with its position) alive
+OPERATOR_TOKENS = {}
+
+def operator_token(tok):
+    shared = OPERATOR_TOKENS.get(tok.value)
+    if shared is None:
+        shared = OPERATOR_TOKENS[tok.value] = Token('OP', tok.value)
+    return shared
+
 class ASTNode:
-    pass
+    # `line` is the source line of a statement node, set by the parser (and
+    # kept by the optimizer); expression nodes leave it unset
+    __slots__ = ('line',)
+
+    # Attribute names of each node class, its base classes' first
+    fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.fields = cls.__base__.fields + tuple(cls.__dict__.get('__slots__', ()))
+
+    def field_values(self):
+        """The node's attribute values, in `fields` order."""
+        return [getattr(self, name) for name in self.fields]
 
 class NumberNode(ASTNode):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = float(value)
 
 class StringNode(ASTNode):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value.strip('"')
 
 class VarAccessNode(ASTNode):
+    __slots__ = ('var_name',)
+
     def __init__(self, var_name):
         self.var_name = var_name
 
 class VarAssignNode(ASTNode):
+    __slots__ = ('var_name', 'expr')
+
     def __init__(self, var_name, expr):
         self.var_name = var_name
         self.expr = expr
 
 class BinOpNode(ASTNode):
+    __slots__ = ('left_node', 'op_token', 'right_node')
+
     def __init__(self, left_node, op_token, right_node):
         self.left_node = left_node
         self.op_token = op_token
         self.right_node = right_node
 
 class UnaryOpNode(ASTNode):
+    __slots__ = ('op_token', 'node')
+
     def __init__(self, op_token, node):
         self.op_token = op_token
         self.node = node
 
 class IfNode(ASTNode):
+    __slots__ = ('condition', 'body', 'else_body')
+
     def __init__(self, condition, body, else_body=None):
         self.condition = condition
         self.body = body
         self.else_body = else_body
 
 class WhileNode(ASTNode):
+    __slots__ = ('condition', 'body')
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
 
 class ForNode(ASTNode):
+    __slots__ = ('var_name', 'iterable', 'body')
+
     def __init__(self, var_name, iterable, body):
         self.var_name = var_name
         self.iterable = iterable
         self.body = body
 
+class ParallelForNode(ASTNode):
+    __slots__ = ('var_name', 'iterable', 'body', 'reductions')
+
+    def __init__(self, var_name, iterable, body, reductions):
+        self.var_name = var_name
+        self.iterable = iterable
+        self.body = body
+        self.reductions = reductions  # [(kind, name)], kind 'sum' or 'product'
+
 class FuncDefNode(ASTNode):
-    def __init__(self, func_name, param_names, body):
+    __slots__ = ('func_name', 'param_names', 'body', 'annotations')
+
+    def __init__(self, func_name, param_names, body, annotations=None):
         self.func_name = func_name
         self.param_names = param_names
         self.body = body
+        self.annotations = annotations or []
 
 class FuncCallNode(ASTNode):
+    __slots__ = ('func_name', 'args')
+
     def __init__(self, func_name, args):
         self.func_name = func_name
         self.args = args
 
+class ListNode(ASTNode):
+    __slots__ = ('elements',)
+
+    def __init__(self, elements):
+        self.elements = elements
+
+class IndexNode(ASTNode):
+    __slots__ = ('target', 'index')
+
+    def __init__(self, target, index):
+        self.target = target
+        self.index = index
+
+class SliceNode(ASTNode):
+    __slots__ = ('start', 'stop')
+
+    def __init__(self, start=None, stop=None):
+        self.start = start
+        self.stop = stop
+
+class MethodCallNode(ASTNode):
+    __slots__ = ('target', 'method_name', 'args')
+
+    def __init__(self, target, method_name, args):
+        self.target = target
+        self.method_name = method_name
+        self.args = args
+
+class SeriesNode(ASTNode):
+    __slots__ = ('var_name', 'start', 'end', 'body')
+
+    def __init__(self, var_name, start, end, body):
+        self.var_name = var_name
+        self.start = start
+        self.end = end
+        self.body = body
+
+class SumNode(SeriesNode):
+    __slots__ = ()
+
+class ProductNode(SeriesNode):
+    __slots__ = ()
+
+class IntegralNode(ASTNode):
+    __slots__ = ('var_name', 'start', 'end', 'body', 'tol')
+
+    def __init__(self, var_name, start, end, body, tol=None):
+        self.var_name = var_name
+        self.start = start
+        self.end = end
+        self.body = body
+        self.tol = tol
+
 class ReturnNode(ASTNode):
+    __slots__ = ('expr',)
+
     def __init__(self, expr):
         self.expr = expr
 
+# The expression grammar, one entry per operator: its precedence (higher
+# binds tighter), whether it groups to the right, and the node it builds.
+# Prefix operators bind tighter than every binary one but ^, so -x^2 is
+# -(x^2) and 2^-1 is 2^(-1). `and` and `or` share the lowest level and
+# group to the left, as they always have: a or b and c is (a or b) and c.
+INFIX_OPERATORS = {
+    'or':  (1, False, BinOpNode),
+    'and': (1, False, BinOpNode),
+    '==':  (3, False, BinOpNode),
+    '!=':  (3, False, BinOpNode),
+    '<':   (3, False, BinOpNode),
+    '>':   (3, False, BinOpNode),
+    '<=':  (3, False, BinOpNode),
+    '>=':  (3, False, BinOpNode),
+    '+':   (4, False, BinOpNode),
+    '-':   (4, False, BinOpNode),
+    '*':   (5, False, BinOpNode),
+    '/':   (5, False, BinOpNode),
+    '%':   (5, False, BinOpNode),
+    '^':   (7, True, BinOpNode),
+}
+
+PREFIX_OPERATORS = {
+    '+':   (6, UnaryOpNode),
+    '-':   (6, UnaryOpNode),
+    'not': (6, UnaryOpNode),
+}
+
 class Parser:
+    """
+    Builds the AST from a list or any iterable of tokens, such as
+    Lexer.stream(). Tokens are consumed one at a time with a single token
+    of lookahead, so statements() can yield each top-level statement as
+    soon as it is complete, before the rest of the source has been read.
+    """
+
     def __init__(self, tokens):
-        self.tokens = tokens
-        self.tok_idx = -1
+        self.tokens = iter(tokens)
         self.current_tok = None
+        self.next_tok = None
         self.advance()
 
     def advance(self):
-        self.tok_idx += 1
-        if self.tok_idx < len(self.tokens):
-            self.current_tok = self.tokens[self.tok_idx]
+        if self.next_tok is not None:
+            self.current_tok = self.next_tok
+            self.next_tok = None
+        else:
+            # Past the end, current_tok stays at EOF
+            self.current_tok = next(self.tokens, self.current_tok)
         return self.current_tok
 
     def parse(self):
-        statements = []
+        return list(self.statements())
+
+    def statements(self):
+        """Yield the top-level statements one at a time."""
         while self.current_tok.type != 'EOF':
             stmt = self.statement()
-            if stmt is not None:
-                statements.append(stmt)
-            else:
+            if stmt is None:
                 break
-        return statements
+            yield stmt
 
     def statement(self):
+        line = self.current_tok.line
+        stmt = self.bare_statement()
+        if stmt is not None:
+            stmt.line = line
+        return stmt
+
+    def bare_statement(self):
         if self.current_tok.type == 'KEYWORD':
             if self.current_tok.value == 'function':
                 return self.func_def()
@@ -104,7 +260,12 @@ class Parser:
                 return self.print_statement()
             else:
                 raise SyntaxError(f"Unknown keyword '{self.current_tok.value}'")
+        elif self.current_tok.type == 'OP' and self.current_tok.value == '@':
+            return self.annotated_func_def()
         elif self.current_tok.type == 'IDENT':
+            if (self.current_tok.value == 'parallel' and self.peek_next().type == 'KEYWORD'
+                    and self.peek_next().value == 'for'):
+                return self.parallel_for_statement()
             if self.peek_next().type == 'OP' and self.peek_next().value == '=':
                 return self.var_assign()
             elif self.peek_next().type == 'OP' and self.peek_next().value == '(':
@@ -121,25 +282,77 @@ class Parser:
         expr = self.expr()
         return VarAssignNode(var_name, expr)
 
-    def expr(self):
-        return self.bin_op(self.comp_expr, [('OP', 'and'), ('OP', 'or')])
-
-    def comp_expr(self):
-        return self.bin_op(self.arith_expr, [('OP', '=='), ('OP', '!='), ('OP', '<'), ('OP', '>'), ('OP', '<='), ('OP', '>=')])
-
-    def arith_expr(self):
-        return self.bin_op(self.term, [('OP', '+'), ('OP', '-')])
-
-    def term(self):
-        return self.bin_op(self.factor, [('OP', '*'), ('OP', '/')])
-
-    def factor(self):
+    def expr(self, min_precedence=0):
+        # Precedence climbing: parse an operand, then keep absorbing
+        # operators that bind tighter than the caller's one
         tok = self.current_tok
-        if tok.type == 'OP' and tok.value in ('+', '-', 'not'):
+        prefix = PREFIX_OPERATORS.get(tok.value) if tok.type == 'OP' else None
+        if prefix is not None:
+            precedence, node_class = prefix
+            self.advance()
+            left = node_class(operator_token(tok), self.expr(precedence))
+        else:
+            left = self.postfix(self.atom())
+        while True:
+            tok = self.current_tok
+            infix = INFIX_OPERATORS.get(tok.value) if tok.type == 'OP' else None
+            if infix is None:
+                return left
+            precedence, right_assoc, node_class = infix
+            if precedence <= min_precedence:
+                return left
             self.advance()
-            node = self.factor()
-            return UnaryOpNode(tok, node)
-        elif tok.type == 'NUMBER':
+            right = self.expr(precedence - 1 if right_assoc else precedence)
+            left = node_class(left, operator_token(tok), right)
+
+    def postfix(self, node):
+        # Indexing, slicing and method calls: x[i], x[a:b], x.append(v)
+        while self.current_tok.type == 'OP' and self.current_tok.value in ('[', '.'):
+            if self.current_tok.value == '[':
+                self.advance()  # Skip '['
+                node = IndexNode(node, self.subscript())
+                if self.current_tok.type != 'OP' or self.current_tok.value != ']':
+                    raise SyntaxError('Expected "]" after index')
+                self.advance()  # Skip ']'
+            else:
+                self.advance()  # Skip '.'
+                if self.current_tok.type != 'IDENT':
+                    raise SyntaxError('Expected method name after "."')
+                method_name = self.current_tok.value
+                self.advance()
+                if self.current_tok.type != 'OP' or self.current_tok.value != '(':
+                    raise SyntaxError(f'Expected "(" after method name {method_name}')
+                node = MethodCallNode(node, method_name, self.arguments())
+        return node
+
+    def subscript(self):
+        start = None
+        if not (self.current_tok.type == 'OP' and self.current_tok.value == ':'):
+            start = self.expr()
+            if not (self.current_tok.type == 'OP' and self.current_tok.value == ':'):
+                return start
+        self.advance()  # Skip ':'
+        stop = None
+        if not (self.current_tok.type == 'OP' and self.current_tok.value == ']'):
+            stop = self.expr()
+        return SliceNode(start, stop)
+
+    def arguments(self):
+        self.advance()  # Skip '('
+        args = []
+        if self.current_tok.type != 'OP' or self.current_tok.value != ')':
+            args.append(self.expr())
+            while self.current_tok.type == 'OP' and self.current_tok.value == ',':
+                self.advance()
+                args.append(self.expr())
+        if self.current_tok.type != 'OP' or self.current_tok.value != ')':
+            raise SyntaxError('Expected ")" after arguments')
+        self.advance()  # Skip ')'
+        return args
+
+    def atom(self):
+        tok = self.current_tok
+        if tok.type == 'NUMBER':
             self.advance()
             return NumberNode(tok.value)
         elif tok.type == 'STRING':
@@ -159,6 +372,20 @@ class Parser:
                 return expr
             else:
                 raise SyntaxError('Expected ")"')
+        elif tok.type == 'OP' and tok.value in ('∑', '∏', '∫'):
+            return self.series()
+        elif tok.type == 'OP' and tok.value == '[':
+            self.advance()  # Skip '['
+            elements = []
+            if self.current_tok.type != 'OP' or self.current_tok.value != ']':
+                elements.append(self.expr())
+                while self.current_tok.type == 'OP' and self.current_tok.value == ',':
+                    self.advance()
+                    elements.append(self.expr())
+            if self.current_tok.type != 'OP' or self.current_tok.value != ']':
+                raise SyntaxError('Expected "]" after list elements')
+            self.advance()  # Skip ']'
+            return ListNode(elements)
         else:
             raise SyntaxError(f'Unexpected token {tok}')
 
@@ -186,20 +413,54 @@ class Parser:
         body = self.block()
         return FuncDefNode(func_name, param_names, body)
 
+    def annotated_func_def(self):
+        annotations = []
+        while self.current_tok.type == 'OP' and self.current_tok.value == '@':
+            self.advance()  # Skip '@'
+            if self.current_tok.type != 'IDENT':
+                raise SyntaxError('Expected annotation name after "@"')
+            annotations.append(self.current_tok.value)
+            self.advance()
+        if self.current_tok.type != 'KEYWORD' or self.current_tok.value != 'function':
+            raise SyntaxError('Expected function definition after annotation')
+        node = self.func_def()
+        node.annotations = annotations
+        return node
+
     def func_call(self):
         func_name = self.current_tok.value
         self.advance()  # Skip function name
-        self.advance()  # Skip '('
-        args = []
-        if self.current_tok.type != 'OP' or self.current_tok.value != ')':
-            args.append(self.expr())
-            while self.current_tok.type == 'OP' and self.current_tok.value == ',':
-                self.advance()
-                args.append(self.expr())
+        return FuncCallNode(func_name, self.arguments())
+
+    def series(self):
+        # ∑(i=1, n, body) and ∏(i=1, n, body), bounds inclusive, and
+        # ∫(x=a, b, body) with an optional tolerance after the body
+        symbol = self.current_tok.value
+        node_class = {'∑': SumNode, '∏': ProductNode, '∫': IntegralNode}[symbol]
+        self.advance()  # Skip '∑', '∏' or '∫'
+        if self.current_tok.type != 'OP' or self.current_tok.value != '(':
+            raise SyntaxError(f'Expected "(" after {symbol}')
+        self.advance()
+        if self.current_tok.type != 'IDENT':
+            raise SyntaxError('Expected index variable name')
+        var_name = self.current_tok.value
+        self.advance()
+        if self.current_tok.type != 'OP' or self.current_tok.value != '=':
+            raise SyntaxError('Expected "=" after index variable')
+        self.advance()
+        parts = [self.expr()]
+        for _ in range(2):
+            if self.current_tok.type != 'OP' or self.current_tok.value != ',':
+                raise SyntaxError('Expected ","')
+            self.advance()
+            parts.append(self.expr())
+        if symbol == '∫' and self.current_tok.type == 'OP' and self.current_tok.value == ',':
+            self.advance()
+            parts.append(self.expr())
         if self.current_tok.type != 'OP' or self.current_tok.value != ')':
-            raise SyntaxError('Expected ")" after arguments')
-        self.advance()  # Skip ')'
-        return FuncCallNode(func_name, args)
+            raise SyntaxError('Expected ")"')
+        self.advance()
+        return node_class(var_name, *parts)
 
     def if_statement(self):
         self.advance()  # Skip 'if'
@@ -217,7 +478,7 @@ class Parser:
         body = self.block()
         return WhileNode(condition, body)
 
-    def for_statement(self):
+    def for_statement(self, parallel=False):
         self.advance()  # Skip 'for'
         var_name = self.current_tok.value
         self.advance()  # Skip variable name
@@ -225,9 +486,38 @@ class Parser:
             raise SyntaxError('Expected "in" after variable name in for loop')
         self.advance()  # Skip 'in'
         iterable = self.expr()
+        if parallel:
+            reductions = self.reductions()
+            return ParallelForNode(var_name, iterable, self.block(), reductions)
         body = self.block()
         return ForNode(var_name, iterable, body)
 
+    def parallel_for_statement(self):
+        # parallel for i in items reduce sum into a, product into b { ... }
+        self.advance()  # Skip 'parallel'
+        return self.for_statement(parallel=True)
+
+    def reductions(self):
+        reductions = []
+        while self.current_tok.type == 'IDENT' and self.current_tok.value == 'reduce':
+            self.advance()  # Skip 'reduce'
+            while True:
+                if self.current_tok.type != 'IDENT' or self.current_tok.value not in ('sum', 'product'):
+                    raise SyntaxError('Expected "sum" or "product" after "reduce"')
+                kind = self.current_tok.value
+                self.advance()
+                if self.current_tok.type != 'IDENT' or self.current_tok.value != 'into':
+                    raise SyntaxError(f'Expected "into" after "{kind}"')
+                self.advance()  # Skip 'into'
+                if self.current_tok.type != 'IDENT':
+                    raise SyntaxError('Expected reduction variable name')
+                reductions.append((kind, self.current_tok.value))
+                self.advance()
+                if self.current_tok.type != 'OP' or self.current_tok.value != ',':
+                    break
+                self.advance()  # Skip ','
+        return reductions
+
     def return_statement(self):
         self.advance()  # Skip 'return'
         expr = self.expr()
@@ -260,17 +550,9 @@ class Parser:
         self.advance()  # Skip '}'
         return statements
 
-    def bin_op(self, func, ops):
-        left = func()
-        while any(self.current_tok.type == op[0] and self.current_tok.value == op[1] for op in ops):
-            op_tok = self.current_tok
-            self.advance()
-            right = func()
-            left = BinOpNode(left, op_tok, right)
-        return left
-
     def peek_next(self):
-        if self.tok_idx + 1 < len(self.tokens):
-            return self.tokens[self.tok_idx + 1]
-        else:
-            return Token('EOF')
+        if self.next_tok is None:
+            self.next_tok = next(self.tokens, None)
+            if self.next_tok is None:
+                return Token('EOF')
+        return self.next_tok
@@ -0,0 +1,370 @@
+# mathscript/profiler.py
+
+import sys
+import time
+import tracemalloc
+
+# Name of the frame that stands for the program's top level
+MODULE = '<module>'
+
+# Allocation sites listed per run by MemoryProfiler.summary()
+MEMORY_SITES = 10
+
+
+class Profiler:
+    """
+    Records where a program spends its time: pass one as
+    Interpreter(mode='tree', profiler=...).
+
+    Collected, cumulatively over every run of the interpreter:
+    - lines: {line: [count, inclusive, exclusive]} for each source line
+      holding a statement;
+    - functions: {name: [calls, inclusive, exclusive]}, MODULE included;
+    - nodes: {node type name: evaluations};
+    - stacks: {(MODULE, function, ...): exclusive seconds}, the collapsed
+      call stacks flamegraph tools read.
+
+    A statement's exclusive time leaves out the statements nested in it,
+    including those of the functions it calls; a function's leaves out the
+    functions it calls. Inclusive time counts recursive activations once.
+    Times are seconds and include the profiler's own overhead, so compare
+    them with each other rather than with unprofiled runs.
+    """
+
+    def __init__(self, timer=time.perf_counter):
+        self.timer = timer
+        self.lines = {}
+        self.functions = {}
+        self.nodes = {}
+        self.stacks = {}
+        # Open statements and calls: [key, start, time spent in nested ones]
+        self.line_stack = []
+        self.call_stack = []
+        self.call_names = []
+
+    def instrument(self, interpreter):
+        """Route the interpreter's visit() and function calls through the profiler."""
+        visit = interpreter.visit
+        call_function = interpreter.call_function
+        nodes = self.nodes
+        enter_line = self.enter_line
+        exit_line = self.exit_line
+
+        def profiled_visit(node):
+            name = type(node).__name__
+            nodes[name] = nodes.get(name, 0) + 1
+            line = getattr(node, 'line', None)
+            if line is None:
+                return visit(node)
+            enter_line(line)
+            try:
+                return visit(node)
+            finally:
+                exit_line()
+
+        def profiled_call(func, values):
+            self.enter_call(func.name)
+            try:
+                return call_function(func, values)
+            finally:
+                self.exit_call()
+
+        # Instance attributes shadow the methods, so every internal
+        # self.visit() and self.call_function() goes through these
+        interpreter.visit = profiled_visit
+        interpreter.call_function = profiled_call
+
+    def start(self):
+        """Prepare for runs that are not just the interpreter's; timing needs nothing."""
+
+    def stop(self):
+        pass
+
+    def enter_line(self, line):
+        self.line_stack.append([line, self.timer(), 0.0])
+
+    def exit_line(self):
+        line, start, nested = self.line_stack.pop()
+        elapsed = self.timer() - start
+        stats = self.lines.get(line)
+        if stats is None:
+            stats = self.lines[line] = [0, 0.0, 0.0]
+        stats[0] += 1
+        if not any(entry[0] == line for entry in self.line_stack):
+            stats[1] += elapsed
+        stats[2] += elapsed - nested
+        if self.line_stack:
+            self.line_stack[-1][2] += elapsed
+
+    def enter_call(self, name):
+        self.call_stack.append([name, self.timer(), 0.0])
+        self.call_names.append(name)
+
+    def exit_call(self):
+        stack = tuple(self.call_names)
+        self.call_names.pop()
+        name, start, nested = self.call_stack.pop()
+        elapsed = self.timer() - start
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        if name not in self.call_names:
+            stats[1] += elapsed
+        stats[2] += elapsed - nested
+        self.stacks[stack] = self.stacks.get(stack, 0.0) + elapsed - nested
+        if self.call_stack:
+            self.call_stack[-1][2] += elapsed
+
+    def summary(self, source=None, limit=None):
+        """
+        The profile as plain data, hottest first (JSON-serializable).
+
+        Parameters:
+        - source (str): The program's source, to show each line's text.
+        - limit (int): Keep only this many lines, functions and node types.
+
+        Returns:
+        - A dict of 'lines', 'functions' and 'nodes' lists, 'stacks', the
+          collapsed stacks as [frames, microseconds] pairs, and 'total',
+          the exclusive seconds of all functions, limited or not.
+        """
+        texts = source.splitlines() if source is not None else []
+        lines = []
+        for line, (count, inclusive, exclusive) in sorted(self.lines.items(), key=lambda item: -item[1][2]):
+            entry = {'line': line, 'count': count, 'inclusive': inclusive, 'exclusive': exclusive}
+            if 0 < line <= len(texts):
+                entry['source'] = texts[line - 1].strip()
+            lines.append(entry)
+        functions = [{'name': name, 'calls': calls, 'inclusive': inclusive, 'exclusive': exclusive}
+                     for name, (calls, inclusive, exclusive)
+                     in sorted(self.functions.items(), key=lambda item: -item[1][2])]
+        nodes = sorted(self.nodes.items(), key=lambda item: -item[1])
+        return {
+            'lines': lines[:limit],
+            'functions': functions[:limit],
+            'nodes': [{'type': name, 'count': count} for name, count in nodes[:limit]],
+            'stacks': [[';'.join(stack), round(seconds * 1e6)] for stack, seconds in self.stacks.items()],
+            'total': sum(exclusive for _, _, exclusive in self.functions.values()),
+        }
+
+
+class MemoryProfiler(Profiler):
+    """
+    Records where a program allocates memory, with tracemalloc; used like
+    Profiler, whose lines, functions, nodes and stacks it fills with
+    [count, net bytes inclusive, net bytes exclusive, blocks exclusive,
+    peak bytes] for lines and functions, and net bytes for stacks.
+
+    Net bytes are what a statement or call left allocated when it
+    finished (negative if it freed more than it allocated), and blocks
+    the number of memory blocks, roughly objects, it left alive. Peak is
+    the most it ever had allocated above its starting point while running,
+    which catches temporaries that net bytes miss.
+
+    Each top-level run also goes into `runs`: its absolute peak, the bytes
+    traced before it (the loaded program, if tracing started before
+    parsing; see start()), its net growth and the Python allocation sites
+    that grew the most, e.g. Context frames or list storage.
+
+    Tracing starts and stops around each run unless start() was called.
+    """
+
+    def __init__(self):
+        super().__init__(timer=None)
+        self.runs = []
+        self.started = False
+        # Whether the current run started tracing, and its first snapshot
+        self.run_started = False
+        self.baseline = None
+        # Open statements and calls of both stacks, innermost last, for
+        # carrying peaks outwards: tracemalloc keeps a single peak
+        self.open = []
+
+    def start(self):
+        """Trace from now on (until stop()), e.g. to include parsing in what runs see."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started = True
+
+    def stop(self):
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+
+    def enter(self, key):
+        current, peak = tracemalloc.get_traced_memory()
+        if self.open:
+            entry = self.open[-1]
+            entry[5] = max(entry[5], peak)
+        tracemalloc.reset_peak()
+        entry = [key, current, sys.getallocatedblocks(), 0, 0, current]
+        self.open.append(entry)
+        return entry
+
+    def exit(self, stats, active):
+        """Close the innermost entry and add it to `stats`; returns (net bytes, blocks, peak)."""
+        key, start, start_blocks, nested, nested_blocks, peak = self.open.pop()
+        current, traced_peak = tracemalloc.get_traced_memory()
+        peak = max(peak, traced_peak)
+        if self.open:
+            parent = self.open[-1]
+            parent[5] = max(parent[5], peak)
+        grown = current - start
+        blocks = sys.getallocatedblocks() - start_blocks
+        record = stats.get(key)
+        if record is None:
+            record = stats[key] = [0, 0, 0, 0, 0]
+        record[0] += 1
+        if not active:
+            record[1] += grown
+        record[2] += grown - nested
+        record[3] += blocks - nested_blocks
+        record[4] = max(record[4], peak - start)
+        return grown, blocks, peak
+
+    def enter_line(self, line):
+        self.line_stack.append(self.enter(line))
+
+    def exit_line(self):
+        entry = self.line_stack.pop()
+        active = any(other[0] == entry[0] for other in self.line_stack)
+        grown, blocks, _ = self.exit(self.lines, active)
+        if self.line_stack:
+            self.line_stack[-1][3] += grown
+            self.line_stack[-1][4] += blocks
+
+    def enter_call(self, name):
+        if not self.open:
+            self.begin_run()
+        self.call_stack.append(self.enter(name))
+        self.call_names.append(name)
+
+    def exit_call(self):
+        stack = tuple(self.call_names)
+        self.call_names.pop()
+        entry = self.call_stack.pop()
+        nested = entry[3]
+        grown, blocks, peak = self.exit(self.functions, entry[0] in self.call_names)
+        self.stacks[stack] = self.stacks.get(stack, 0) + grown - nested
+        if self.call_stack:
+            self.call_stack[-1][3] += grown
+            self.call_stack[-1][4] += blocks
+        if not self.open:
+            self.end_run(entry[1], grown, blocks, peak)
+
+    def begin_run(self):
+        self.run_started = not tracemalloc.is_tracing()
+        if self.run_started:
+            tracemalloc.start()
+        self.baseline = self.snapshot()
+
+    def end_run(self, before, grown, blocks, peak):
+        sites = self.snapshot().compare_to(self.baseline, 'lineno')
+        self.baseline = None
+        if self.run_started:
+            tracemalloc.stop()
+        top = [{'site': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                'bytes': stat.size_diff, 'blocks': stat.count_diff}
+               for stat in sites if stat.size_diff > 0][:MEMORY_SITES]
+        self.runs.append({'peak': peak, 'before': before, 'growth': grown, 'blocks': blocks, 'sites': top})
+
+    def snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+
+    def summary(self, source=None, limit=None):
+        """
+        The profile as plain data, largest first (JSON-serializable).
+
+        Parameters:
+        - source (str): The program's source, to show each line's text.
+        - limit (int): Keep only this many lines, functions and node types.
+
+        Returns:
+        - A dict like Profiler.summary()'s, with bytes for times, 'blocks'
+          and 'peak' in each line and function, and the 'runs'.
+        """
+        texts = source.splitlines() if source is not None else []
+        lines = []
+        for line, (count, inclusive, exclusive, blocks, peak) in sorted(
+                self.lines.items(), key=lambda item: (-item[1][4], -item[1][2])):
+            entry = {'line': line, 'count': count, 'inclusive': inclusive, 'exclusive': exclusive,
+                     'blocks': blocks, 'peak': peak}
+            if 0 < line <= len(texts):
+                entry['source'] = texts[line - 1].strip()
+            lines.append(entry)
+        functions = [{'name': name, 'calls': calls, 'inclusive': inclusive, 'exclusive': exclusive,
+                      'blocks': blocks, 'peak': peak}
+                     for name, (calls, inclusive, exclusive, blocks, peak)
+                     in sorted(self.functions.items(), key=lambda item: (-item[1][4], -item[1][2]))]
+        nodes = sorted(self.nodes.items(), key=lambda item: -item[1])
+        return {
+            'memory': True,
+            'runs': self.runs,
+            'lines': lines[:limit],
+            'functions': functions[:limit],
+            'nodes': [{'type': name, 'count': count} for name, count in nodes[:limit]],
+            'stacks': [[';'.join(stack), size] for stack, size in self.stacks.items()],
+        }
+
+
+def format_summary(summary, out):
+    """Write a summary() of either profiler as a hot-spot report."""
+    if summary.get('memory'):
+        format_memory(summary, out)
+        return
+    # Shares of the whole profile, not of the rows kept
+    total = summary['total'] or 1.0
+    out.write(f'{"line":>6} {"count":>10} {"incl s":>10} {"excl s":>10} {"excl%":>6}  source\n')
+    for entry in summary['lines']:
+        out.write(f'{entry["line"]:>6} {entry["count"]:>10} {entry["inclusive"]:>10.4f} '
+                  f'{entry["exclusive"]:>10.4f} {entry["exclusive"] / total:>6.1%}  {entry.get("source", "")}\n')
+    out.write(f'\n{"function":<24} {"calls":>10} {"incl s":>10} {"excl s":>10} {"excl%":>6}\n')
+    for entry in summary['functions']:
+        out.write(f'{entry["name"]:<24} {entry["calls"]:>10} {entry["inclusive"]:>10.4f} '
+                  f'{entry["exclusive"]:>10.4f} {entry["exclusive"] / total:>6.1%}\n')
+    format_nodes(summary, out)
+
+
+def format_memory(summary, out):
+    for number, run in enumerate(summary['runs'], 1):
+        out.write(f'run {number}: peak {kib(run["peak"])}, {kib(run["before"])} before the run, '
+                  f'{kib(run["growth"])} and {run["blocks"]:+} blocks retained\n')
+        for site in run['sites']:
+            out.write(f'    {kib(site["bytes"])} in {site["blocks"]:+} blocks at {site["site"]}\n')
+    out.write(f'\n{"line":>6} {"count":>10} {"peak":>12} {"net incl":>12} {"net excl":>12} {"blocks":>9}  source\n')
+    for entry in summary['lines']:
+        out.write(f'{entry["line"]:>6} {entry["count"]:>10} {kib(entry["peak"]):>12} {kib(entry["inclusive"]):>12} '
+                  f'{kib(entry["exclusive"]):>12} {entry["blocks"]:>+9}  {entry.get("source", "")}\n')
+    out.write(f'\n{"function":<24} {"calls":>10} {"peak":>12} {"net incl":>12} {"net excl":>12} {"blocks":>9}\n')
+    for entry in summary['functions']:
+        out.write(f'{entry["name"]:<24} {entry["calls"]:>10} {kib(entry["peak"]):>12} {kib(entry["inclusive"]):>12} '
+                  f'{kib(entry["exclusive"]):>12} {entry["blocks"]:>+9}\n')
+    format_nodes(summary, out)
+
+
+def format_nodes(summary, out):
+    out.write(f'\n{"node":<24} {"evaluations":>12}\n')
+    for entry in summary['nodes']:
+        out.write(f'{entry["type"]:<24} {entry["count"]:>12}\n')
+
+
+def kib(size):
+    return f'{size / 1024:.1f} KiB'
+
+
+def write_collapsed(stacks, out, root=None):
+    """
+    Write [frames, value] pairs from summary() (microseconds, or bytes for
+    MemoryProfiler) as collapsed stacks ("a;b;c 123" lines), optionally
+    under a `root` frame such as a file.
+    """
+    for frames, micros in stacks:
+        if micros <= 0:
+            continue
+        if root is not None:
+            frames = f'{root};{frames}'
+        out.write(f'{frames} {micros}\n')
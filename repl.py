@@ -1,20 +1,49 @@
 # repl.py
 
-from mathscript import MathScript
+import sys
 
-def main():
+from mathscript.lexer import Lexer
+from mathscript.parser import (Parser, VarAssignNode, IfNode, WhileNode, ForNode, ParallelForNode,
+                               FuncDefNode, ReturnNode)
+from mathscript.interpreter import Interpreter
+from mathscript.msc import load_file
+
+def main(argv=None):
+    # Files named on the command line (or with ':load <file>') are run
+    # first, parsed through their .msc artifacts
+    files = sys.argv[1:] if argv is None else argv
     print("Welcome to MathScript REPL")
-    ms = MathScript()
+    interpreter = Interpreter()
+    for path in files:
+        try:
+            interpreter.interpret(load_file(path))
+        except Exception as e:
+            print(f'Error: {e}')
     while True:
         try:
             text = input('>>> ')
             if text.strip() == '':
                 continue
-            result = ms.execute(text)
-            if result is not None:
-                print(result)
+            if text.startswith(':load '):
+                interpreter.interpret(load_file(text[len(':load '):].strip()))
+                continue
+            ast = Parser(Lexer(text).tokenize()).parse()
+            # Show the value of a trailing expression, like Python's REPL
+            last = ast.pop() if ast and is_expression(ast[-1]) else None
+            interpreter.interpret(ast)
+            if last is not None:
+                result = interpreter.visit(last)
+                if result is not None:
+                    print(result)
+        except (EOFError, KeyboardInterrupt):
+            print()
+            break
         except Exception as e:
             print(f'Error: {e}')
 
+def is_expression(node):
+    return not isinstance(node, (VarAssignNode, IfNode, WhileNode, ForNode, ParallelForNode,
+                                 FuncDefNode, ReturnNode))
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,89 @@
+# mathscript/resolver.py
+
+from .parser import *
+
+
+class Scope:
+    """
+    Local variable slots of one function body.
+
+    At runtime a function frame is a list: slot 0 holds the enclosing frame
+    (or the global Context for top-level functions) and every local variable
+    gets a fixed index after it. Parameters come first, in order.
+    """
+
+    def __init__(self, param_names=(), parent=None):
+        self.parent = parent
+        # Number of frame hops from this scope to the global Context
+        self.depth = parent.depth + 1 if parent is not None else 1
+        self.slots = {}
+        for name in param_names:
+            self.declare(name)
+
+    def declare(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.slots) + 1
+        return self.slots[name]
+
+    @property
+    def frame_size(self):
+        return len(self.slots) + 1
+
+    def resolve(self, name):
+        """
+        Find every enclosing function scope that binds `name`.
+
+        Returns a tuple of (hops, slot) pairs, innermost first. A name that
+        is not in any of them is a global or builtin.
+        """
+        path = []
+        scope = self
+        hops = 0
+        while scope is not None:
+            slot = scope.slots.get(name)
+            if slot is not None:
+                path.append((hops, slot))
+            scope = scope.parent
+            hops += 1
+        return tuple(path)
+
+
+class Resolver:
+    """
+    Assign frame slots to the variables of function bodies.
+
+    A variable is local to a function when the body assigns it anywhere:
+    parameters, assignments, loop variables, nested function names and the
+    implicit 'return_value'. Nested function bodies get their own Scope.
+    """
+
+    def resolve_function(self, node, parent=None):
+        scope = Scope(node.param_names, parent)
+        self.declare_block(scope, node.body)
+        return scope
+
+    def declare_block(self, scope, statements):
+        for stmt in statements:
+            self.declare(scope, stmt)
+
+    def declare(self, scope, node):
+        if isinstance(node, VarAssignNode):
+            scope.declare(node.var_name)
+        elif isinstance(node, ForNode):
+            scope.declare(node.var_name)
+            self.declare_block(scope, node.body)
+        elif isinstance(node, ParallelForNode):
+            # The body runs in worker processes; only these are copied back
+            scope.declare(node.var_name)
+            for _, name in node.reductions:
+                scope.declare(name)
+        elif isinstance(node, IfNode):
+            self.declare_block(scope, node.body)
+            if node.else_body:
+                self.declare_block(scope, node.else_body)
+        elif isinstance(node, WhileNode):
+            self.declare_block(scope, node.body)
+        elif isinstance(node, FuncDefNode):
+            scope.declare(node.func_name)
+        elif isinstance(node, ReturnNode):
+            scope.declare('return_value')
@@ -0,0 +1,263 @@
+# mathscript/series.py
+
+import math
+
+from .parser import *
+from .arrays import np
+from .stdlib import mathlib
+from .vectorize import LoopVectorizer, PlanEvaluator, Fallback, plan_names, VECTOR_MIN_LENGTH
+
+# Index values evaluated per NumPy batch, bounding memory for huge ranges
+SERIES_CHUNK = 1 << 16
+
+# Highest power of the index with a closed-form sum
+MAX_DEGREE = 3
+
+
+class SeriesPlanner:
+    """
+    Choose how a ∑ or ∏ node is evaluated.
+
+    plan(node) returns (var_name, closed_form, element, builtins) where
+    closed_form and element may be None:
+    - closed_form describes a body whose sum or product has a formula:
+      ('poly', ((degree, coefficient), ...)) for a polynomial in the index
+      of degree at most 3, ('geometric', coefficient, ratio) for
+      c * pow(r, i), or ('factorial',) for ∏ of the index itself;
+    - element is the body as a vectorize.py expression plan, when it can be
+      evaluated for a whole batch of indices at once;
+    - builtins names the builtins the closed form assumes, which must not
+      have been rebound when it is used.
+
+    Coefficients and ratios are expression plans too; they never use the
+    index, so they evaluate to scalars. Everything is plain tuples so the
+    VM can keep plans as constants.
+    """
+
+    def plan(self, node):
+        self.var_name = node.var_name
+        self.builtins = set()
+        closed_form = None
+        if isinstance(node, ProductNode):
+            if isinstance(node.body, VarAccessNode) and node.body.var_name == node.var_name:
+                closed_form = ('factorial',)
+        else:
+            try:
+                closed_form = self.geometric(node.body) or self.polynomial_form(node.body)
+            except Fallback:
+                closed_form = None
+        element = LoopVectorizer(approximate=True).plan_element(node.var_name, node.body)
+        return (node.var_name, closed_form, element, tuple(sorted(self.builtins)))
+
+    def polynomial_form(self, node):
+        terms = self.polynomial(node)
+        return ('poly', tuple(sorted(terms.items())))
+
+    def polynomial(self, node):
+        """Return {degree: coefficient plan} for a polynomial in the index."""
+        if isinstance(node, NumberNode):
+            return {0: ('const', node.value)}
+        elif isinstance(node, VarAccessNode):
+            if node.var_name == self.var_name:
+                return {1: ('const', 1.0)}
+            return {0: ('var', node.var_name)}
+        elif isinstance(node, UnaryOpNode) and node.op_token.value in ('+', '-'):
+            terms = self.polynomial(node.node)
+            if node.op_token.value == '-':
+                terms = {degree: ('unary', '-', coef) for degree, coef in terms.items()}
+            return terms
+        elif isinstance(node, BinOpNode):
+            op = node.op_token.value
+            left = self.polynomial(node.left_node)
+            if op == '^' or op == '/':
+                right = self.invariant(node.right_node)
+                if op == '^':
+                    return self.power(left, right)
+                return {degree: ('binary', '/', coef, right) for degree, coef in left.items()}
+            right = self.polynomial(node.right_node)
+            if op in ('+', '-'):
+                terms = dict(left)
+                for degree, coef in right.items():
+                    if op == '-':
+                        coef = ('unary', '-', coef)
+                    terms[degree] = ('binary', '+', terms[degree], coef) if degree in terms else coef
+                return terms
+            if op == '*':
+                terms = {}
+                for left_degree, left_coef in left.items():
+                    for right_degree, right_coef in right.items():
+                        degree = left_degree + right_degree
+                        if degree > MAX_DEGREE:
+                            raise Fallback
+                        coef = ('binary', '*', left_coef, right_coef)
+                        terms[degree] = ('binary', '+', terms[degree], coef) if degree in terms else coef
+                return terms
+        elif isinstance(node, FuncCallNode) and node.func_name == 'pow' and len(node.args) == 2:
+            self.builtins.add('pow')
+            return self.power(self.polynomial(node.args[0]), self.invariant(node.args[1]))
+        raise Fallback
+
+    def power(self, base, exponent):
+        # Only the index itself to a small literal power
+        if base != {1: ('const', 1.0)} or exponent[0] != 'const':
+            raise Fallback
+        degree = exponent[1]
+        if degree != int(degree) or not 0 <= degree <= MAX_DEGREE:
+            raise Fallback
+        return {int(degree): ('const', 1.0)}
+
+    def geometric(self, node):
+        coefficient = ('const', 1.0)
+        if isinstance(node, BinOpNode) and node.op_token.value == '*':
+            if self.uses_index(node.left_node):
+                coefficient, node = self.invariant(node.right_node), node.left_node
+            else:
+                coefficient, node = self.invariant(node.left_node), node.right_node
+        if isinstance(node, FuncCallNode) and node.func_name == 'pow' and len(node.args) == 2:
+            self.builtins.add('pow')
+            base, exponent = node.args
+        elif isinstance(node, BinOpNode) and node.op_token.value == '^':
+            base, exponent = node.left_node, node.right_node
+        else:
+            return None
+        if not (isinstance(exponent, VarAccessNode) and exponent.var_name == self.var_name):
+            return None
+        return ('geometric', coefficient, self.invariant(base))
+
+    def invariant(self, node):
+        if self.uses_index(node):
+            raise Fallback
+        plan = LoopVectorizer(approximate=True).plan_element(self.var_name, node)
+        if plan is None:
+            raise Fallback
+        return plan
+
+    def uses_index(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, VarAccessNode) and node.var_name == self.var_name:
+                return True
+            if isinstance(node, ASTNode):
+                for value in node.field_values():
+                    if isinstance(value, ASTNode):
+                        stack.append(value)
+                    elif isinstance(value, list):
+                        stack.extend(value)
+        return False
+
+
+def series_names(plan):
+    """Every variable and function name evaluating a series plan may look up."""
+    var_name, closed_form, element, builtins = plan
+    exprs = [element] if element is not None else []
+    if closed_form is not None and closed_form[0] == 'poly':
+        exprs.extend(coef for _, coef in closed_form[1])
+    elif closed_form is not None and closed_form[0] == 'geometric':
+        exprs.extend(closed_form[1:])
+    names = plan_names((var_name, [('sum', var_name, exprs)]))
+    names.discard(var_name)
+    return names | set(builtins)
+
+
+def power_sum(degree, first, last):
+    """Exact sum of i ** degree for i from first to last inclusive."""
+    if first < 0:
+        # Mirror the negative indices onto positive ones
+        sign = -1 if degree % 2 else 1
+        if last < 0:
+            return sign * power_sum(degree, -last, -first)
+        return sign * power_sum(degree, 1, -first) + power_sum(degree, 0, last)
+    return prefix_power_sum(degree, last) - prefix_power_sum(degree, first - 1)
+
+
+def prefix_power_sum(degree, n):
+    """Exact sum of i ** degree for i from 0 to n."""
+    if n < 0:
+        return 0
+    if degree == 0:
+        return n + 1
+    if degree == 1:
+        return n * (n + 1) // 2
+    if degree == 2:
+        return n * (n + 1) * (2 * n + 1) // 6
+    return (n * (n + 1) // 2) ** 2
+
+
+def evaluate_series(product, plan, start, end, lookup, body):
+    """
+    Evaluate ∑ (or ∏ if `product`) of the body for the index from `start`
+    to `end` inclusive.
+
+    Tries the closed form, then one NumPy reduction per batch of indices,
+    then calls `body(i)` for each index: the engine's compiled loop. The
+    result is always a float; an empty range gives 0 or 1.
+    """
+    items = range(int(start), int(end) + 1)
+    initial = 1.0 if product else 0.0
+    if not items:
+        return initial
+    var_name, closed_form, element, builtins = plan
+    if (closed_form is not None and np is not None
+            and all(lookup(name) is getattr(mathlib, name) for name in builtins)):
+        result = closed_form_value(closed_form, var_name, items, lookup)
+        if result is not None:
+            return result
+    if element is not None and np is not None and len(items) >= VECTOR_MIN_LENGTH:
+        result = vector_value(product, element, var_name, items, lookup)
+        if result is not None:
+            return result
+    total = initial
+    if product:
+        for i in items:
+            total = total * body(i)
+    else:
+        for i in items:
+            total = total + body(i)
+    return total
+
+
+def closed_form_value(closed_form, var_name, items, lookup):
+    kind = closed_form[0]
+    first, last = items[0], items[-1]
+    if kind == 'factorial':
+        if first <= 0:
+            return 0.0 if last >= 0 else None
+        if math.lgamma(last + 1) - math.lgamma(first) > 710:
+            return math.inf
+        try:
+            return float(math.prod(items))
+        except OverflowError:
+            return math.inf
+    try:
+        with np.errstate(divide='raise', over='raise', invalid='raise', under='ignore'):
+            evaluator = PlanEvaluator(var_name, items, lookup)
+            if kind == 'poly':
+                total = 0.0
+                for degree, coef in closed_form[1]:
+                    total += float(evaluator.evaluate(coef)[0]) * power_sum(degree, first, last)
+                return total
+            coefficient = float(evaluator.evaluate(closed_form[1])[0])
+            ratio = float(evaluator.evaluate(closed_form[2])[0])
+            if ratio == 1.0:
+                return coefficient * len(items)
+            return coefficient * ratio ** first * (ratio ** len(items) - 1) / (ratio - 1)
+    except (Fallback, FloatingPointError, ArithmeticError, ValueError, TypeError):
+        return None
+
+
+def vector_value(product, element, var_name, items, lookup):
+    ufunc = np.multiply if product else np.add
+    total = 1.0 if product else 0.0
+    try:
+        with np.errstate(divide='raise', over='raise', invalid='raise', under='ignore'):
+            for offset in range(0, len(items), SERIES_CHUNK):
+                chunk = items[offset:offset + SERIES_CHUNK]
+                evaluator = PlanEvaluator(var_name, chunk, lookup)
+                value, _ = evaluator.evaluate(element)
+                values = np.broadcast_to(np.asarray(value, dtype=np.float64), (len(chunk),))
+                # Sequential, like the loop it replaces
+                total = ufunc.accumulate(np.concatenate(([total], values)))[-1]
+    except (Fallback, FloatingPointError, ArithmeticError, ValueError, TypeError):
+        return None
+    return float(total)
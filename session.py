@@ -0,0 +1,135 @@
+# mathscript/session.py
+
+import asyncio
+import contextlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .lexer import Lexer
+from .parser import Parser
+from .interpreter import Interpreter, CHECK_INTERVAL
+
+
+class Session:
+    """
+    Runs MathScript programs from asyncio code without blocking the event
+    loop:
+
+        async with Session() as session:
+            await session.run('x = 2 ^ 10', timeout=5)
+            async for line in session.stream('print(x)'):
+                ...
+
+    Programs run one at a time on the session's worker thread and share
+    its global variables, like REPL lines. Every `check_interval` loop
+    iterations and function calls (see Interpreter) the program hands the
+    GIL to the event loop's thread, and stops if its run was cancelled or
+    ran out of time. A single long builtin call, e.g. on a large array,
+    runs to its end before that.
+
+    What programs print goes line by line into `output`, an asyncio.Queue,
+    or, for stream(), to its caller.
+
+    Parameters:
+    - mode (str): The Interpreter mode.
+    - check_interval (int): Steps between two checks.
+    - options: Other Interpreter arguments.
+    """
+
+    def __init__(self, mode='closure', check_interval=CHECK_INTERVAL, **options):
+        self.interpreter = Interpreter(mode, checkpoint=self.checkpoint, check_interval=check_interval,
+                                       **options)
+        # Printing writes to the current run's channel instead of stdout
+        self.interpreter.builtins['print'] = self.interpreter.builtins['print_'] = self.print_
+        self.output = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='mathscript')
+        self.lock = asyncio.Lock()
+        # Of the current run: how to deliver a line, when to time out and
+        # the exception to stop with, set by the event loop's thread
+        self.emit = None
+        self.deadline = None
+        self.stop = None
+
+    @property
+    def variables(self):
+        """The global variables programs have set."""
+        return self.interpreter.context.variables
+
+    def get(self, name):
+        return self.interpreter.context.get(name)
+
+    async def run(self, program, timeout=None):
+        """
+        Run a program; printed lines go to `output`.
+
+        Parameters:
+        - program: The source, or the program parsed already: a list of
+          statements (e.g. from msc.load_source) or an Arena.
+        - timeout (float): Seconds after which the program is stopped with
+          TimeoutError.
+        """
+        await self.execute(program, timeout, self.output)
+
+    async def stream(self, program, timeout=None):
+        """Run a program like run(), yielding the lines it prints as they come."""
+        lines = asyncio.Queue()
+        task = asyncio.ensure_future(self.execute(program, timeout, lines))
+        # Lines are queued before the run finishes, so None comes last
+        task.add_done_callback(lambda _: lines.put_nowait(None))
+        try:
+            while True:
+                line = await lines.get()
+                if line is None:
+                    break
+                yield line
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+
+    async def execute(self, program, timeout, output):
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            self.emit = lambda line: loop.call_soon_threadsafe(output.put_nowait, line)
+            self.deadline = None if timeout is None else time.monotonic() + timeout
+            self.stop = None
+            worker = loop.run_in_executor(self.executor, self.interpret, program)
+            try:
+                await asyncio.shield(worker)
+            except asyncio.CancelledError:
+                # Wait for the program to reach a checkpoint and stop, so
+                # the next run does not start under it
+                self.stop = asyncio.CancelledError()
+                with contextlib.suppress(BaseException):
+                    await worker
+                raise
+
+    def interpret(self, program):
+        # On the worker thread
+        if isinstance(program, str):
+            program = Parser(Lexer(program).stream()).parse()
+        self.interpreter.interpret(program)
+
+    def checkpoint(self):
+        # On the worker thread, every `check_interval` steps
+        if self.stop is not None:
+            raise self.stop
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise TimeoutError('MathScript program timed out')
+        # Let the event loop's thread take the GIL now rather than at the
+        # end of the switch interval
+        time.sleep(0)
+
+    def print_(self, *args):
+        self.emit(' '.join(str(arg) for arg in args))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
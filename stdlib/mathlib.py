@@ -2,6 +2,9 @@
 
 import math
 
+pi = math.pi
+π = math.pi
+
 def sin(x):
     return math.sin(x)
 
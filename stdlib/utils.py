@@ -3,11 +3,18 @@
 def len_(obj):
     return len(obj)
 
+def _range_bound(value):
+    # MathScript numbers are floats; range bounds must be integral, and
+    # are not truncated when they are not
+    if value != int(value):
+        raise ValueError(f"range() bounds must be integers, not {value!r}")
+    return int(value)
+
 def range_(start, end=None, step=1):
     if end is None:
-        return range(start)
+        return range(_range_bound(start))
     else:
-        return range(start, end, step)
+        return range(_range_bound(start), _range_bound(end), _range_bound(step))
 
 def type_(obj):
     return type(obj).__name__
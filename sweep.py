@@ -0,0 +1,227 @@
+# mathscript/sweep.py
+
+import contextlib
+import csv
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .lexer import Lexer
+from .parser import *
+from .interpreter import Interpreter, Context
+from .arrays import Array, np
+
+# Chunks handed to each worker, so a slow chunk does not leave the others idle
+CHUNKS_PER_WORKER = 4
+
+
+def load_table(source, names=None):
+    """
+    Read parameter bindings into (names, rows).
+
+    Parameters:
+    - source: A .csv, .json, .npy or .npz path, a NumPy array (structured,
+      or 2-d with `names`), a dict of columns or a list of dicts.
+    - names (list): Column names for a plain 2-d array.
+
+    Returns:
+    - The column names and a list of rows, each a tuple of values.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            with open(path, newline='') as f:
+                reader = csv.reader(f)
+                header = next(reader)
+                return header, [tuple(map(csv_value, row)) for row in reader if row]
+        elif extension == '.json':
+            with open(path) as f:
+                source = json.load(f)
+        elif extension in ('.npy', '.npz'):
+            if np is None:
+                raise RuntimeError('Reading NumPy tables requires NumPy (pip install numpy)')
+            source = np.load(path)
+            if extension == '.npz':
+                source = {name: source[name] for name in source.files}
+        else:
+            raise ValueError(f"Unsupported table format '{extension}'")
+
+    if np is not None and isinstance(source, np.ndarray):
+        if source.dtype.names:
+            names = list(source.dtype.names)
+            return names, [tuple(row) for row in source.tolist()]
+        if source.ndim != 2 or names is None or len(names) != source.shape[1]:
+            raise ValueError('A plain array needs two dimensions and one name per column')
+        return list(names), [tuple(row) for row in source.tolist()]
+    if isinstance(source, dict):
+        names = list(source)
+        columns = [list(source[name]) for name in names]
+        if len({len(column) for column in columns}) > 1:
+            raise ValueError('Columns must have the same length')
+        return names, list(zip(*columns))
+    if isinstance(source, list):
+        names = list(names or (source[0] if source else ()))
+        return names, [tuple(row[name] for name in names) for row in source]
+    raise TypeError(f"Cannot read a parameter table from '{type(source).__name__}'")
+
+
+def csv_value(text):
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def save_table(rows, path):
+    """Write result rows to a .csv or .json file."""
+    extension = os.path.splitext(os.fspath(path))[1].lower()
+    if extension == '.json':
+        with open(path, 'w') as f:
+            json.dump(rows, f, indent=2)
+    elif extension == '.csv':
+        names = list(rows[0]) if rows else []
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, names)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        raise ValueError(f"Unsupported table format '{extension}'")
+
+
+def drop_defaults(ast, names):
+    """
+    Remove the first top-level assignment to each swept name: it is the
+    script's default for the parameter, which the row overrides.
+    """
+    remaining = set(names)
+    program = []
+    for stmt in ast:
+        if isinstance(stmt, VarAssignNode) and stmt.var_name in remaining:
+            remaining.discard(stmt.var_name)
+            continue
+        program.append(stmt)
+    return program
+
+
+def to_value(value):
+    """Convert a table cell into a MathScript value."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) or (np is not None and isinstance(value, np.number)):
+        return float(value)
+    if isinstance(value, (list, tuple)) or (np is not None and isinstance(value, np.ndarray)):
+        return Array(value)
+    return value
+
+
+def from_value(value):
+    """Convert a MathScript value into a plain, serializable one."""
+    if isinstance(value, Array):
+        return value.tolist()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+
+class SweepWorker:
+    """
+    Runs one program for many rows of bindings.
+
+    The program is optimized, analyzed and compiled once; each row then
+    runs it against a fresh global Context holding the row's bindings.
+    Memo caches and ∫ results carry over between rows.
+    """
+
+    def __init__(self, ast, names, outputs, mode='closure', quiet=True, options=None):
+        self.names = names
+        self.outputs = outputs
+        self.quiet = quiet
+        self.interpreter = Interpreter(mode, **(options or {}))
+        self.program = self.interpreter.load(ast)
+
+    def run_rows(self, start, rows):
+        if not self.quiet:
+            return [self.run_row(start + offset, row) for offset, row in enumerate(rows)]
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            return [self.run_row(start + offset, row) for offset, row in enumerate(rows)]
+
+    def run_row(self, index, row):
+        context = Context()
+        context.variables.update(zip(self.names, map(to_value, row)))
+        result = {'row': index, **dict(zip(self.names, map(from_value, row)))}
+        try:
+            self.program(context)
+        except Exception as e:
+            result.update((name, None) for name in self.outputs)
+            result['error'] = f'{type(e).__name__}: {e}'
+            return result
+        result.update((name, from_value(context.get(name))) for name in self.outputs)
+        result['error'] = None
+        return result
+
+
+# The worker of each pool process, built once by init_worker
+worker = None
+
+
+def init_worker(*args):
+    global worker
+    worker = SweepWorker(*args)
+
+
+def run_chunk(start, rows):
+    return worker.run_rows(start, rows)
+
+
+def run_sweep(program, table, outputs, mode='closure', workers=None, chunk_size=None,
+              names=None, quiet=True, **options):
+    """
+    Run a program once per row of a parameter table.
+
+    Parameters:
+    - program: MathScript source or an already parsed list of statements.
+    - table: Parameter bindings, anything load_table() reads.
+    - outputs (list): Names of the variables to collect after each run.
+    - mode (str): Interpreter mode.
+    - workers (int): Worker processes; 0 runs every row in this process.
+      Defaults to the number of CPUs.
+    - chunk_size (int): Rows sent to a worker at a time.
+    - names (list): Column names for a plain 2-d array table.
+    - quiet (bool): Discard what the program prints.
+    - options: Further Interpreter arguments, e.g. optimize=True.
+
+    Returns:
+    - One dict per row, in table order, holding the row index, the
+      bindings, the outputs and 'error' (None, or the error the run raised).
+
+    The program is parsed once here and compiled once per worker. The
+    first top-level assignment to each parameter is treated as the
+    script's default and skipped, so `learning_rate = 0.01` in the script
+    does not override the table.
+    """
+    if isinstance(program, str):
+        program = Parser(Lexer(program).stream()).parse()
+    names, rows = load_table(table, names)
+    outputs = list(outputs)
+    ast = drop_defaults(program, names)
+    args = (ast, names, outputs, mode, quiet, options)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(rows))
+    if workers <= 1:
+        return SweepWorker(*args).run_rows(0, rows)
+
+    if chunk_size is None:
+        chunk_size = max(1, math.ceil(len(rows) / (workers * CHUNKS_PER_WORKER)))
+    # The rows already keep every worker busy; parallel loops run in-process
+    args = (ast, names, outputs, mode, quiet, {**options, 'workers': 0})
+    results = []
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=args) as pool:
+        futures = [pool.submit(run_chunk, start, rows[start:start + chunk_size])
+                   for start in range(0, len(rows), chunk_size)]
+        for future in futures:
+            results.extend(future.result())
+    return results
@@ -0,0 +1,108 @@
+# tests/test_arena.py
+
+import glob
+import os
+import pickle
+
+import pytest
+
+from mathscript.arena import Arena
+from mathscript.interpreter import Interpreter
+from mathscript.lexer import Lexer, Token
+from mathscript.parser import ASTNode, Parser, NumberNode, VarAssignNode
+
+from conftest import EXAMPLES_DIR
+
+EXAMPLES = sorted(glob.glob(os.path.join(EXAMPLES_DIR, '*.ms')))
+
+PROGRAM = '''\
+a = -1.5
+b = 0
+s = "text" + "text"
+items = [1, 2, 3 * 4]
+part = items[1:]
+@memo
+function f(n, m) {
+    if n > 0 and not m {
+        return f(n - 1, m) + 1
+    } else {
+        return 0
+    }
+}
+for i in range(0, 3) {
+    items.append(i)
+}
+while b < 2 {
+    b = b + 1
+}
+total = ∑(i=1, 4, i) + ∏(i=1, 3, i) + ∫(x=0, 1, x, 0.001) + f(3, 0)
+'''
+
+
+def parse(code):
+    return Parser(Lexer(code).tokenize()).parse()
+
+
+def dump(value):
+    """A node tree as nested tuples, for comparing trees."""
+    if isinstance(value, ASTNode):
+        return (type(value).__name__, getattr(value, 'line', None),
+                tuple(dump(field) for field in value.field_values()))
+    if isinstance(value, list):
+        return [dump(item) for item in value]
+    if isinstance(value, Token):
+        return ('Token', value.type, value.value)
+    if isinstance(value, float):
+        return value.hex()
+    return value
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('code', [PROGRAM] + [read(path) for path in EXAMPLES],
+                         ids=['program'] + [os.path.basename(path) for path in EXAMPLES])
+def test_round_trip(code):
+    ast = parse(code)
+    arena = Arena(ast)
+    assert len(arena.roots) == len(ast)
+    assert dump(arena.to_ast()) == dump(ast)
+    assert dump(pickle.loads(pickle.dumps(arena)).to_ast()) == dump(ast)
+
+
+def test_constants_are_shared_but_signed_zeros_are_not():
+    arena = Arena(parse(PROGRAM))
+    assert arena.constants.count('text') == 1
+    arena = Arena([VarAssignNode('a', NumberNode(-0.0)), VarAssignNode('b', NumberNode(0.0))])
+    a, b = (arena.node(index).expr.value for index in arena.roots)
+    assert str(a) == '-0.0' and str(b) == '0.0'
+
+
+def test_streamed_statements():
+    streamed = Arena(Parser(Lexer(PROGRAM).stream()).statements())
+    assert dump(streamed.to_ast()) == dump(parse(PROGRAM))
+
+
+def test_views():
+    arena = Arena(parse('x = 1 + y\n'))
+    root = arena.view(arena.roots[0])
+    assert root.kind is VarAssignNode
+    assert root.line == 1
+    assert root.var_name == 'x'
+    assert root.expr.left_node.kind is NumberNode
+    assert root.expr.op_token.value == '+'
+    assert arena.children(root.index) == [root.expr.index]
+    with pytest.raises(AttributeError, match='no field'):
+        root.body
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_runs_from_the_arena(mode):
+    expected = Interpreter('tree')
+    expected.interpret(parse(PROGRAM))
+    interpreter = Interpreter(mode)
+    interpreter.interpret(pickle.loads(pickle.dumps(Arena(parse(PROGRAM)))))
+    assert interpreter.context.get('total') == pytest.approx(expected.context.get('total'))
+    assert interpreter.context.get('total') == pytest.approx(10 + 6 + 0.5 + 3)
@@ -0,0 +1,64 @@
+# tests/test_arrays.py
+
+import pytest
+
+from mathscript.arrays import Array, call_method
+from mathscript.interpreter import Interpreter
+from mathscript.lexer import Lexer
+from mathscript.parser import Parser
+
+pytest.importorskip('numpy')
+
+
+def run(code, mode):
+    interpreter = Interpreter(mode)
+    interpreter.interpret(Parser(Lexer(code).tokenize()).parse())
+    return interpreter.context.variables
+
+
+def test_truth_value():
+    assert not Array([])
+    assert not Array([0])
+    assert Array([2])
+    with pytest.raises(ValueError, match='ambiguous'):
+        bool(Array([1, 2]))
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_ambiguous_condition_raises(mode):
+    with pytest.raises(ValueError):
+        run('a = [1, 2]\nif a == [1, 3] {\n    x = 1\n}', mode)
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_any_and_all(mode):
+    variables = run('a = [1, 2]\nb = [1, 3]\nsome = (a == b).any()\nevery = (a == b).all()', mode)
+    assert variables['some'] is True
+    assert variables['every'] is False
+
+
+def test_allowed_methods():
+    a = Array([1, 2])
+    call_method(a, 'append', [3])
+    assert call_method(a, 'sum', []) == 6
+    assert call_method('abc', 'upper', []) == 'ABC'
+
+
+@pytest.mark.parametrize('target, name', [
+    (Array([1]), 'tolist'),
+    (Array([1]), 'buffer'),
+    (Array([1]), 'wrap'),
+    (Array([1]), '__class__'),
+    ('abc', 'format'),
+    ('abc', 'encode'),
+    (1.5, 'hex'),
+])
+def test_other_attributes_are_out_of_reach(target, name):
+    with pytest.raises(AttributeError, match='has no method'):
+        call_method(target, name, [])
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_scripts_cannot_reach_python_attributes(mode):
+    with pytest.raises(AttributeError):
+        run('a = [1]\nb = a.wrap([2])', mode)
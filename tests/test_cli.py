@@ -0,0 +1,83 @@
+# tests/test_cli.py
+
+import json
+
+import pytest
+
+from mathscript.cli import main
+
+
+def write(directory, name, code):
+    path = directory / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(code, encoding='utf-8')
+    return str(path)
+
+
+def run_main(argv, capsys):
+    with pytest.raises(SystemExit) as info:
+        main(argv)
+    out = capsys.readouterr().out
+    return info.value.code, [json.loads(line) for line in out.splitlines()]
+
+
+@pytest.fixture
+def files(tmp_path):
+    return [
+        write(tmp_path, 'a.ms', 'x = 2\ny = x * 3\nprint("hi")\n'),
+        write(tmp_path, 'sub/b.ms', 'function f(n) {\n    return n + 1\n}\nz = f(4)\n'),
+        write(tmp_path, 'sub/c.ms', 'x = 2\ny = x * 3\nprint("hi")\n'),
+    ]
+
+
+@pytest.mark.parametrize('workers', ['0', '2'])
+def test_batch(files, tmp_path, workers, capsys):
+    cache = tmp_path / 'cache'
+    # A directory, a glob and a file matched twice
+    code, results = run_main([str(tmp_path / 'sub'), str(tmp_path / '*.ms'), files[0],
+                              '-j', workers, '--cache-dir', str(cache)], capsys)
+    assert code == 0
+    results.sort(key=lambda result: result['index'])
+    assert [result['file'] for result in results] == [files[1], files[2], files[0]]
+    assert all(result['ok'] and isinstance(result['time'], float) for result in results)
+    assert results[0]['variables'] == {'z': 5}
+    assert results[1]['variables'] == results[2]['variables'] == {'x': 2, 'y': 6}
+    assert results[2]['output'] == 'hi\n'
+    assert list(cache.iterdir())
+
+
+def test_errors_are_reported_per_file(files, tmp_path, capsys):
+    broken = [
+        write(tmp_path, 'syntax.ms', 'x = (1 +\n'),
+        write(tmp_path, 'runtime.ms', 'print("before")\nx = 1 / 0\n'),
+        str(tmp_path / 'missing.ms'),
+    ]
+    code, results = run_main([files[0], *broken, '-j', '0', '--no-cache'], capsys)
+    assert code == 1
+    assert [result['ok'] for result in results] == [True, False, False, False]
+    assert results[1]['error'].startswith('SyntaxError')
+    assert results[2]['error'].startswith('ZeroDivisionError')
+    assert results[2]['output'] == 'before\n'
+    assert results[3]['error'].startswith('FileNotFoundError')
+
+
+@pytest.mark.parametrize('mode', ['tree', 'closure', 'vm'])
+def test_options(files, mode, capsys):
+    code, results = run_main([files[0], '-j', '0', '--no-cache', '--mode', mode, '--optimize',
+                              '--vars', 'y,w'], capsys)
+    assert code == 0
+    assert results[0]['variables'] == {'y': 6, 'w': None}
+
+
+@pytest.mark.parametrize('argv', [['--profile', '--mode', 'vm'], ['--profile-output', 'out.txt']])
+def test_invalid_option_combinations(files, argv, capsys):
+    with pytest.raises(SystemExit) as info:
+        main([files[0], *argv])
+    assert info.value.code == 2
+    assert 'needs' in capsys.readouterr().err
+
+
+def test_no_files_matched(tmp_path, capsys):
+    with pytest.raises(SystemExit) as info:
+        main([str(tmp_path / '*.ms')])
+    assert info.value.code == 2
@@ -0,0 +1,115 @@
+# tests/test_engines.py
+
+import glob
+import os
+
+import pytest
+
+from mathscript.interpreter import Interpreter, Function
+from mathscript.lexer import Lexer
+from mathscript.parser import Parser
+
+from conftest import EXAMPLES_DIR
+
+EXAMPLES = sorted(glob.glob(os.path.join(EXAMPLES_DIR, '*.ms')))
+
+PROGRAMS = {
+    'constant folding': '''\
+a = 2 ^ 3 + 1 * 4 - -1
+b = "ab" + "cd"
+c = 1 < 2 and 3 > 4 or 5
+d = not 0
+''',
+    'constants mixed with variables': '''\
+x = 3
+a = x * 2 + 1
+b = 10 - x / 4
+c = (1 + 2) * x
+''',
+    'folding does not raise early': '''\
+x = 0
+if x {
+    y = 1 / 0
+}
+''',
+    'shared variable reads': '''\
+x = 2
+function f(n) {
+    if n > 0 {
+        x = n
+    }
+    return x * x + x
+}
+a = f(0)
+b = f(5)
+c = x + x
+''',
+}
+
+
+def values(variables):
+    # Compiled functions differ between engines; compare them by name
+    return {name: value.name if isinstance(value, Function) else repr(value)
+            for name, value in variables.items()}
+
+
+def run(code, mode, optimize=False):
+    interpreter = Interpreter(mode, optimize=optimize)
+    interpreter.interpret(Parser(Lexer(code).tokenize()).parse())
+    return values(interpreter.context.variables)
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('optimize', [False, True])
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+@pytest.mark.parametrize('path', EXAMPLES, ids=os.path.basename)
+def test_examples_match_unoptimized_tree(path, mode, optimize, capsys):
+    code = read(path)
+    assert run(code, mode, optimize) == run(code, 'tree')
+
+
+# Known results of the examples, so the engines are not only checked
+# against each other
+EXPECTED = {
+    'example1.ms': {'y': 55, 'z': 120, 'area': pytest.approx(2), 'result': 187},
+    'fibonacci.ms': {'n': 10, 'i': 9},
+    'linear_regression.ms': {'m': pytest.approx(2, abs=0.01), 'b': pytest.approx(1, abs=0.02),
+                             'n': 5},
+}
+
+
+@pytest.mark.parametrize('optimize', [False, True])
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+@pytest.mark.parametrize('name', sorted(EXPECTED))
+def test_example_results(name, mode, optimize, capsys):
+    interpreter = Interpreter(mode, optimize=optimize)
+    interpreter.interpret(Parser(Lexer(read(os.path.join(EXAMPLES_DIR, name))).tokenize()).parse())
+    for var_name, value in EXPECTED[name].items():
+        assert interpreter.context.get(var_name) == value, var_name
+    if name == 'fibonacci.ms':
+        printed = capsys.readouterr().out.splitlines()[1:]
+        assert [float(line) for line in printed] == [0, 1, 1, 2, 3, 5, 8, 13, 21, 34]
+
+
+@pytest.mark.parametrize('optimize', [False, True])
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+@pytest.mark.parametrize('name', sorted(PROGRAMS))
+def test_programs_match_unoptimized_tree(name, mode, optimize):
+    code = PROGRAMS[name]
+    assert run(code, mode, optimize) == run(code, 'tree')
+
+
+def test_division_by_constant_zero_raises_when_reached():
+    with pytest.raises(ZeroDivisionError):
+        run('x = 1\ny = x + 1 / 0', 'closure')
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_range_bounds_must_be_integral(mode):
+    assert run('n = 0\nfor i in range(0, 6 / 2) {\n    n = n + 1\n}', mode)['n'] == '3.0'
+    with pytest.raises(ValueError, match='range'):
+        run('n = 0\nfor i in range(0, 2.5) {\n    n = n + 1\n}', mode)
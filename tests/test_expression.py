@@ -0,0 +1,74 @@
+# tests/test_expression.py
+
+import math
+
+import pytest
+
+from mathscript import compile_expression
+from mathscript.arrays import Array
+
+np = pytest.importorskip('numpy')
+
+
+def test_columns():
+    f = compile_expression('a * sin(x) + b', ['x', 'a', 'b'])
+    x = np.linspace(0, 3, 11)
+    expected = [2 * math.sin(v) + 0.5 for v in x]
+    assert f(x, 2, 0.5).tolist() == pytest.approx(expected, rel=1e-15)
+    # Lists, Arrays and buffers of doubles are columns too
+    assert f(list(x), [2] * 11, b=0.5).tolist() == pytest.approx(expected, rel=1e-15)
+    assert f(x.tobytes(), a=Array([2.0] * 11), b=0.5).tolist() == pytest.approx(expected, rel=1e-15)
+
+
+def test_chunks_cover_every_row():
+    f = compile_expression('x ^ 2 / y + c', ['x', 'y'], constants={'c': 3})
+    x = np.arange(1000, dtype=np.float64)
+    y = np.arange(1, 1001, dtype=np.float64)
+    f.chunk = 7
+    out = np.empty(1000)
+    assert f(x, y, out=out) is out
+    assert out.tolist() == [a ** 2 / b + 3 for a, b in zip(x.tolist(), y.tolist())]
+
+
+def test_array_semantics():
+    f = compile_expression('(x > 1) + (x == 2) * 10 + not x', ['x'])
+    assert f([0, 1, 2, 3]).tolist() == [1.0, 0.0, 11.0, 1.0]
+    # Errors give inf and nan instead of raising, whatever NumPy's settings
+    with np.errstate(all='raise'):
+        assert compile_expression('1 / x', ['x'])([0, -2]).tolist() == [math.inf, -0.5]
+        assert math.isnan(compile_expression('log(x)', ['x'])([-1])[0])
+
+
+def test_constants_and_functions():
+    f = compile_expression('scale * twice(x) + pi', ['x'], constants={'scale': 2},
+                           functions={'twice': lambda v: v * 2})
+    assert f([1, 2]).tolist() == [4 + math.pi, 8 + math.pi]
+    # An expression without columns gives one row, or fills out
+    assert compile_expression('2 ^ 3')().tolist() == [8.0]
+    assert compile_expression('2 ^ 3')(out=np.zeros(3)).tolist() == [8.0] * 3
+
+
+@pytest.mark.parametrize('src, params, error', [
+    ('x + y', ['x'], NameError),
+    ('x + 1 2', ['x'], SyntaxError),
+    ('f(x)', ['x'], NameError),
+    ('[x]', ['x'], SyntaxError),
+    ('x', ['x', 'x'], ValueError),
+])
+def test_compile_errors(src, params, error):
+    with pytest.raises(error):
+        compile_expression(src, params)
+
+
+def test_call_errors():
+    f = compile_expression('x + y', ['x', 'y'])
+    with pytest.raises(TypeError, match="'y'"):
+        f([1, 2])
+    with pytest.raises(ValueError, match="'y' has 3 rows"):
+        f([1, 2], [1, 2, 3])
+    with pytest.raises(TypeError, match='given twice'):
+        f([1], x=[2])
+    with pytest.raises(TypeError, match='numbers'):
+        f(['a'], [1])
+    with pytest.raises(ValueError, match='out'):
+        f([1, 2], [1, 2], out=np.empty(3))
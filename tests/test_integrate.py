@@ -0,0 +1,98 @@
+# tests/test_integrate.py
+
+import math
+
+import pytest
+
+from mathscript.integrate import Integrator, integral_plan
+from mathscript.interpreter import Interpreter, load_builtins
+from mathscript.lexer import Lexer
+from mathscript.parser import Parser
+
+pytest.importorskip('numpy')
+
+INTEGRALS = [
+    ('∫(x=0, π, sin(x))', 2.0),
+    ('∫(x=0, 1, x ^ 2)', 1 / 3),
+    ('∫(x=1, 2, 1 / x)', math.log(2)),
+    ('∫(x=1, 0, x)', -0.5),
+    ('∫(x=0, 1, sqrt(x))', 2 / 3),
+    ('∫(x=-1, 1, exp(-x * x * 50))', math.sqrt(math.pi / 50) * math.erf(math.sqrt(50))),
+    ('∫(x=2, 2, x)', 0.0),
+]
+
+
+def parse(code):
+    return Parser(Lexer(code).tokenize()).parse()
+
+
+def run(code, mode='tree', integrator=None):
+    interpreter = Interpreter(mode, integrator=integrator)
+    interpreter.interpret(parse(code))
+    return interpreter
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+@pytest.mark.parametrize('code, expected', INTEGRALS, ids=[code for code, _ in INTEGRALS])
+def test_accuracy(code, expected, mode):
+    assert run(f'y = {code}', mode).context.get('y') == pytest.approx(expected, rel=1e-10, abs=1e-10)
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_non_vectorizable_bodies(mode):
+    # Calls a script function, so the compiled body is evaluated per node
+    code = 'function f(x) {\n    return x * cos(x)\n}\ny = ∫(x=0, 1, f(x))\n'
+    assert run(code, mode).context.get('y') == pytest.approx(math.sin(1) + math.cos(1) - 1, rel=1e-10)
+
+
+def test_evaluation_budget():
+    with pytest.raises(RuntimeError, match='45 evaluations'):
+        run('y = ∫(x=0, 1, sqrt(x))', integrator=Integrator(max_evals=45))
+
+
+def test_explicit_tolerance():
+    default = run('y = ∫(x=0, 1, sqrt(x))').integrator
+    loose = run('y = ∫(x=0, 1, sqrt(x), 0.001)')
+    assert loose.context.get('y') == pytest.approx(2 / 3, abs=1e-3)
+    assert loose.integrator.evaluations < default.evaluations
+    # Within a budget the default tolerance does not fit in
+    budget = Integrator(max_evals=default.evaluations - 1)
+    run('y = ∫(x=0, 1, sqrt(x), 0.001)', integrator=budget)
+    with pytest.raises(RuntimeError):
+        run('y = ∫(x=0, 1, sqrt(x))', integrator=budget)
+
+
+@pytest.mark.parametrize('lower, upper', [(0, math.inf), (-math.inf, 0), (0, math.nan)])
+def test_bounds_must_be_finite(lower, upper):
+    plan = integral_plan(parse('y = ∫(x=0, 1, x)')[0].expr)
+    builtins = load_builtins()
+    with pytest.raises(ValueError, match='finite'):
+        Integrator().integrate(plan, lower, upper, builtins.get, lambda x: x)
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_repeated_integrals_are_cached(mode):
+    code = 'c = 2\ns = 0\nfor k in range(0, 5) {\n    s = s + ∫(x=0, 1, x * c)\n}\n'
+    interpreter = run(code, mode)
+    assert interpreter.context.get('s') == pytest.approx(5.0)
+    stats = interpreter.integrator.cache.stats()
+    assert (stats['hits'], stats['misses']) == (4, 1)
+    assert interpreter.integrator.evaluations == run('y = ∫(x=0, 1, x * 2)').integrator.evaluations
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_free_variables_are_part_of_the_key(mode):
+    code = 's = 0\nfor k in range(1, 4) {\n    s = s + ∫(x=0, 1, x * k)\n}\n'
+    interpreter = run(code, mode)
+    assert interpreter.context.get('s') == pytest.approx(3.0)
+    assert interpreter.integrator.cache.stats()['hits'] == 0
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_non_vectorizable_bodies_are_not_cached(mode):
+    code = ('function f(x) {\n    return x\n}\n'
+            's = 0\nfor k in range(0, 3) {\n    s = s + ∫(x=0, 1, f(x))\n}\n')
+    interpreter = run(code, mode)
+    assert interpreter.context.get('s') == pytest.approx(1.5)
+    stats = interpreter.integrator.cache.stats()
+    assert (stats['hits'], stats['size']) == (0, 0)
@@ -0,0 +1,74 @@
+# tests/test_lexer.py
+
+import io
+
+import pytest
+
+from mathscript.lexer import Lexer
+from mathscript.parser import Parser, VarAssignNode
+
+SOURCE = '''\
+# a comment long enough to cross several chunks ∑∏∫
+x = 12.5 * (3 - y) # trailing comment
+s = "a string long enough to cross a chunk boundary, with ∑ inside"
+t = "a string
+over two lines" + "and another"
+function f(a, b) {
+    return a >= b and not (a == b)
+}
+total = ∑(i=1, 10, i ^ 2)   
+'''
+
+
+def tokens(lexer_tokens):
+    return [(token.type, token.value, token.line, token.column) for token in lexer_tokens]
+
+
+@pytest.mark.parametrize('read_size', [1, 2, 3, 7, 64])
+@pytest.mark.parametrize('binary', [False, True])
+def test_stream_matches_tokenize(read_size, binary):
+    expected = tokens(Lexer(SOURCE).tokenize())
+    source = io.BytesIO(SOURCE.encode('utf-8')) if binary else io.StringIO(SOURCE)
+    assert tokens(Lexer(source, read_size=read_size).stream()) == expected
+
+
+def test_positions():
+    found = {(token.type, str(token.value)): (token.line, token.column) for token in Lexer(SOURCE).tokenize()}
+    assert found[('IDENT', 'x')] == (2, 1)
+    assert found[('NUMBER', '12.5')] == (2, 5)
+    # After the string over two lines
+    assert found[('OP', '+')] == (5, 17)
+    assert found[('IDENT', 'total')] == (9, 1)
+    assert found[('EOF', 'None')] == (10, 1)
+
+
+def test_unterminated_string_at_the_end():
+    with pytest.raises(RuntimeError, match='line 2'):
+        list(Lexer(io.StringIO('x = 1\ny = "open\n'), read_size=2).stream())
+
+
+class CountingReader(io.StringIO):
+    def __init__(self, text):
+        super().__init__(text)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+def test_statements_are_parsed_as_they_arrive():
+    source = CountingReader(''.join(f'v{i} = {i} * 2\n' for i in range(1000)))
+    statements = Parser(Lexer(source, read_size=16).stream()).statements()
+    first = next(statements)
+    assert isinstance(first, VarAssignNode) and first.var_name == 'v0'
+    assert source.reads < 5
+    assert sum(1 for _ in statements) == 999
+
+
+def test_statements_before_an_error_are_yielded():
+    source = io.StringIO('a = 1\nb = 2\nc = $\n')
+    statements = Parser(Lexer(source, read_size=4).stream()).statements()
+    assert [next(statements).var_name, next(statements).var_name] == ['a', 'b']
+    with pytest.raises(RuntimeError, match="'\\$'"):
+        next(statements)
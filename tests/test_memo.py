@@ -0,0 +1,100 @@
+# tests/test_memo.py
+
+import pytest
+
+from mathscript.interpreter import Interpreter
+from mathscript.lexer import Lexer
+from mathscript.memo import MemoCache, PurityAnalyzer, MISSING
+from mathscript.parser import Parser
+
+FIB = '''\
+@memo
+function fib(n) {
+    if n < 2 {
+        return n
+    }
+    return fib(n - 1) + fib(n - 2)
+}
+x = fib(20)
+'''
+
+SQUARE = '''\
+@memo
+function sq(n) {
+    return n * n
+}
+'''
+
+IMPURE = {
+    'print': ('function f(n) {\n    print(n)\n    return n\n}\n', "calls 'print'"),
+    'global read': ('k = 2\nfunction f(n) {\n    return n * k\n}\n', "reads outer variable 'k'"),
+    'impure callee': ('function g(n) {\n    print(n)\n    return n\n}\n'
+                      'function f(n) {\n    return g(n) + 1\n}\n', "calls impure function 'g'"),
+    'reassigned': ('function f(n) {\n    return n\n}\nf = 1\n', "'f' is reassigned"),
+    'missing return': ('function f(n) {\n    if n > 0 {\n        return n\n    }\n}\n', 'every path'),
+}
+
+
+def parse(code):
+    return Parser(Lexer(code).tokenize()).parse()
+
+
+def run(code, mode, **options):
+    interpreter = Interpreter(mode, **options)
+    interpreter.interpret(parse(code))
+    return interpreter
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_hits_and_misses(mode):
+    interpreter = run(FIB, mode)
+    assert interpreter.context.get('x') == 6765
+    # One miss per n in 0..20; fib(n - 2) is then a hit for n >= 3
+    stats = interpreter.memo_stats()['fib']
+    assert (stats['hits'], stats['misses'], stats['size']) == (18, 21, 21)
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_least_recently_used_entries_are_evicted(mode):
+    interpreter = run(SQUARE + 'a = sq(1)\nb = sq(2)\nc = sq(1)\nd = sq(3)\ne = sq(1)\nf = sq(2)\n',
+                      mode, memo_size=2)
+    assert [interpreter.context.get(name) for name in 'abcdef'] == [1, 4, 1, 9, 1, 4]
+    # sq(3) evicts sq(2), as sq(1) was used since; sq(2) then evicts sq(3)
+    assert interpreter.memo_stats()['sq'] == {'hits': 2, 'misses': 4, 'evictions': 2,
+                                              'size': 2, 'maxsize': 2}
+
+
+def test_cache_keys_tell_ints_from_floats():
+    cache = MemoCache('f')
+    cache.put(cache.key((1,)), 'int')
+    assert cache.get(cache.key((1.0,))) is MISSING
+    assert cache.get(cache.key((1,))) == 'int'
+
+
+@pytest.mark.parametrize('name', sorted(IMPURE))
+def test_impure_functions(name):
+    code, reason = IMPURE[name]
+    reasons = PurityAnalyzer(Interpreter().builtins).analyze(parse(code))
+    assert reason in {node.func_name: value for node, value in reasons.items()}['f']
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+@pytest.mark.parametrize('name', sorted(IMPURE))
+def test_impure_functions_are_not_memoized(name, mode, capsys):
+    code = IMPURE[name][0]
+    # memoize=True skips them quietly; @memo is an error
+    interpreter = run(code, mode, memoize=True)
+    assert [node.func_name for node in interpreter.memo_nodes] == []
+    with pytest.raises(SyntaxError, match='not pure'):
+        run(code.replace('function f', '@memo\nfunction f', 1), mode)
+
+
+def test_memoize_picks_pure_functions_without_annotation():
+    interpreter = run(SQUARE.replace('@memo\n', '') + 'a = sq(3)\nb = sq(3)\n', 'tree', memoize=True)
+    assert interpreter.memo_stats()['sq']['hits'] == 1
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_impure_calls_run_every_time(mode, capsys):
+    run('function f(n) {\n    print(n)\n    return n\n}\na = f(1)\nb = f(1)\n', mode, memoize=True)
+    assert capsys.readouterr().out.split() == ['1.0', '1.0']
@@ -0,0 +1,170 @@
+# tests/test_msc.py
+
+import hashlib
+import hmac
+import os
+import pickle
+import stat
+
+import pytest
+
+from mathscript import msc
+from mathscript.lexer import Token
+from mathscript.parser import ASTNode
+
+SOURCE = '''\
+x = 2
+function f(n) {
+    return n * x + 1
+}
+y = f(3)
+items = [1, 2, 3]
+'''
+
+
+def dump(value):
+    # A comparable form of a program
+    if isinstance(value, list):
+        return [dump(item) for item in value]
+    if isinstance(value, ASTNode):
+        return (type(value).__name__, getattr(value, 'line', None),
+                [dump(field) for field in value.field_values()])
+    if isinstance(value, Token):
+        return ('Token', value.type, value.value)
+    return value
+
+
+@pytest.fixture
+def script(tmp_path, monkeypatch):
+    monkeypatch.delenv(msc.CACHE_DIR_ENV, raising=False)
+    monkeypatch.delenv(msc.NO_WRITE_ENV, raising=False)
+    path = tmp_path / 'script.ms'
+    path.write_text(SOURCE, encoding='utf-8')
+    return str(path)
+
+
+def artifact_of(path, optimize=False):
+    return msc.artifact_path(msc.source_key(SOURCE, optimize), path, optimize=optimize)
+
+
+def test_artifact_is_written_and_reused(script, monkeypatch):
+    ast = msc.load_file(script)
+    assert os.path.exists(artifact_of(script))
+
+    def parse(code):
+        raise AssertionError('parsed again')
+    monkeypatch.setattr(msc, 'parse', parse)
+    assert dump(msc.load_file(script)) == dump(ast)
+
+
+def test_changed_source_is_parsed_again(script):
+    msc.load_file(script)
+    changed = SOURCE.replace('x = 2', 'x = 5')
+    with open(script, 'w', encoding='utf-8') as f:
+        f.write(changed)
+    assert dump(msc.load_file(script)) == dump(msc.parse(changed))
+    # The stale artifact was replaced
+    key = msc.source_key(changed)
+    assert msc.read_artifact(msc.artifact_path(key, script), key) is not None
+
+
+def test_new_language_version_invalidates(script, monkeypatch):
+    msc.load_file(script)
+    artifact = artifact_of(script)
+    monkeypatch.setattr(msc, 'LANGUAGE_VERSION', msc.LANGUAGE_VERSION + 1)
+    assert msc.read_artifact(artifact, msc.source_key(SOURCE)) is None
+
+
+def test_optimized_programs_have_their_own_artifact(script):
+    msc.load_file(script)
+    msc.load_file(script, optimize=True)
+    assert artifact_of(script) != artifact_of(script, optimize=True)
+    assert os.path.exists(artifact_of(script, optimize=True))
+
+
+@pytest.mark.parametrize('contents', [b'', b'MSC\x00', b'garbage', None])
+def test_bad_artifact_is_ignored(script, contents):
+    msc.load_file(script)
+    artifact = artifact_of(script)
+    with open(artifact, 'rb') as f:
+        data = f.read()
+    if contents is None:
+        # Right header, truncated payload
+        contents = data[:len(data) // 2]
+    with open(artifact, 'wb') as f:
+        f.write(contents)
+    assert dump(msc.load_file(script)) == dump(msc.parse(SOURCE))
+
+
+def test_no_write_env(script, monkeypatch):
+    monkeypatch.setenv(msc.NO_WRITE_ENV, '1')
+    msc.load_file(script)
+    assert not os.path.exists(artifact_of(script))
+
+
+def test_cache_dir(script, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    msc.load_file(script, cache_dir=str(cache_dir))
+    assert os.listdir(cache_dir) == [msc.source_key(SOURCE).hex() + '.msc']
+
+
+class Planted:
+    loaded = False
+
+    def __reduce__(self):
+        return (plant, ())
+
+
+def plant():
+    Planted.loaded = True
+    return 'planted'
+
+
+@pytest.mark.parametrize('mac', [b'', b'\0' * 32, None])
+def test_unsigned_artifact_is_not_unpickled(script, mac):
+    key = msc.source_key(SOURCE)
+    payload = pickle.dumps(Planted())
+    if mac is None:
+        # Signed, but with another secret
+        mac = hmac.new(b'someone else', msc.MAGIC + key + payload, hashlib.sha256).digest()
+    artifact = artifact_of(script)
+    os.makedirs(os.path.dirname(artifact))
+    with open(artifact, 'wb') as f:
+        f.write(msc.MAGIC + key + mac + payload)
+    assert msc.read_artifact(artifact, key) is None
+    assert not Planted.loaded
+    assert dump(msc.load_file(script)) == dump(msc.parse(SOURCE))
+
+
+def test_artifacts_of_another_secret_are_parsed_again(script, monkeypatch):
+    msc.load_file(script)
+    monkeypatch.setenv(msc.SECRET_ENV, 'another secret')
+    assert msc.read_artifact(artifact_of(script), msc.source_key(SOURCE)) is None
+
+
+def test_secret_file(script, tmp_path, monkeypatch):
+    monkeypatch.delenv(msc.SECRET_ENV)
+    monkeypatch.setattr(msc, '_secrets', {})
+    path = tmp_path / 'home' / 'msc.key'
+    monkeypatch.setattr(msc, 'SECRET_PATH', str(path))
+    ast = msc.load_file(script)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    secret = path.read_bytes()
+    assert len(secret) == 32
+    # Another process reads the same file
+    monkeypatch.setattr(msc, '_secrets', {})
+    assert msc.artifact_secret() == secret
+    assert dump(msc.read_artifact(artifact_of(script), msc.source_key(SOURCE))) == dump(ast)
+
+
+def test_secret_for_this_process_only(script, tmp_path, monkeypatch):
+    monkeypatch.delenv(msc.SECRET_ENV)
+    monkeypatch.setattr(msc, '_secrets', {})
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    # The secret cannot be stored below a file
+    monkeypatch.setattr(msc, 'SECRET_PATH', str(blocker / 'msc.key'))
+    msc.load_file(script)
+    assert msc.read_artifact(artifact_of(script), msc.source_key(SOURCE)) is not None
+    monkeypatch.setattr(msc, '_secrets', {})
+    assert msc.read_artifact(artifact_of(script), msc.source_key(SOURCE)) is None
@@ -0,0 +1,102 @@
+# tests/test_optimizer.py
+
+import io
+import json
+
+import pytest
+
+from mathscript.cli import run_batch
+from mathscript.interpreter import Interpreter
+from mathscript.lexer import Lexer
+from mathscript.mahscript import MathScript
+from mathscript.parser import Parser
+
+LOOPS = '''\
+a = 3
+b = 4
+total = 0
+for i in range(0, 3) {
+    total = total + (a * b) + (a * b)
+}
+n = 0
+while n < 5 {
+    n = n + 1
+    c = (a + b) * 2 + (a + b)
+}
+function f(x) {
+    s = 0
+    for j in range(0, x) {
+        s = s + (a * b) * j
+    }
+    return s
+}
+r = f(4)
+'''
+
+
+def parse(code):
+    return Parser(Lexer(code).tokenize()).parse()
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_optimizing_keeps_the_globals(mode):
+    plain = Interpreter(mode)
+    plain.interpret(parse(LOOPS))
+    optimized = Interpreter(mode, optimize=True)
+    optimized.interpret(parse(LOOPS))
+    assert optimized.optimizations
+    assert sorted(optimized.context.variables) == sorted(plain.context.variables)
+    assert optimized.context.get('total') == plain.context.get('total') == 72
+    assert optimized.context.get('r') == plain.context.get('r')
+
+
+def test_cli_optimize_reports_the_same_variables(tmp_path):
+    path = tmp_path / 'loops.ms'
+    path.write_text(LOOPS)
+    reports = []
+    for optimize in (False, True):
+        out = io.StringIO()
+        failed = run_batch([str(path)], workers=0, options={'optimize': optimize}, out=out, use_cache=False)
+        assert failed == 0
+        reports.append(json.loads(out.getvalue())['variables'])
+    assert reports[0] == reports[1]
+
+
+def test_temporaries_are_dropped_when_the_program_fails():
+    interpreter = Interpreter('closure', optimize=True)
+    with pytest.raises(ZeroDivisionError):
+        interpreter.interpret(parse('a = 2\nfor i in range(0, 3) {\n    x = (a * a) / 0\n}\n'))
+    assert [name for name in interpreter.context.variables if name.startswith('__')] == []
+
+
+def test_reserved_names_are_rejected():
+    with pytest.raises(RuntimeError, match='reserved'):
+        parse('__cse0 = 1\n')
+
+
+ARRAY_LOOP = '''\
+a = [1, 2, 3]
+e = []
+k = 3
+s = 0
+for v in a {
+    s = s + v * (k * 2)
+}
+for v in e {
+    s = s + v * (k * 3)
+}
+'''
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_hoisting_out_of_a_loop_over_an_array(mode):
+    interpreter = Interpreter(mode, optimize=True)
+    interpreter.interpret(parse(ARRAY_LOOP))
+    assert any('hoisted' in change for change in interpreter.optimizations)
+    assert interpreter.context.get('s') == 36
+
+
+def test_transpiled_hoisting_out_of_a_loop_over_an_array():
+    script = MathScript(optimize=True)
+    script.execute(ARRAY_LOOP)
+    assert script.variables['s'] == 36
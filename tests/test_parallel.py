@@ -0,0 +1,130 @@
+# tests/test_parallel.py
+
+import pytest
+
+from mathscript.interpreter import Interpreter
+from mathscript.lexer import Lexer
+from mathscript.parser import Parser
+
+
+def run(code, mode='tree', workers=0):
+    interpreter = Interpreter(mode, workers=workers)
+    interpreter.interpret(Parser(Lexer(code).tokenize()).parse())
+    return interpreter.context.variables
+
+
+ACCEPTED = '''\
+scale = 2
+function square(v) {
+    return v * v
+}
+total = 0
+product = 1
+parallel for i in range(1, 6) reduce sum into total, product into product {
+    t = square(i) * scale
+    if t > 10 {
+        t = t - 1
+    }
+    total = total + t
+    product = product * i
+}
+'''
+
+REJECTED = {
+    'conditional write': ('''\
+total = 0
+parallel for i in range(0, 4) {
+    if i > 1 {
+        y = i
+    }
+}
+''', "shared variable 'y'"),
+    'read before write': ('''\
+parallel for i in range(0, 4) {
+    t = t + i
+}
+''', "'t'"),
+    'loop variable': ('''\
+parallel for i in range(0, 4) {
+    i = 1
+}
+''', 'loop variable'),
+    'reduction read elsewhere': ('''\
+total = 0
+parallel for i in range(0, 4) reduce sum into total {
+    t = total
+    total = total + i
+}
+''', "'total'"),
+    'wrong reduction operator': ('''\
+total = 0
+parallel for i in range(0, 4) reduce sum into total {
+    total = total * i
+}
+''', "'total'"),
+    'method on shared variable': ('''\
+items = [1]
+parallel for i in range(0, 4) {
+    items.append(i)
+}
+''', "'append'"),
+    'nested function': ('''\
+parallel for i in range(0, 4) {
+    function f() {
+        return 1
+    }
+}
+''', "'f'"),
+    'return': ('''\
+function f() {
+    parallel for i in range(0, 4) {
+        return i
+    }
+}
+''', 'return'),
+    'nested loop': ('''\
+parallel for i in range(0, 4) {
+    parallel for j in range(0, 4) {
+        t = j
+    }
+}
+''', 'nested'),
+}
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_accepted_body_matches_serial_loop(mode):
+    variables = run(ACCEPTED, mode)
+    expected = run(ACCEPTED.replace('parallel for', 'for').replace(
+        ' reduce sum into total, product into product', ''))
+    assert variables['total'] == expected['total'] == 2 + 8 + 17 + 31 + 49
+    assert variables['product'] == expected['product'] == 120
+
+
+def test_worker_processes_match_in_process():
+    assert run(ACCEPTED, workers=2)['total'] == run(ACCEPTED)['total']
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_private_variables_stay_in_the_body(mode):
+    # Assigned first thing in every iteration, x is private to it
+    assert run('x = 0\nparallel for i in range(0, 4) {\n    x = i\n}\n', mode)['x'] == 0
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+@pytest.mark.parametrize('name', sorted(REJECTED))
+def test_rejected_bodies(name, mode):
+    code, message = REJECTED[name]
+    with pytest.raises(SyntaxError, match='parallel for') as info:
+        run(code, mode)
+    assert message in str(info.value)
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_calls_functions_from_an_earlier_batch(mode):
+    interpreter = Interpreter(mode, workers=0)
+    statements = Parser(Lexer(ACCEPTED).tokenize()).parse()
+    # One statement per batch, as in the REPL
+    interpreter.interpret_stream(statements, batch_size=1)
+    assert interpreter.context.get('total') == 2 + 8 + 17 + 31 + 49
+    assert interpreter.context.get('product') == 120
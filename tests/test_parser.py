@@ -0,0 +1,42 @@
+# tests/test_parser.py
+
+import pytest
+
+from mathscript.interpreter import Interpreter
+from mathscript.lexer import Lexer
+from mathscript.parser import Parser, BinOpNode, UnaryOpNode
+
+
+def parse_expr(code):
+    return Parser(Lexer(f'r = {code}\n').tokenize()).parse()[0].expr
+
+
+def shape(node):
+    """An expression as nested tuples of operators, for comparing groupings."""
+    if isinstance(node, BinOpNode):
+        return (shape(node.left_node), node.op_token.value, shape(node.right_node))
+    if isinstance(node, UnaryOpNode):
+        return (node.op_token.value, shape(node.node))
+    return getattr(node, 'var_name', getattr(node, 'value', None))
+
+
+@pytest.mark.parametrize('code, expected', [
+    ('a or b and c', (('a', 'or', 'b'), 'and', 'c')),
+    ('a and b or c', (('a', 'and', 'b'), 'or', 'c')),
+    ('a == b and c < d', (('a', '==', 'b'), 'and', ('c', '<', 'd'))),
+    ('a + b * c - d', (('a', '+', ('b', '*', 'c')), '-', 'd')),
+    ('a - b - c', (('a', '-', 'b'), '-', 'c')),
+    ('a ^ b ^ c', ('a', '^', ('b', '^', 'c'))),
+    ('-a ^ 2', ('-', ('a', '^', 2.0))),
+    ('not a == b', (('not', 'a'), '==', 'b')),
+    ('a % b * c', (('a', '%', 'b'), '*', 'c')),
+])
+def test_grouping(code, expected):
+    assert shape(parse_expr(code)) == expected
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_and_or_share_one_level(mode):
+    interpreter = Interpreter(mode)
+    interpreter.interpret(Parser(Lexer('a = 1\nb = 0\nc = 0\nr = a or b and c\n').tokenize()).parse())
+    assert not interpreter.context.get('r')
@@ -0,0 +1,91 @@
+# tests/test_profiler.py
+
+import io
+import json
+import tracemalloc
+
+import pytest
+
+from mathscript.cli import main
+from mathscript.interpreter import Interpreter
+from mathscript.lexer import Lexer
+from mathscript.parser import Parser
+from mathscript.profiler import Profiler, MemoryProfiler, format_summary
+
+
+def test_percentages_are_of_the_whole_profile():
+    clock = [0.0]
+    profiler = Profiler(timer=lambda: clock[0])
+    for name, seconds in [('a', 1.0), ('b', 1.0), ('c', 2.0)]:
+        profiler.enter_call(name)
+        clock[0] += seconds
+        profiler.exit_call()
+    summary = profiler.summary(limit=1)
+    assert [entry['name'] for entry in summary['functions']] == ['c']
+    assert summary['total'] == 4.0
+    out = io.StringIO()
+    format_summary(summary, out)
+    assert ' 50.0%' in out.getvalue()
+    assert '100.0%' not in out.getvalue()
+
+
+def test_total_covers_every_function():
+    code = 'function f(n) {\n    return n * 2\n}\nfunction g(n) {\n    return f(n) + 1\n}\nx = g(1) + f(2)\n'
+    profiler = Profiler()
+    interpreter = Interpreter('tree', profiler=profiler)
+    interpreter.interpret(Parser(Lexer(code).tokenize()).parse())
+    full = profiler.summary()
+    assert full['total'] == sum(entry['exclusive'] for entry in full['functions'])
+    assert profiler.summary(limit=1)['total'] == full['total']
+
+
+MEMORY = '''\
+function grow(n) {
+    a = []
+    for i in range(0, n) {
+        a.append(i)
+    }
+    return a
+}
+kept = grow(20000)
+s = grow(20000).sum()
+'''
+
+
+def test_memory_profile():
+    profiler = MemoryProfiler()
+    interpreter = Interpreter('tree', profiler=profiler)
+    interpreter.interpret(Parser(Lexer(MEMORY).tokenize()).parse())
+    assert not tracemalloc.is_tracing()
+    summary = profiler.summary(MEMORY)
+    json.dumps(summary)
+    lines = {entry['line']: entry for entry in summary['lines']}
+    # 20000 doubles stay allocated after line 8; line 9's array is freed
+    assert lines[8]['inclusive'] >= 20000 * 8
+    assert lines[8]['source'] == 'kept = grow(20000)'
+    assert lines[9]['peak'] >= 20000 * 8
+    assert lines[9]['inclusive'] < 20000 * 8 / 4
+    grow = next(entry for entry in summary['functions'] if entry['name'] == 'grow')
+    assert grow['calls'] == 2
+    assert grow['peak'] >= 20000 * 8
+    run, = summary['runs']
+    assert run['growth'] >= 20000 * 8
+    assert run['peak'] >= run['before'] + run['growth']
+    out = io.StringIO()
+    format_summary(summary, out)
+    assert out.getvalue().startswith('run 1: peak ')
+
+
+def test_cli_profile_memory(tmp_path, capsys):
+    path = tmp_path / 'grow.ms'
+    path.write_text(MEMORY)
+    stacks = tmp_path / 'stacks.txt'
+    with pytest.raises(SystemExit) as info:
+        main([str(path), '-j', '0', '--no-cache', '--profile-memory', '--profile-output', str(stacks)])
+    assert info.value.code == 0
+    captured = capsys.readouterr()
+    assert json.loads(captured.out)['variables']['s'] == sum(range(20000))
+    assert f'Profile of {path}' in captured.err
+    assert 'KiB' in captured.err
+    frames = [line.rsplit(' ', 1)[0] for line in stacks.read_text().splitlines()]
+    assert f'{path};<module>;grow' in frames
@@ -0,0 +1,110 @@
+# tests/test_series.py
+
+import math
+
+import pytest
+
+from mathscript import series
+from mathscript.interpreter import Interpreter, load_builtins
+from mathscript.lexer import Lexer
+from mathscript.parser import Parser
+from mathscript.series import SeriesPlanner, evaluate_series
+
+pytest.importorskip('numpy')
+
+
+def brute_sum(body, first, last):
+    total = 0.0
+    for i in range(first, last + 1):
+        total = total + body(i)
+    return total
+
+
+def brute_product(body, first, last):
+    total = 1.0
+    for i in range(first, last + 1):
+        total = total * body(i)
+    return total
+
+
+# (expression, closed form kind, expected)
+SERIES = {
+    'polynomial': ('∑(i=-5, 10, 2 * i ^ 2 - 3 * i + 1)', 'poly',
+                   brute_sum(lambda i: 2 * i ** 2 - 3 * i + 1, -5, 10)),
+    'cubic over negatives': ('∑(i=-7, -2, a * pow(i, 3) / 4)', 'poly',
+                             brute_sum(lambda i: 1.5 * i ** 3 / 4, -7, -2)),
+    'constant': ('∑(i=3, 12, a)', 'poly', 15.0),
+    'geometric': ('∑(i=0, 20, 3 * 2 ^ i)', 'geometric', brute_sum(lambda i: 3 * 2 ** i, 0, 20)),
+    'geometric from a negative index': ('∑(i=-3, 5, 0.5 ^ i * a)', 'geometric',
+                                        brute_sum(lambda i: 0.5 ** i * 1.5, -3, 5)),
+    'ratio one': ('∑(i=-3, 4, pow(1, i))', 'geometric', 8.0),
+    'factorial': ('∏(i=1, 10, i)', 'factorial', 3628800.0),
+    'factorial over zero': ('∏(i=-2, 3, i)', 'factorial', 0.0),
+    'factorial of negatives': ('∏(i=-4, -1, i)', 'factorial', 24.0),
+    'factorial overflow': ('∏(i=1, 200, i)', 'factorial', math.inf),
+    'factorial overflow from a large start': ('∏(i=150, 400, i)', 'factorial', math.inf),
+    'empty sum': ('∑(i=5, 4, i)', 'poly', 0.0),
+    'empty product': ('∏(i=5, 4, i)', 'factorial', 1.0),
+}
+
+
+def parse(code):
+    return Parser(Lexer(code).tokenize()).parse()
+
+
+def run(code, mode='tree'):
+    interpreter = Interpreter(mode)
+    interpreter.interpret(parse(code))
+    return interpreter.context
+
+
+@pytest.mark.parametrize('name', sorted(SERIES))
+def test_closed_forms_are_planned(name):
+    code, kind, _ = SERIES[name]
+    node = parse(f'x = {code}')[0].expr
+    closed_form = SeriesPlanner().plan(node)[1]
+    assert closed_form is not None and closed_form[0] == kind
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+@pytest.mark.parametrize('name', sorted(SERIES))
+def test_closed_forms_match_brute_force(name, mode):
+    code, _, expected = SERIES[name]
+    assert run(f'a = 1.5\nx = {code}', mode).get('x') == pytest.approx(expected, rel=1e-12)
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_rebound_pow_is_called(mode):
+    code = 'function pow(a, b) {\n    return a + b\n}\nx = ∑(i=1, 4, pow(i, 2))\ny = ∑(i=0, 3, pow(2, i))\n'
+    context = run(code, mode)
+    assert context.get('x') == 18
+    assert context.get('y') == 14
+
+
+def evaluate(code, start, end, variables=None):
+    node = parse(f'x = {code}')[0].expr
+    builtins = load_builtins()
+    lookup = lambda name: (variables or {}).get(name, builtins.get(name))
+    body = lambda i: pytest.fail('the body should not be called one index at a time')
+    return evaluate_series(isinstance(node, series.ProductNode), SeriesPlanner().plan(node),
+                           start, end, lookup, body)
+
+
+@pytest.mark.parametrize('chunk', [7, 64, series.SERIES_CHUNK])
+def test_vectorized_batches_match_a_sequential_loop(chunk, monkeypatch):
+    monkeypatch.setattr(series, 'SERIES_CHUNK', chunk)
+    # Sums are accumulated in order, so exactly rounded bodies match exactly
+    assert evaluate('∑(i=1, 500, i / 3)', 1, 500) == brute_sum(lambda i: i / 3, 1, 500)
+    assert evaluate('∑(i=-100, 300, i * i / 7 - i)', -100, 300) == \
+        brute_sum(lambda i: i * i / 7 - i, -100, 300)
+    assert evaluate('∏(i=1, 100, 1 + i / 1000)', 1, 100) == \
+        brute_product(lambda i: 1 + i / 1000, 1, 100)
+    assert evaluate('∑(i=0, 400, sin(i) * i)', 0, 400) == \
+        pytest.approx(brute_sum(lambda i: math.sin(i) * i, 0, 400), rel=1e-12)
+
+
+def test_loop_fallback_when_vectorizing_fails():
+    with pytest.raises(ZeroDivisionError):
+        run('x = ∑(i=1, 100, 1 / (i - 50))')
+    assert run('x = ∑(i=1, 100, 1 / (i - 50.5))').get('x') == \
+        pytest.approx(brute_sum(lambda i: 1 / (i - 50.5), 1, 100), rel=1e-12)
@@ -0,0 +1,95 @@
+# tests/test_session.py
+
+import asyncio
+
+import pytest
+
+from mathscript.interpreter import Interpreter
+from mathscript.session import Session
+
+FOREVER = 'n = 0\nwhile 1 {\n    n = n + 1\n}\n'
+
+RECURSE_FOREVER = 'function f(n) {\n    return f(n + 1)\n}\nx = f(0)\n'
+
+
+def test_run_and_output():
+    async def main():
+        async with Session() as session:
+            await session.run('x = 2 ^ 10\nprint(x)\nprint("done")')
+            return session.get('x'), [session.output.get_nowait() for _ in range(session.output.qsize())]
+    assert asyncio.run(main()) == (1024, ['1024.0', 'done'])
+
+
+def test_stream():
+    async def main():
+        async with Session() as session:
+            return [line async for line in session.stream('for i in range(0, 3) {\n    print(i)\n}')]
+    assert asyncio.run(main()) == ['0', '1', '2']
+
+
+# Only the VM recurses forever; the other engines hit the recursion limit
+@pytest.mark.parametrize('mode, program', [(mode, FOREVER) for mode in Interpreter.MODES]
+                         + [('vm', RECURSE_FOREVER)], ids=[*Interpreter.MODES, 'vm-calls'])
+def test_timeout(mode, program):
+    async def main():
+        async with Session(mode) as session:
+            with pytest.raises(TimeoutError):
+                await session.run(program, timeout=0.2)
+            # The session still works afterwards
+            await session.run('y = 3', timeout=5)
+            return session.get('y')
+    assert asyncio.run(main()) == 3
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_cancel(mode):
+    async def main():
+        async with Session(mode) as session:
+            task = asyncio.ensure_future(session.run(FOREVER))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # The cancelled program stopped before the next one started
+            stopped_at = session.get('n')
+            await session.run('y = 3', timeout=5)
+            assert session.get('n') == stopped_at
+            return session.get('y')
+    assert asyncio.run(main()) == 3
+
+
+def test_timeout_cancels_with_wait_for():
+    async def main():
+        async with Session() as session:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(session.run(FOREVER), 0.1)
+            await session.run('y = 3', timeout=5)
+            return session.get('y')
+    assert asyncio.run(main()) == 3
+
+
+def test_leaving_a_stream_stops_the_program():
+    async def main():
+        async with Session() as session:
+            lines = []
+            async for line in session.stream('i = 0\nwhile 1 {\n    print(i)\n    i = i + 1\n}'):
+                lines.append(line)
+                if len(lines) == 3:
+                    break
+            await session.run('y = 3', timeout=5)
+            return lines, session.get('y')
+    assert asyncio.run(main()) == (['0.0', '1.0', '2.0'], 3)
+
+
+def test_event_loop_stays_responsive():
+    async def main():
+        async with Session() as session:
+            task = asyncio.ensure_future(session.run(FOREVER, timeout=1))
+            ticks = 0
+            while not task.done():
+                await asyncio.sleep(0.01)
+                ticks += 1
+            with pytest.raises(TimeoutError):
+                await task
+            return ticks
+    assert asyncio.run(main()) > 10
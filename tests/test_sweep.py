@@ -0,0 +1,33 @@
+# tests/test_sweep.py
+
+from concurrent.futures import ThreadPoolExecutor
+
+from mathscript import sweep
+
+PROGRAM = '''\
+a = 1
+total = 0
+parallel for i in range(0, 4) reduce sum into total {
+    total = total + i * a
+}
+'''
+
+TABLE = {'a': [1, 2, 3, 4]}
+
+
+def totals(results):
+    return [result['total'] for result in results]
+
+
+def test_in_process():
+    assert totals(sweep.run_sweep(PROGRAM, TABLE, ['total'], workers=0)) == [6, 12, 18, 24]
+
+
+def test_pool_workers_run_parallel_loops_in_process(monkeypatch):
+    # Threads stand in for the worker processes, so the worker they build
+    # can be inspected
+    monkeypatch.setattr(sweep, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(sweep, 'worker', None)
+    results = sweep.run_sweep(PROGRAM, TABLE, ['total'], workers=2)
+    assert totals(results) == [6, 12, 18, 24]
+    assert sweep.worker.interpreter.workers == 0
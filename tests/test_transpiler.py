@@ -0,0 +1,123 @@
+# tests/test_transpiler.py
+
+import glob
+import os
+
+import pytest
+
+from mathscript.interpreter import Interpreter, Function
+from mathscript.lexer import Lexer
+from mathscript.mahscript import MathScript
+from mathscript.parser import Parser
+
+from conftest import EXAMPLES_DIR
+
+
+def interpret(code):
+    interpreter = Interpreter('tree')
+    interpreter.interpret(Parser(Lexer(code).tokenize()).parse())
+    return interpreter.context.variables
+
+
+def transpile_and_run(code, optimize=False):
+    script = MathScript(optimize=optimize)
+    script.execute(code)
+    return script.variables
+
+
+def values(variables):
+    # Functions differ in type between the two; compare everything else
+    return {name: repr(value) for name, value in variables.items()
+            if not isinstance(value, Function) and not callable(value)}
+
+
+PROGRAMS = {
+    'global fallback': '''\
+y = 5
+function f(n) {
+    if n > 0 {
+        y = 1
+    }
+    return y
+}
+a = f(0)
+b = f(1)
+''',
+    'enclosing fallback': '''\
+y = 3
+function f(n) {
+    function g() {
+        if n > 1 {
+            y = 10
+        }
+        return y
+    }
+    if n > 0 {
+        y = 2
+    }
+    return g()
+}
+a = f(0)
+b = f(1)
+c = f(2)
+''',
+    'implicit return': '''\
+function f() {
+    z = 1
+}
+r = f()
+''',
+    'implicit return of a global': '''\
+return_value = 7
+function f() {
+    z = 1
+}
+r = f()
+''',
+    'eager and/or': '''\
+calls = [0]
+function t() {
+    calls.append(1)
+    return 1
+}
+x = 1 or t()
+y = 0 and t()
+n = len(calls)
+''',
+    'series in a function': '''\
+x = 3
+function f(n) {
+    if n > 1 {
+        x = n
+    }
+    return ∑(i=1, x, i * n)
+}
+a = f(1)
+b = f(4)
+''',
+    'top-level return': '''\
+x = 1
+return 4
+x = 2
+''',
+}
+
+
+@pytest.mark.parametrize('name', sorted(PROGRAMS))
+def test_matches_interpreter(name):
+    code = PROGRAMS[name]
+    assert values(transpile_and_run(code)) == values(interpret(code))
+
+
+def test_and_or_evaluate_both_operands():
+    with pytest.raises(ZeroDivisionError):
+        transpile_and_run('x = 0 and (1 / 0)')
+
+
+@pytest.mark.parametrize('optimize', [False, True])
+@pytest.mark.parametrize('path', sorted(glob.glob(os.path.join(EXAMPLES_DIR, '*.ms'))),
+                         ids=os.path.basename)
+def test_examples_match_interpreter(path, optimize, capsys):
+    with open(path, encoding='utf-8') as f:
+        code = f.read()
+    assert values(transpile_and_run(code, optimize)) == values(interpret(code))
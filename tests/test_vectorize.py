@@ -0,0 +1,123 @@
+# tests/test_vectorize.py
+
+import pytest
+
+from mathscript.arrays import Array
+from mathscript.interpreter import Interpreter, load_builtins
+from mathscript.lexer import Lexer
+from mathscript.parser import Parser
+from mathscript.vectorize import LoopVectorizer, run_plan
+
+pytest.importorskip('numpy')
+
+REDUCTIONS = '''\
+a = []
+for i in range(0, 200) {
+    a.append(i / 7)
+}
+s = 0
+p = 1
+n = 0
+for i in range(0, 200) {
+    s = s + a[i] * 3 - i / 11
+    p = p * (1 + i / 1000)
+    n = n + (a[i] > 10)
+}
+m = []
+for i in range(-50, 150) {
+    m.append(i * 0.1 + a[i + 50])
+}
+'''
+
+APPROXIMATE = '''\
+s = 0
+t = 0
+for i in range(0, 200) {
+    s = s + sin(i) ^ 2
+    t = t + i % 7
+}
+'''
+
+
+def parse(code):
+    return Parser(Lexer(code).tokenize()).parse()
+
+
+def run(code, mode, vectorize):
+    interpreter = Interpreter(mode, vectorize=vectorize)
+    interpreter.interpret(parse(code))
+    return interpreter
+
+
+def values(interpreter):
+    return {name: repr(value) for name, value in interpreter.context.variables.items()}
+
+
+def plans(code, approximate=False):
+    return list(LoopVectorizer(approximate).analyze(parse(code)).values())
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_vectorized_loops_match_the_interpreter_exactly(mode):
+    assert len(plans(REDUCTIONS)) == 3
+    assert values(run(REDUCTIONS, mode, True)) == values(run(REDUCTIONS, mode, False))
+
+
+def test_approximate_operations_are_opt_in():
+    assert plans(APPROXIMATE) == []
+    assert len(plans(APPROXIMATE, approximate=True)) == 1
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_approximate_results_are_close(mode):
+    exact = run(APPROXIMATE, mode, False).context
+    approximate = run(APPROXIMATE, mode, 'approximate').context
+    assert approximate.get('s') == pytest.approx(exact.get('s'), rel=1e-12)
+    assert approximate.get('t') == exact.get('t')
+
+
+def lookup_in(variables):
+    builtins = load_builtins()
+    return lambda name: variables.get(name, builtins.get(name))
+
+
+@pytest.mark.parametrize('body, variables', [
+    # Division by zero part way through the range
+    ('s = s + 1 / (i - 40)', {'s': 0}),
+    # Index out of range, and not integral
+    ('s = s + a[i]', {'s': 0, 'a': Array([1.0] * 10)}),
+    ('s = s + a[i / 2]', {'s': 0, 'a': Array([1.0] * 100)}),
+    # Accumulator that is not a number
+    ('s = s + i', {'s': 'x'}),
+    # Leaves the range of exact integers
+    ('s = s * (i + 1)', {'s': 1}),
+])
+def test_plans_fall_back_to_the_interpreter(body, variables):
+    plan, = plans(f'for i in range(0, 100) {{\n    {body}\n}}\n', approximate=True)
+    before = dict(variables)
+    assert run_plan(plan, range(0, 100), lookup_in(variables)) is None
+    assert variables == before
+
+
+def test_short_loops_run_in_the_interpreter():
+    plan, = plans('for i in range(0, 10) {\n    s = s + i\n}\n')
+    assert run_plan(plan, range(0, 10), lookup_in({'s': 0})) is None
+    assert run_plan(plan, range(0, 100), lookup_in({'s': 0})) == {'s': 4950, 'i': 99}
+
+
+def test_rebound_builtins_are_not_vectorized():
+    plan, = plans('for i in range(0, 100) {\n    s = s + sin(i)\n}\n', approximate=True)
+    assert run_plan(plan, range(0, 100), lookup_in({'s': 0, 'sin': lambda x: x})) is None
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_rebound_builtins_in_scripts(mode):
+    code = 'function sin(x) {\n    return x * 2\n}\ns = 0\nfor i in range(0, 100) {\n    s = s + sin(i)\n}\n'
+    assert run(code, mode, 'approximate').context.get('s') == 9900
+
+
+@pytest.mark.parametrize('mode', Interpreter.MODES)
+def test_errors_are_raised_by_the_interpreter(mode):
+    code = 's = 0\nfor i in range(0, 100) {\n    s = s + 1 / (i - 40)\n}\n'
+    with pytest.raises(ZeroDivisionError):
+        run(code, mode, True)
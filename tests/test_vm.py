@@ -0,0 +1,86 @@
+# tests/test_vm.py
+
+import sys
+
+import pytest
+
+from mathscript.bytecode import BytecodeCompiler, CodeObject, VM
+from mathscript.interpreter import Interpreter
+from mathscript.lexer import Lexer
+from mathscript.parser import Parser
+
+
+def parse(code):
+    return Parser(Lexer(code).tokenize()).parse()
+
+
+def test_constants_and_names_are_shared():
+    code = CodeObject()
+    assert [code.const(value) for value in (1, 2.0, 1, True, 'a', 2.0)] == [0, 1, 0, 2, 3, 1]
+    assert code.consts == [1, 2.0, True, 'a']
+    assert [code.name_index(name) for name in ('x', 'y', 'x')] == [0, 1, 0]
+
+
+def test_round_trip_keeps_the_tables():
+    code = BytecodeCompiler().compile(parse('x = 1\ny = x + 1\nz = "s"\n'))
+    loaded = CodeObject.loads(code.dumps())
+    assert loaded.consts == code.consts
+    assert loaded.names == code.names
+    # New entries go after the loaded ones and existing ones are found
+    assert loaded.const(1) == code.const(1)
+    assert loaded.name_index('y') == code.name_index('y')
+    assert loaded.name_index('w') == len(code.names)
+
+    interpreter = Interpreter('vm')
+    VM(interpreter).run(loaded, interpreter.context)
+    assert interpreter.context.get('y') == 2
+
+
+def run(code, max_depth=None):
+    interpreter = Interpreter('vm')
+    if max_depth is None:
+        interpreter.interpret(parse(code))
+    else:
+        VM(interpreter, max_depth).run(BytecodeCompiler().compile(parse(code)), interpreter.context)
+    return interpreter.context
+
+
+DEPTH = '''\
+function depth(n) {
+    if n == 0 {
+        return 0
+    }
+    return 1 + depth(n - 1)
+}
+d = depth(N)
+'''
+
+COUNTDOWN = '''\
+function count(n, acc) {
+    if n == 0 {
+        return acc
+    }
+    return count(n - 1, acc + 1)
+}
+c = count(N, 0)
+'''
+
+
+def test_recursion_beyond_the_python_limit():
+    n = sys.getrecursionlimit() * 20
+    assert run(DEPTH.replace('N', str(n))).get('d') == n
+
+
+def test_tail_calls_run_in_constant_stack():
+    # Far more tail calls than the VM allows nested ones
+    assert run(COUNTDOWN.replace('N', '50000'), max_depth=10).get('c') == 50000
+
+
+def test_call_depth_limit():
+    interpreter = Interpreter('vm')
+    vm = VM(interpreter, max_depth=10)
+    with pytest.raises(RecursionError, match="call depth exceeded in 'depth'"):
+        vm.run(BytecodeCompiler().compile(parse(DEPTH.replace('N', '50'))), interpreter.context)
+    # Within the limit, the same VM still runs
+    vm.run(BytecodeCompiler().compile(parse(DEPTH.replace('N', '9'))), interpreter.context)
+    assert interpreter.context.get('d') == 9
@@ -0,0 +1,357 @@
+# mathscript/vectorize.py
+
+from .parser import *
+from .arrays import Array, np
+from .stdlib import mathlib
+
+# Loops over fewer items run in the interpreter: below this NumPy's
+# per-call overhead costs more than the iterations it saves.
+VECTOR_MIN_LENGTH = 32
+
+# Integers beyond this are not exact in float64
+EXACT_INT_LIMIT = 2 ** 53
+
+ARITHMETIC_OPS = ('+', '-', '*', '/', '%', '^')
+
+# Operators whose NumPy implementation may round differently from
+# Python's; loops using them, or math builtins, are only vectorized when
+# approximate results are allowed. + - * / are exactly rounded in both.
+APPROXIMATE_OPS = ('%', '^')
+COMPARISON_OPS = ('==', '!=', '<', '>', '<=', '>=')
+
+if np is not None:
+    BINARY_UFUNCS = {
+        '+': np.add,
+        '-': np.subtract,
+        '*': np.multiply,
+        '/': np.true_divide,
+        '%': np.mod,
+        '^': np.power,
+        '==': np.equal,
+        '!=': np.not_equal,
+        '<': np.less,
+        '>': np.greater,
+        '<=': np.less_equal,
+        '>=': np.greater_equal,
+    }
+
+    # Builtins with an element-wise NumPy equivalent, keyed by the builtin
+    # itself so a script that rebinds the name is not vectorized
+    MATH_UFUNCS = {
+        mathlib.sin: (np.sin,),
+        mathlib.cos: (np.cos,),
+        mathlib.tan: (np.tan,),
+        mathlib.exp: (np.exp,),
+        mathlib.sqrt: (np.sqrt,),
+        mathlib.log: (np.log, lambda x, base: np.log(x) / np.log(base)),
+        mathlib.pow: (None, np.power),
+    }
+
+
+class Fallback(Exception):
+    """Raised while running a plan when the loop must run in the interpreter."""
+
+
+class LoopVectorizer:
+    """
+    Find for loops that can run as one NumPy evaluation.
+
+    A loop qualifies when every statement of its body is either a reduction
+    into an accumulator (`acc = acc + e1 - e2 ...`, `acc = acc * e1 * e2 ...`,
+    or `acc = e + acc`, `acc = e * acc`) or an element-wise map
+    (`out.append(e)`), and no `e` reads a variable the loop writes. The
+    element expressions may use numbers, the loop variable, variables the
+    loop does not assign, `a[index]`, arithmetic, comparisons and math
+    builtins.
+
+    Unless `approximate` is set, loops using % or ^ or calling math
+    builtins run in the interpreter, so vectorizing never changes a
+    result; with it, those results may differ in the last bit.
+
+    A plan is nested tuples of plain values, so it can be stored in
+    bytecode constants. Whether it really applies is decided when the loop
+    runs, see run_plan().
+    """
+
+    def __init__(self, approximate=False):
+        self.approximate = approximate
+
+    def analyze(self, ast):
+        """Return {ForNode: plan} for every vectorizable loop in the program."""
+        plans = {}
+        stack = list(ast)
+        while stack:
+            node = stack.pop()
+            if isinstance(node, ForNode):
+                plan = self.plan(node)
+                if plan is not None:
+                    plans[node] = plan
+            if isinstance(node, (IfNode, WhileNode, ForNode, FuncDefNode)):
+                stack.extend(node.body)
+            if isinstance(node, IfNode) and node.else_body:
+                stack.extend(node.else_body)
+        return plans
+
+    def plan(self, node):
+        if not node.body:
+            return None
+        steps = []
+        written = {node.var_name}
+        for stmt in node.body:
+            step = self.plan_statement(stmt)
+            if step is None or step[1] in written:
+                return None
+            written.add(step[1])
+            steps.append(step)
+        self.written = written
+        self.var_name = node.var_name
+        try:
+            steps = tuple((kind, name, tuple(self.plan_expr(term) for term in terms))
+                          for kind, name, terms in steps)
+        except Fallback:
+            return None
+        return (node.var_name, steps)
+
+    def plan_element(self, var_name, expr):
+        """Plan one element expression of the index `var_name`, or None."""
+        self.written = {var_name}
+        self.var_name = var_name
+        try:
+            return self.plan_expr(expr)
+        except Fallback:
+            return None
+
+    def plan_statement(self, node):
+        """Return (kind, name, terms) for a reduction or map statement, or None."""
+        if isinstance(node, VarAssignNode) and isinstance(node.expr, BinOpNode):
+            name = node.var_name
+            expr = node.expr
+            op = expr.op_token.value
+            if self.is_var(expr.right_node, name) and op in ('+', '*'):
+                return ('product' if op == '*' else 'sum', name, (expr.left_node,))
+            kind = 'product' if op == '*' else 'sum'
+            ops = ('*',) if op == '*' else ('+', '-')
+            # ((acc + e1) - e2) + e3 adds e1, -e2, e3 in turn
+            terms = []
+            while isinstance(expr, BinOpNode) and expr.op_token.value in ops:
+                term = expr.right_node
+                if expr.op_token.value == '-':
+                    # acc - e == acc + (-e) exactly
+                    term = UnaryOpNode(Token('OP', '-'), term)
+                terms.append(term)
+                expr = expr.left_node
+            if terms and self.is_var(expr, name):
+                return (kind, name, tuple(reversed(terms)))
+        elif (isinstance(node, MethodCallNode) and node.method_name == 'append'
+              and isinstance(node.target, VarAccessNode) and len(node.args) == 1):
+            return ('append', node.target.var_name, (node.args[0],))
+        return None
+
+    def is_var(self, node, name):
+        return isinstance(node, VarAccessNode) and node.var_name == name
+
+    def plan_expr(self, node):
+        if isinstance(node, NumberNode):
+            return ('const', node.value)
+        elif isinstance(node, VarAccessNode):
+            if node.var_name != self.var_name and node.var_name in self.written:
+                raise Fallback  # loop-carried dependency
+            return ('var', node.var_name)
+        elif isinstance(node, IndexNode):
+            target = node.target
+            if (not isinstance(target, VarAccessNode) or isinstance(node.index, SliceNode)
+                    or target.var_name in self.written):
+                raise Fallback
+            return ('index', target.var_name, self.plan_expr(node.index))
+        elif isinstance(node, BinOpNode):
+            op = node.op_token.value
+            if op not in ARITHMETIC_OPS and op not in COMPARISON_OPS:
+                raise Fallback
+            if op in APPROXIMATE_OPS and not self.approximate:
+                raise Fallback
+            return ('binary', op, self.plan_expr(node.left_node), self.plan_expr(node.right_node))
+        elif isinstance(node, UnaryOpNode):
+            if node.op_token.value not in ('+', '-'):
+                raise Fallback
+            return ('unary', node.op_token.value, self.plan_expr(node.node))
+        elif isinstance(node, FuncCallNode):
+            if node.func_name in self.written or not self.approximate:
+                raise Fallback
+            return ('call', node.func_name, tuple(self.plan_expr(arg) for arg in node.args))
+        raise Fallback
+
+
+def plan_names(plan):
+    """Every variable and function name a plan may look up."""
+    names = {name for _, name, _ in plan[1]}
+    stack = [term for _, _, terms in plan[1] for term in terms]
+    while stack:
+        expr = stack.pop()
+        if expr[0] in ('var', 'index', 'call'):
+            names.add(expr[1])
+        if expr[0] == 'index':
+            stack.append(expr[2])
+        elif expr[0] == 'binary':
+            stack.extend(expr[2:])
+        elif expr[0] == 'unary':
+            stack.append(expr[2])
+        elif expr[0] == 'call':
+            stack.extend(expr[2])
+    return names
+
+
+def run_plan(plan, items, lookup):
+    """
+    Run a loop plan over `items` as one vectorized evaluation.
+
+    `lookup(name)` returns the value a variable or builtin has where the
+    loop runs, or None. Returns {name: value} of the variables the loop
+    leaves behind (accumulators and the loop variable), after appending to
+    the mapped arrays; returns None, having changed nothing, when the loop
+    must run in the interpreter instead: too short, not a range, operands
+    that are not numbers or arrays, an index out of range or not integral,
+    or any arithmetic that would raise or leave float64's exact range.
+
+    Sums and products are accumulated left to right, so results match the
+    interpreter exactly; math builtins, % and ^ (in plans made with
+    `approximate`) use NumPy's implementations, which may differ from the
+    math module in the last bit.
+    """
+    if np is None or type(items) is not range or len(items) < VECTOR_MIN_LENGTH:
+        return None
+    var_name, steps = plan
+    try:
+        with np.errstate(divide='raise', over='raise', invalid='raise', under='ignore'):
+            evaluator = PlanEvaluator(var_name, items, lookup)
+            results = [evaluator.step(kind, name, terms) for kind, name, terms in steps]
+    except (Fallback, FloatingPointError, ArithmeticError, ValueError, TypeError):
+        return None
+
+    targets = [target for kind, target, _ in results if kind == 'append']
+    if len({id(target) for target in targets}) != len(targets):
+        # Two names for one array: the appends would interleave
+        return None
+
+    updates = {}
+    for kind, name, value in results:
+        if kind == 'append':
+            name.extend(value)
+        else:
+            updates[name] = value
+    updates[var_name] = items[-1]
+    return updates
+
+
+class PlanEvaluator:
+    """
+    Evaluate plan expressions to (float64 array or scalar, is_int) pairs.
+
+    `items` gives the values of the variable `var_name`: a range of ints,
+    or any float64 array (the abscissae of an integral, say).
+    """
+
+    def __init__(self, var_name, items, lookup):
+        self.var_name = var_name
+        self.items = items
+        self.lookup = lookup
+        self.length = len(items)
+        if isinstance(items, range):
+            if max(abs(items[0]), abs(items[-1])) >= EXACT_INT_LIMIT:
+                raise Fallback
+            self.index = np.arange(items.start, items.stop, items.step, dtype=np.float64)
+            self.index_is_int = True
+        else:
+            self.index = np.asarray(items, dtype=np.float64)
+            self.index_is_int = False
+
+    def step(self, kind, name, terms):
+        columns = []
+        all_int = True
+        for term in terms:
+            value, is_int = self.evaluate(term)
+            columns.append(np.broadcast_to(np.asarray(value, dtype=np.float64), (self.length,)))
+            all_int = all_int and is_int
+        if kind == 'append':
+            target = self.lookup(name)
+            if not isinstance(target, Array):
+                raise Fallback
+            return (kind, target, columns[0])
+
+        start = self.lookup(name)
+        if type(start) not in (int, float):
+            raise Fallback
+        # Interleave the terms in execution order, iteration by iteration;
+        # accumulate() is strictly sequential, so every rounding step is the
+        # interpreter's
+        values = np.column_stack(columns).ravel() if len(columns) > 1 else columns[0]
+        ufunc = np.add if kind == 'sum' else np.multiply
+        partial = ufunc.accumulate(np.concatenate(([start], values)))
+        if type(start) is int:
+            # The interpreter computes with exact ints until a float appears
+            if np.abs(partial).max() >= EXACT_INT_LIMIT:
+                raise Fallback
+            if all_int:
+                return (kind, name, int(partial[-1]))
+        return (kind, name, float(partial[-1]))
+
+    def evaluate(self, expr):
+        kind = expr[0]
+        if kind == 'const':
+            return np.float64(expr[1]), type(expr[1]) is int
+        elif kind == 'var':
+            if expr[1] == self.var_name:
+                return self.index, self.index_is_int
+            return self.scalar(self.lookup(expr[1]))
+        elif kind == 'index':
+            return self.subscript(expr[1], expr[2])
+        elif kind == 'binary':
+            return self.binary(expr[1], self.evaluate(expr[2]), self.evaluate(expr[3]))
+        elif kind == 'unary':
+            value, is_int = self.evaluate(expr[2])
+            return (-value if expr[1] == '-' else value), is_int
+        elif kind == 'call':
+            return self.call(expr[1], [self.evaluate(arg)[0] for arg in expr[2]])
+        raise Fallback
+
+    def scalar(self, value):
+        if type(value) is float:
+            return np.float64(value), False
+        if type(value) in (int, bool):
+            if abs(value) >= EXACT_INT_LIMIT:
+                raise Fallback
+            return np.float64(value), True
+        raise Fallback
+
+    def subscript(self, name, index_expr):
+        target = self.lookup(name)
+        if not isinstance(target, Array):
+            raise Fallback
+        index, _ = self.evaluate(index_expr)
+        index = np.broadcast_to(index, (self.length,))
+        if not np.all(np.floor(index) == index):
+            raise Fallback
+        length = len(target)
+        if length == 0 or index.min() < -length or index.max() >= length:
+            raise Fallback
+        return target.values[index.astype(np.int64)], False
+
+    def binary(self, op, left, right):
+        left_value, left_int = left
+        right_value, right_int = right
+        result = BINARY_UFUNCS[op](left_value, right_value)
+        if op in COMPARISON_OPS:
+            # Python comparisons give bools, which add like 0 and 1
+            return np.asarray(result, dtype=np.float64), True
+        is_int = left_int and right_int and op != '/'
+        if is_int and op == '^' and np.any(right_value < 0):
+            is_int = False
+        if is_int and np.abs(result).max() >= EXACT_INT_LIMIT:
+            raise Fallback
+        return result, is_int
+
+    def call(self, name, args):
+        func = self.lookup(name)
+        variants = MATH_UFUNCS.get(func) if callable(func) else None
+        if not variants or not 1 <= len(args) <= len(variants) or variants[len(args) - 1] is None:
+            raise Fallback
+        return variants[len(args) - 1](*args), False